@@ -0,0 +1,131 @@
+"""
+    CommitDataFrame の通常の形と compact な形のメモリ使用量を比べる。
+    重なりのある2つの csv をまとめて読むときのピークメモリも、一度にすべて読む場合と比べる。
+
+    python benchmarks/bench_memory.py --commits 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import gilot
+from gilot.core import CommitDataFrame
+
+
+def synthetic_log(commits: int, authors: int, files: int, files_per_commit: int,
+                  seed: int = 0) -> CommitDataFrame:
+    # gilot log --full の出力と同じ列を持つデータを作る
+    rng = np.random.default_rng(seed)
+    names = np.array([f"src/module{i % 97}/file{i}.py" for i in range(files)])
+    counts = rng.integers(1, min(files_per_commit * 2, files), commits)
+    parents = np.repeat(np.arange(commits), counts)
+    # 1つのコミットの中でファイルが重複しないように、連続した番号のファイルを選ぶ
+    first = np.repeat(rng.integers(0, files, commits), counts)
+    offset = np.arange(len(parents)) - np.repeat(np.cumsum(counts) - counts, counts)
+    file_names = names[(first + offset) % files]
+    ins = rng.integers(0, 50, len(parents))
+    dels = rng.integers(0, 50, len(parents))
+    entries = [
+        f'"{n}": {{"insertions": {i}, "deletions": {d}, "lines": {i + d}, "change_type": "M"}}'
+        for n, i, d in zip(file_names, ins, dels)]
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    files_json = ["{" + ", ".join(entries[bounds[c]:bounds[c + 1]]) + "}" for c in range(commits)]
+    insertions = np.bincount(parents, weights=ins, minlength=commits).astype(np.int64)
+    deletions = np.bincount(parents, weights=dels, minlength=commits).astype(np.int64)
+    df = pd.DataFrame(dict(
+        date=pd.date_range("2015-01-01", periods=commits, freq="17min"),
+        hexsha=[f"{v:040x}" for v in rng.integers(0, 1 << 62, commits)],
+        author=rng.choice([f"author{i}" for i in range(authors)], commits),
+        insertions=insertions,
+        deletions=deletions,
+        lines=insertions + deletions,
+        files=counts,
+        files_json=files_json))
+    return CommitDataFrame.from_dataframe(df)
+
+
+def deep_size(df: CommitDataFrame) -> int:
+    size = df.memory_usage(deep=True).sum()
+    table = df.file_table
+    if table is not None:
+        size += table.drop(columns=["hexsha"]).memory_usage(deep=True).sum()
+        # compact なデータではコミット側とカテゴリを共有しているので、コードだけを数える
+        hexsha = table["hexsha"]
+        size += hexsha.cat.codes.nbytes if df.is_compact else hexsha.memory_usage(deep=True)
+    return int(size)
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.time()
+    result = run()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def read_all(paths):
+    # チャンクに分けず、すべてを読み込んでから重複を除く
+    df = pd.concat([pd.read_csv(p) for p in paths]).drop_duplicates(subset=["hexsha"])
+    return CommitDataFrame.from_dataframe(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commits", type=int, default=100000)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--files-per-commit", type=int, default=4)
+    args = parser.parse_args()
+
+    df = synthetic_log(args.commits, args.authors, args.files, args.files_per_commit)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "log.csv")
+        df.to_csv(path)
+        del df
+        print(f"{args.commits} commits, csv {os.path.getsize(path) / 2**20:.1f} MiB")
+        print("frame: size of the loaded data, load: gilot.from_csvs, "
+              "hotspot: from_csvs + expand_files + get_hotspots (twice, as gilot serve does)")
+        print(f"{'mode':<8} {'frame MiB':>10} {'load MiB':>9} {'load s':>7} "
+              f"{'hotspot MiB':>12} {'hotspot s':>10}")
+        for mode, compact in [("default", False), ("compact", True)]:
+            loaded, load_seconds, load_peak = measure(
+                lambda: gilot.from_csvs([path], compact=compact))
+            size = deep_size(loaded)
+            del loaded
+
+            def hotspot():
+                loaded = gilot.from_csvs([path], compact=compact)
+                for _ in range(2):
+                    gilot.get_hotspots(loaded.expand_files())
+            _, hotspot_seconds, hotspot_peak = measure(hotspot)
+            print(f"{mode:<8} {size / 2**20:>10.1f} {load_peak / 2**20:>9.1f} "
+                  f"{load_seconds:>7.2f} {hotspot_peak / 2**20:>12.1f} {hotspot_seconds:>10.2f}")
+
+        # 前半 2/3 と後半 2/3 に分けて、1/3 が重なる2つの csv を作る
+        df = pd.read_csv(path)
+        shards = [os.path.join(tmp, f"shard{i}.csv") for i in range(2)]
+        df.iloc[:len(df) * 2 // 3].to_csv(shards[0], index=False)
+        df.iloc[len(df) // 3:].to_csv(shards[1], index=False)
+        del df
+        print("combine: two csvs overlapping by a third")
+        print(f"{'mode':<8} {'load MiB':>9} {'load s':>7}")
+        peaks = dict()
+        for mode, run in [("read_all", lambda: read_all(shards)),
+                          ("chunked", lambda: gilot.from_csvs(shards))]:
+            loaded, seconds, peaks[mode] = measure(run)
+            assert len(loaded) == args.commits
+            del loaded
+            print(f"{mode:<8} {peaks[mode] / 2**20:>9.1f} {seconds:>7.2f}")
+        # チャンクごとに重複を除くので、重なった分を一度に抱えない
+        assert peaks["chunked"] < peaks["read_all"], "chunked from_csvs should peak lower"
+
+
+if __name__ == "__main__":
+    main()
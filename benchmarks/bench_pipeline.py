@@ -0,0 +1,181 @@
+"""
+    合成リポジトリに対して gilot の各段階の時間・スループット・ピークメモリを測る。
+    --save で結果を JSON に保存し、--baseline で前の結果と比べて遅くなった段階があれば失敗する。
+
+    python benchmarks/bench_pipeline.py --preset small --save bench.json
+    python benchmarks/bench_pipeline.py --preset small --baseline bench.json --max-slowdown 1.5
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import gilot
+from gilot.core import Duration
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_repo import RepoShape, add_shape_options, create_repo, shape_from_args  # NOQA
+
+# ホットスポットの時間減衰を固定して、毎回同じ結果にする
+NOW = datetime.datetime(2020, 7, 1)
+
+
+@dataclass
+class StageResult:
+    name: str
+    seconds: float
+    peak_mib: float
+    commits: int
+    file_rows: int
+
+    @property
+    def commits_per_second(self) -> float:
+        return self.commits / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.file_rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def measure(run: Callable[[], Any], repeat: int) -> tuple:
+    """
+        最も速かった時間と、別の1回で測ったピークメモリ (tracemalloc は遅くなるので時間とは分ける)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(seconds), peak / 2**20
+
+
+def run_stages(repo: str, shape: RepoShape, workdir: str, repeat: int, jobs: int,
+               renames: bool = False) -> List[StageResult]:
+    from gilot.cochange import build_hotgraph
+    from gilot.hotgraph import hotgraph_figure
+    from gilot.plotter import _count_commits
+    from gilot.render import figure_to_bytes
+
+    since = datetime.date.fromisoformat(shape.since)
+    until = since + datetime.timedelta(days=shape.days + 1)
+    duration = Duration.range(since.isoformat(), until.isoformat())
+    csv = os.path.join(workdir, "log.csv")
+    results: List[StageResult] = []
+
+    def stage(name: str, run: Callable[[], Any], commits: int = 0, file_rows: int = 0,
+              times: Optional[int] = None) -> Any:
+        result, seconds, peak = measure(run, times or repeat)
+        results.append(StageResult(name, round(seconds, 4), round(peak, 1), commits, file_rows))
+        print(f"  {name}: {seconds:.3f}s", file=sys.stderr)
+        return result
+
+    # git log は重いので1回だけ測る
+    df = stage("from_dir", lambda: gilot.from_dir(
+        repo, branch="main", duration=duration, full=True, jobs=jobs, renames=renames), times=1)
+    df.to_csv(csv)
+    commits = len(df)
+    rows = int(df["files"].sum())
+    results[-1].commits, results[-1].file_rows = commits, rows
+
+    df = stage("from_csvs", lambda: gilot.from_csvs([csv]), commits, rows)
+    expanded = stage("expand_files", lambda: df.expand_files(), commits, rows)
+    if renames:
+        stage("follow_renames", lambda: df.expand_files(follow_renames=True), commits, rows)
+    stage("filter_files", lambda: df.filter_files(lambda f: f.endswith(".py")), commits, rows)
+    stage("get_hotspots", lambda: gilot.get_hotspots(expanded, now=NOW), commits, len(expanded))
+    stage("info", lambda: gilot.info(df), commits)
+    stage("count_commits", lambda: _count_commits(df, top=15), commits)
+    g = stage("hotgraph_build", lambda: build_hotgraph(expanded, max_nodes=200),
+              commits, len(expanded))
+    if g is not None:
+        stage("hotgraph_render",
+              lambda: figure_to_bytes(hotgraph_figure(g, layout="spring"), dpi=50))
+    return results
+
+
+def compare(results: List[StageResult], baseline: Dict[str, Any],
+            max_slowdown: float) -> List[str]:
+    before = {s["name"]: s for s in baseline["stages"]}
+    slower = []
+    for r in results:
+        if r.name in before and before[r.name]["seconds"] > 0:
+            ratio = r.seconds / before[r.name]["seconds"]
+            if ratio > max_slowdown:
+                slower.append(f"{r.name} is {ratio:.2f}x slower "
+                              f"({before[r.name]['seconds']:.3f}s -> {r.seconds:.3f}s)")
+    return slower
+
+
+def print_table(results: List[StageResult], baseline: Optional[Dict[str, Any]] = None) -> None:
+    before = {s["name"]: s["seconds"] for s in baseline["stages"]} if baseline else dict()
+    header = f"{'stage':<16} {'seconds':>9} {'commits/s':>11} {'rows/s':>11} {'peak MiB':>9}"
+    print(header + ("  vs baseline" if before else ""))
+    for r in results:
+        row = (f"{r.name:<16} {r.seconds:>9.3f} {r.commits_per_second:>11,.0f} "
+               f"{r.rows_per_second:>11,.0f} {r.peak_mib:>9.1f}")
+        if before.get(r.name):
+            row += f"  {r.seconds / before[r.name]:>6.2f}x"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_shape_options(parser)
+    parser.add_argument("--repo",
+                        help="reuse a repository made by synthetic_repo.py with the same shape")
+    parser.add_argument("--repeat", type=int, default=3, help="report the fastest of REPEAT runs")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="jobs for from_dir")
+    parser.add_argument("--renames", action="store_true",
+                        help="extract with rename detection and "
+                             "measure expand_files(follow_renames=True)")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON written by --save to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="fail when a stage is slower than the baseline by this ratio")
+    args = parser.parse_args()
+    shape = shape_from_args(args)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        repo = args.repo
+        if repo is None:
+            repo = os.path.join(workdir, "repo")
+            start = time.time()
+            create_repo(repo, shape)
+            print(f"generated {shape.commits} commits in {time.time() - start:.1f}s",
+                  file=sys.stderr)
+        results = run_stages(repo, shape, workdir, args.repeat, args.jobs, renames=args.renames)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict(
+                shape=asdict(shape),
+                python=platform.python_version(),
+                created_at=datetime.datetime.now().isoformat(timespec="seconds"),
+                stages=[asdict(r) for r in results]), f, indent=4)
+    if baseline:
+        slower = compare(results, baseline, args.max_slowdown)
+        for message in slower:
+            print(message, file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
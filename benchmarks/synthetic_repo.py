@@ -0,0 +1,253 @@
+"""
+    ベンチマーク用の合成 git リポジトリを git fast-import で作る。
+    作業ツリーは作らず (bare)、main と origin/HEAD を設定するので gilot log がそのまま使える。
+
+    python benchmarks/synthetic_repo.py /tmp/synthetic --preset medium
+    python benchmarks/synthetic_repo.py /tmp/synthetic --commits 5000 --rename-rate 0.05
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import time
+from dataclasses import asdict, dataclass, fields, replace
+from typing import IO, Dict, List
+
+import numpy as np
+
+EXTENSIONS = [".py", ".py", ".py", ".js", ".ts", ".md", ".lock"]
+# 1つのコミットで変更するファイルを選ぶ範囲 (作られた順に並べたときの幅)
+COCHANGE_WINDOW = 12
+
+
+@dataclass
+class RepoShape:
+    commits: int = 2000
+    # 最初のコミットで作るファイル数
+    files: int = 400
+    files_per_commit: int = 4
+    authors: int = 20
+    # コミットごとにファイルを1つリネームする確率
+    rename_rate: float = 0.02
+    # サイドブランチのコミットとマージコミットの組を作る確率
+    merge_rate: float = 0.05
+    # コミットごとにファイルを1つ追加する確率
+    add_rate: float = 0.05
+    lines_per_file: int = 60
+    since: str = "2020-01-01"
+    days: int = 180
+    seed: int = 0
+
+
+PRESETS: Dict[str, RepoShape] = {
+    "small": RepoShape(commits=2000, files=400, authors=20),
+    "medium": RepoShape(commits=20000, files=3000, authors=150),
+    "large": RepoShape(commits=100000, files=20000, authors=800),
+}
+
+
+class _History:
+    """
+        ファイルの中身 (行番号の配列) を持ちながら fast-import のストリームを書く
+    """
+
+    def __init__(self, shape: RepoShape, out: IO[bytes]):
+        self.shape = shape
+        self.out = out
+        self.rng = np.random.default_rng(shape.seed)
+        self.contents: Dict[str, np.ndarray] = dict()
+        self.paths: List[str] = []
+        self.next_file = 0
+        self.next_line = 0
+        self.mark = 0
+        self.commits = 0
+        start = datetime.datetime.fromisoformat(shape.since).replace(tzinfo=datetime.timezone.utc)
+        self.start = int(start.timestamp())
+        self.authors = [f"author{i:04d}" for i in range(shape.authors)]
+        # 少数の作者がコミットの大半を占めるようにする
+        weights = 1.0 / np.arange(1, shape.authors + 1)
+        self.author_weights = weights / weights.sum()
+
+    def _lines(self, n: int) -> np.ndarray:
+        lines = np.arange(self.next_line, self.next_line + n)
+        self.next_line += n
+        return lines
+
+    def _new_path(self) -> str:
+        i = self.next_file
+        self.next_file += 1
+        ext = EXTENSIONS[i % len(EXTENSIONS)]
+        return f"src/pkg{i % 37}/module{i}{ext}"
+
+    def _write(self, text: str) -> None:
+        self.out.write(text.encode("utf-8"))
+
+    def _data(self, data: bytes) -> None:
+        self._write(f"data {len(data)}\n")
+        self.out.write(data)
+        self._write("\n")
+
+    def _modify(self, path: str) -> None:
+        lines = self.contents[path]
+        self._write(f"M 100644 inline {path}\n")
+        self._data(("\n".join(map(str, lines.tolist())) + "\n").encode("ascii"))
+
+    def _edit(self, path: str) -> None:
+        # 数行を書き換え、何行かを足すか消す
+        lines = self.contents[path].copy()
+        rng = self.rng
+        changed = rng.integers(1, max(2, len(lines) // 8))
+        positions = rng.choice(len(lines), size=min(changed, len(lines)), replace=False)
+        lines[positions] = self._lines(len(positions))
+        grow = int(rng.integers(-3, 8))
+        if grow > 0:
+            lines = np.insert(lines, int(rng.integers(0, len(lines) + 1)), self._lines(grow))
+        elif grow < 0 and len(lines) > 10:
+            lines = np.delete(lines, rng.choice(len(lines), size=-grow, replace=False))
+        self.contents[path] = lines
+        self._modify(path)
+
+    def _commit(self, ref: str, *, parent: int = 0, merge: int = 0) -> int:
+        self.mark += 1
+        self.commits += 1
+        span = self.shape.days * 86400
+        when = self.start + int(span * self.commits / max(self.shape.commits, 1))
+        author = self.authors[self.rng.choice(len(self.authors), p=self.author_weights)]
+        ident = f"{author} <{author}@example.com> {when} +0000"
+        self._write(f"commit {ref}\nmark :{self.mark}\nauthor {ident}\ncommitter {ident}\n")
+        self._data(f"commit {self.commits}".encode("ascii"))
+        if parent:
+            self._write(f"from :{parent}\n")
+        if merge:
+            self._write(f"merge :{merge}\n")
+        return self.mark
+
+    def _pick(self, n: int) -> List[str]:
+        n = min(n, len(self.paths))
+        return [self.paths[i] for i in self.rng.choice(len(self.paths), size=n, replace=False)]
+
+    def _pick_related(self, n: int) -> List[str]:
+        # 実際の履歴のように、近くで作られたファイルをまとめて変更し、古いファイルほどよく変更する。
+        # 一様に選ぶと同時変更がほとんど重ならず、hotgraph が空になる
+        window = max(COCHANGE_WINDOW, 2 * n)
+        start = int((len(self.paths) - 1) * self.rng.random() ** 2)
+        candidates = self.paths[start:start + window]
+        n = min(n, len(candidates))
+        return [candidates[i] for i in self.rng.choice(len(candidates), size=n, replace=False)]
+
+    def initial(self) -> int:
+        mark = self._commit("refs/heads/main")
+        for _ in range(self.shape.files):
+            path = self._new_path()
+            self.paths.append(path)
+            self.contents[path] = self._lines(self.shape.lines_per_file)
+            self._modify(path)
+        self._write("\n")
+        return mark
+
+    def change(self, ref: str, parent: int = 0) -> int:
+        shape = self.shape
+        rng = self.rng
+        mark = self._commit(ref, parent=parent)
+        # マージコミットで同じ変更を繰り返せるように、リネームと変更したファイルを覚えておく
+        self.renamed: List[str] = []
+        self.touched: List[str] = []
+        for path in self._pick_related(int(rng.integers(1, 2 * shape.files_per_commit))):
+            self._edit(path)
+            self.touched.append(path)
+        if rng.random() < shape.rename_rate:
+            # 中身を少しだけ変えてリネームする (git のリネーム検出に掛かるように)
+            old = self._pick(1)[0]
+            new = self._new_path()
+            self._write(f"R {old} {new}\n")
+            self.paths[self.paths.index(old)] = new
+            self.contents[new] = self.contents.pop(old)
+            self._edit(new)
+            self.renamed.append(f"R {old} {new}\n")
+            self.touched = [new if t == old else t for t in self.touched] + [new]
+        if rng.random() < shape.add_rate:
+            path = self._new_path()
+            self.paths.append(path)
+            self.contents[path] = self._lines(int(rng.integers(5, shape.lines_per_file * 2)))
+            self._modify(path)
+            self.touched.append(path)
+        self._write("\n")
+        return mark
+
+    def merged(self, head: int) -> int:
+        # head から分岐したサイドブランチのコミットを、main にマージする。
+        # main はその間に進まないので、マージ後のツリーはサイドブランチと同じになる
+        side = self.change("refs/heads/side", parent=head)
+        mark = self._commit("refs/heads/main", parent=head, merge=side)
+        for op in self.renamed:
+            self._write(op)
+        for path in dict.fromkeys(self.touched):
+            self._modify(path)
+        self._write("\n")
+        return mark
+
+    def run(self) -> None:
+        head = self.initial()
+        while self.commits < self.shape.commits:
+            room = self.commits + 2 <= self.shape.commits
+            if room and self.rng.random() < self.shape.merge_rate:
+                head = self.merged(head)
+            else:
+                head = self.change("refs/heads/main", parent=head)
+        self._write("done\n")
+
+
+def _git(path: str, *args: str) -> None:
+    subprocess.run(["git", "-C", path, *args], check=True)
+
+
+def create_repo(path: str, shape: RepoShape) -> str:
+    """
+        path に shape の形の履歴を持つ bare リポジトリを作り、path を返す
+    """
+    if os.path.exists(path) and os.listdir(path):
+        raise FileExistsError(f"{path} is not empty")
+    os.makedirs(path, exist_ok=True)
+    _git(path, "init", "--quiet", "--bare")
+    proc = subprocess.Popen(
+        ["git", "-C", path, "fast-import", "--quiet", "--done"], stdin=subprocess.PIPE)
+    assert proc.stdin is not None
+    with proc.stdin as stdin:
+        _History(shape, stdin).run()
+    if proc.wait() != 0:
+        raise RuntimeError(f"git fast-import failed with {proc.returncode}")
+    _git(path, "symbolic-ref", "HEAD", "refs/heads/main")
+    # gilot log の既定のブランチ (origin/HEAD) でも読めるようにする
+    _git(path, "update-ref", "refs/remotes/origin/main", "refs/heads/main")
+    _git(path, "symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/main")
+    return path
+
+
+def shape_from_args(args) -> RepoShape:
+    shape = PRESETS[args.preset]
+    overrides = {f.name: getattr(args, f.name) for f in fields(RepoShape)
+                 if getattr(args, f.name, None) is not None}
+    return replace(shape, **overrides)
+
+
+def add_shape_options(parser) -> None:
+    parser.add_argument("--preset", choices=list(PRESETS), default="small")
+    for f in fields(RepoShape):
+        parser.add_argument("--" + f.name.replace("_", "-"), type=type(f.default), default=None,
+                            help=f"override the preset (small: {f.default})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    add_shape_options(parser)
+    args = parser.parse_args()
+    shape = shape_from_args(args)
+    start = time.time()
+    create_repo(args.path, shape)
+    print(f"created {args.path} in {time.time() - start:.1f}s: {asdict(shape)}")
+
+
+if __name__ == "__main__":
+    main()
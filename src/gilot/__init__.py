@@ -1,5 +1,31 @@
+from importlib import import_module
 
-from .core import from_csv, from_csvs, from_dir  # NOQA
-from .hotgraph import plot_hotgraph  # NOQA
-from .hotspot import get_hotspots  # NOQA
-from .plotter import info, plot ,authors  # NOQA
+from .core import append_dir, from_csv, from_csvs, from_dir  # NOQA
+from .timings import collect, profile  # NOQA
+
+# matplotlib などの重いモジュールは、使われたときに初めて読み込む (PEP 562)
+_LAZY_ATTRS = {
+    "plot_hotgraph": "hotgraph",
+    "hotgraph_figure": "hotgraph",
+    "get_hotspots": "hotspot",
+    "info": "plotter",
+    "plot": "plotter",
+    "authors": "plotter",
+    "plot_figure": "plotter",
+    "authors_figure": "plotter",
+    "figure_to_bytes": "render",
+}
+
+__all__ = ["append_dir", "from_csv", "from_csvs", "from_dir", "collect", "profile", *_LAZY_ATTRS]
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(import_module(f".{_LAZY_ATTRS[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY_ATTRS])
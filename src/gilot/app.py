@@ -1,16 +1,27 @@
-from gilot.core import Duration
+from gilot.cache import DEFAULT_MAX_SIZE, StatsCache
+from gilot.core import REPO_COLUMN, SUMMARY_COLUMNS, CommitDataFrame, Duration, to_pathspecs
+from gilot.filters import compose_filter
+from gilot.timings import Timings, collect, profile
 import argparse
 import json
 import logging
+import os
 import sys
-from fnmatch import fnmatch
 from logging import getLogger
-from typing import Callable, List, Optional
+from typing import List, Optional, Tuple
+
+import pandas as pd
 
 import gilot
 
 logger = getLogger(__name__)
 
+# gilot hotgraph の選択肢。networkx などを読み込まずに引数を解釈できるようにここで持つ
+LAYOUTS = ["auto", "spring", "spectral", "multilevel"]
+EXPORT_FORMATS = ["graphml", "json", "csv"]
+# gilot report の画像の形式 (gilot.report.REPORT_FORMATS と同じ)
+REPORT_FORMATS = ["png", "svg"]
+
 parser = argparse.ArgumentParser(description="""
 gilot is a tool for analyzing and visualizing git logs
 
@@ -39,19 +50,31 @@ def add_logging_option(parser):
     parser.add_argument("-v","--verbose",action="count",default=0,help="increase log level")
 
 
-def compose_filter(allow: Optional[List[str]], deny: Optional[List[str]]) -> Callable[[str], bool]:
-    allow_list = allow or ["*"]
-    deny_list = deny or []
+def add_instrument_option(parser):
+    parser.add_argument(
+        "--timings",
+        nargs="?",
+        const="",
+        metavar="JSON",
+        help="""
+        measure the wall time, rows in/out and peak RSS of each stage.
+        The table is printed on stderr, or written as JSON to JSON ('-' for stdout)""")
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="""
+        run the command under cProfile and write the stats to FILE
+        (see `python -m pstats FILE`)""")
 
-    def match(file_name: str) -> bool:
-        # いずれかのallow条件にmatchするか
-        is_allowed = any(fnmatch(file_name, p) for p in allow_list)
-        # いずれかのdeny条件にmatchするか
-        is_denyed = any(fnmatch(file_name, p) for p in deny_list)
-        # 許可されており、拒否リストに含まれていない。
-        return (is_allowed and not is_denyed)
 
-    return match
+def write_timings(timings: Timings, output: str) -> None:
+    if output == "":
+        print(timings.format_table(), file=sys.stderr)
+    elif output == "-":
+        print(timings.to_json())
+    else:
+        with open(output, "w") as f:
+            f.write(timings.to_json())
 
 
 def args_to_duration(args) -> Duration:
@@ -67,23 +90,95 @@ def args_to_duration(args) -> Duration:
     return Duration.months(6)
 
 
+def args_to_cache(args) -> Optional[StatsCache]:
+    if not (args.cache or args.cache_dir):
+        return None
+    return StatsCache.for_repo(args.repo, cache_dir=args.cache_dir)
+
+
 def handle_log(args) -> None:
     init_logger(args)
     duration = args_to_duration(args)
-    df = gilot.from_dir(
-        args.repo,
+    cache = args_to_cache(args)
+    pathspecs = to_pathspecs(args.allow_files, args.ignore_files)
+    if (args.append):
+        df = gilot.append_dir(
+            gilot.from_csvs([args.append]),
+            args.repo,
+            branch=args.branch,
+            duration=duration,
+            full=args.full,
+            cache=cache,
+            jobs=args.jobs,
+            pathspecs=pathspecs,
+            renames=args.renames
+        )
+    else:
+        df = gilot.from_dir(
+            args.repo,
+            branch=args.branch,
+            duration=duration,
+            full=args.full,
+            cache=cache,
+            jobs=args.jobs,
+            pathspecs=pathspecs,
+            renames=args.renames
+        )
+    df.save(args.output)
+
+
+def handle_log_many(args) -> None:
+    init_logger(args)
+    from gilot.batch import ExtractOptions, extract_many, format_results, read_manifest, to_specs
+    entries = [*(read_manifest(args.manifest) if args.manifest else []), *args.repos]
+    if not entries:
+        parser.error("log-many needs REPO or --manifest")
+    try:
+        specs = to_specs(entries)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = ExtractOptions(
         branch=args.branch,
-        duration=duration,
-        full=args.full
-    )
-    df.to_csv(args.output)
+        duration=args_to_duration(args),
+        full=args.full,
+        jobs=args.jobs,
+        pathspecs=to_pathspecs(args.allow_files, args.ignore_files),
+        renames=args.renames,
+        cache=args.cache,
+        cache_dir=args.cache_dir)
+    df, results = extract_many(
+        specs,
+        options,
+        workers=args.workers,
+        output_dir=args.output_dir,
+        extension="." + args.format)
+    if df is not None:
+        df.save(args.output)
+    print(format_results(results), file=sys.stderr)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+def handle_cache(args) -> None:
+    init_logger(args)
+    max_size = int(args.max_size * 1024 * 1024) if args.max_size is not None else DEFAULT_MAX_SIZE
+    cache = StatsCache.for_repo(args.repo, cache_dir=args.cache_dir, max_size=max_size)
+    if (args.command == "prune"):
+        removed = cache.prune()
+        logger.info(f"{removed} commits are removed")
+    print(json.dumps(cache.stats(), indent=4, sort_keys=False))
 
 
-def handle_plot(args) -> None:
+def handle_serve(args) -> None:
     init_logger(args)
-    df = gilot.from_csvs(args.input)
-    if (args.allow_files or args.ignore_files):
-        df = df.filter_files(compose_filter(allow=args.allow_files,deny=args.ignore_files))
+    from gilot.server import serve
+    serve(args.host, args.port, data_dir=args.data_dir, workers=args.workers,
+          max_datasets=args.max_datasets, compact=args.compact)
+
+
+def handle_plot(args) -> None:
+    df = _load_df(args)
     if len(df) == 0:
         logger.warning("No data to plot")
         return
@@ -92,14 +187,33 @@ def handle_plot(args) -> None:
 
 def _load_df(args):
     init_logger(args)
-    df = gilot.from_csvs(args.input)
-    if (args.allow_files or args.ignore_files):
-        df = df.filter_files(compose_filter(allow=args.allow_files, deny=args.ignore_files))
-    return df
+    if not (args.allow_files or args.ignore_files):
+        # ファイルで絞り込まない集計では files_json を読み込まない
+        return gilot.from_csvs(args.input, columns=SUMMARY_COLUMNS, compact=args.compact)
+    df = gilot.from_csvs(args.input, compact=args.compact)
+    return df.filter_files(compose_filter(allow=args.allow_files, deny=args.ignore_files))
+
+
+def require_repo_column(df: CommitDataFrame) -> None:
+    if REPO_COLUMN not in df.columns:
+        parser.error(f"--by-repo needs data with a '{REPO_COLUMN}' column (see gilot log-many)")
+
+
+def split_by_repo(df: CommitDataFrame) -> List[Tuple[str, CommitDataFrame]]:
+    # gilot log-many でまとめたデータを、repo 列ごとに分ける
+    require_repo_column(df)
+    return [
+        (str(name), CommitDataFrame(df[df[REPO_COLUMN] == name]).with_file_table(df.file_table))
+        for name in pd.unique(df[REPO_COLUMN])]
 
 
 def handle_info(args) -> None:
     df = _load_df(args)
+    if args.by_repo:
+        result = {name: gilot.info(sub, timeslot=args.timeslot)
+                  for name, sub in split_by_repo(df) if len(sub) > 0}
+        print(json.dumps(result, indent=4, sort_keys=False))
+        return
     if len(df) == 0:
         logger.warning("No data to analyze")
         print(json.dumps({
@@ -117,32 +231,73 @@ def handle_info(args) -> None:
 
 def handle_hotspot(args) -> None:
     init_logger(args)
-    df = gilot.from_csvs(args.input)
-    result = gilot.get_hotspots(
-        df.expand_files(
-            compose_filter(
-                allow=args.allow_files,
-                deny=args.ignore_files)))
+    df = gilot.from_csvs(args.input, compact=args.compact)
+    expanded = df.expand_files(
+        compose_filter(
+            allow=args.allow_files,
+            deny=args.ignore_files),
+        follow_renames=args.follow_renames)
+    if args.by_repo:
+        results = [
+            gilot.get_hotspots(sub).assign(**{REPO_COLUMN: name})
+            for name, sub in split_by_repo(expanded) if len(sub) > 0]
+        result = pd.concat(results) if results else gilot.get_hotspots(expanded)
+        top = (result.groupby(REPO_COLUMN, sort=False).head(args.num) if results
+               else result[:args.num])
+    else:
+        result = gilot.get_hotspots(expanded)
+        top = result[:args.num]
     if(args.csv) :
         result.to_csv(args.output)
     else :
-        pretty_print_hotspot(result[:args.num])
+        pretty_print_hotspot(top)
 
 
 def handle_author(args) -> None:
-    init_logger(args)
-    df = gilot.from_csvs(args.input)
-    if (args.allow_files or args.ignore_files):
-        df = df.filter_files(compose_filter(allow=args.allow_files,deny=args.ignore_files))
+    df = _load_df(args)
+    if args.by_repo:
+        # 作者の代わりにリポジトリごとに積み上げる
+        require_repo_column(df)
+        df = df.assign(author=df[REPO_COLUMN])
 
     gilot.authors(df, output=args.output, name=args.name,top=args.top,only=args.only)
 
 
+def hotgraph_format(args) -> Optional[str]:
+    """
+        描画せずに書き出す形式。--format, --csv, 出力ファイルの拡張子の順に決める。
+    """
+    if args.format:
+        return args.format
+    if args.csv:
+        return "csv"
+    if isinstance(args.output, str):
+        ext = os.path.splitext(args.output)[1].lower().lstrip(".")
+        if ext in EXPORT_FORMATS:
+            return ext
+    return None
+
+
 def handle_hotgraph(args) -> None:
     init_logger(args)
-    df = gilot.from_csvs(args.input)
+    df = gilot.from_csvs(args.input, compact=args.compact)
     is_match = compose_filter(allow=args.allow_files,deny=args.ignore_files)
-    epanded_df = df.expand_files(is_match)
+    epanded_df = df.expand_files(is_match, follow_renames=args.follow_renames)
+    fmt = hotgraph_format(args)
+    if fmt:
+        from gilot.cochange import build_hotgraph, export_hotgraph
+        g = build_hotgraph(
+            epanded_df,
+            rank=args.rank,
+            max_nodes=args.max_nodes,
+            max_edges=args.max_edges,
+            seed=args.seed)
+        if g is not None:
+            export_hotgraph(g, args.output or sys.stdout, fmt)
+        return
+
+    from gilot.layout import LayoutCache
+    layout_cache = LayoutCache(args.layout_cache) if args.layout_cache else None
     gilot.plot_hotgraph(
         epanded_df,
         output_file_name=args.output,
@@ -150,7 +305,39 @@ def handle_hotgraph(args) -> None:
         stop_retry=args.stop_retry,
         k=args.k,
         font_size=args.font_size,
-        newline=args.newline)
+        newline=args.newline,
+        max_nodes=args.max_nodes,
+        max_edges=args.max_edges,
+        layout=args.layout,
+        seed=args.seed,
+        layout_cache=layout_cache)
+
+
+def handle_report(args) -> None:
+    init_logger(args)
+    from gilot.report import ReportOptions, make_report
+    options = ReportOptions(
+        name=args.name,
+        timeslot=args.timeslot,
+        fmt=args.format,
+        top=args.top,
+        rank=args.rank,
+        max_nodes=args.max_nodes,
+        max_edges=args.max_edges,
+        k=args.k,
+        layout=args.layout,
+        seed=args.seed,
+        layout_cache=args.layout_cache,
+        workers=args.workers)
+    is_match = None
+    if args.allow_files or args.ignore_files:
+        is_match = compose_filter(allow=args.allow_files, deny=args.ignore_files)
+    metadata = make_report(args.input, args.output_dir, options, is_match=is_match,
+                           compact=args.compact, follow_renames=args.follow_renames)
+    if metadata is None:
+        logger.warning("No data to report")
+        return
+    print(json.dumps(metadata, indent=4, sort_keys=False))
 
 
 def pretty_print_hotspot(df) -> None:
@@ -159,7 +346,8 @@ def pretty_print_hotspot(df) -> None:
     gilot hotspot ( https://github.com/hirokidaichi/gilot )
 ------------------------------------------------------------
     """)
-    targets = ["hotspot","commits","authors","file_name"]
+    by_repo = REPO_COLUMN in df.columns
+    targets = ["hotspot","commits","authors",*([REPO_COLUMN] if by_repo else []),"file_name"]
     columns_text = " ".join([f"{t:>8}" for t in targets])
     print(columns_text)
     for k,v in df.iterrows():
@@ -167,7 +355,7 @@ def pretty_print_hotspot(df) -> None:
         hotspot = "{:.2f}".format(v["hotspot"])
         commits = "{:6d}".format(int(v["commits"]))
         authors = "{:6d}".format(int(v["authors"]))
-        row = [hotspot,commits,authors,k]
+        row = [hotspot,commits,authors,*([v[REPO_COLUMN]] if by_repo else []),k]
         print(" ".join([f"{c:>8}" for c in row]))
 
 
@@ -177,7 +365,8 @@ def add_file_filter_option(parser):
         nargs="*",
         help="""
         Specify the files to allow.
-        You can specify more than one like 'src/*' '*.rb'. Only data with the --full flag is valid.""")
+        You can specify more than one like 'src/*' '*.rb'. Only data with the --full flag is valid.
+        Patterns match the whole file path like fnmatch ('*' also matches '/') in every command.""")
 
     parser.add_argument(
         "--ignore-files",
@@ -187,6 +376,24 @@ def add_file_filter_option(parser):
         You can specify more than one like 'dist/*' '*.gen.java'. Only data with the --full flag is valid.""")
 
 
+def add_compact_option(parser):
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="""
+        keep the data in a compact form (categorical author and hexsha, int32 counts,
+        shared file table) to reduce memory for large histories""")
+
+
+def add_follow_renames_option(parser):
+    parser.add_argument(
+        "--follow-renames",
+        action="store_true",
+        help="""
+        count a renamed file under its newest name instead of as separate files.
+        Only data with the --full flag is valid.""")
+
+
 def add_author_filter_option(parser):
     parser.add_argument(
         "--allow-authors",
@@ -203,6 +410,12 @@ def add_author_filter_option(parser):
         You can specify more than one like 'dist/*' '*.gen.java'. Only data with the --full flag is valid.""")
 
 
+def add_cache_dir_option(parser):
+    parser.add_argument(
+        "--cache-dir",
+        help="directory of the per-commit stats cache. default is .git/gilot/ of the repository")
+
+
 def add_log_option(parser):
     """
         gilot log コマンドのオプション
@@ -220,6 +433,23 @@ def add_log_option(parser):
         "-o", "--output",
         default=sys.__stdout__)
 
+    parser.add_argument(
+        "--append",
+        metavar="CSV",
+        help="""
+        Existing csv of the same repository. Only commits newer than it are extracted,
+        and the merged result trimmed to the period is output.""")
+
+    add_extract_options(parser)
+
+    parser.set_defaults(handler=handle_log)
+    return parser
+
+
+def add_extract_options(parser):
+    """
+        gilot log と gilot log-many に共通する、コミットを取り出す範囲と方法のオプション
+    """
     parser.add_argument(
         "--since",
         help="SINCE must be ISO format like 2020-01-01.")
@@ -237,7 +467,73 @@ def add_log_option(parser):
         action="store_true",
         help="If this flag is enabled, detailed data including the commuted file name will be output.")
 
-    parser.set_defaults(handler=handle_log)
+    parser.add_argument(
+        "--renames",
+        action="store_true",
+        help="""
+        detect renamed files and record them as 'OLD => NEW' (use with --full).
+        hotspot / hotgraph --follow-renames then count them under the newest name.""")
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes to extract commits. the output does not depend on it")
+
+    add_cache_dir_option(parser)
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse per-commit stats cached in .git/gilot/ (or --cache-dir).")
+
+    # git の pathspec として渡し、対象外のファイルは最初から取り出さない
+    add_file_filter_option(parser)
+
+
+def add_log_many_option(parser):
+    """
+        gilot log-many コマンドのオプション
+    """
+    parser.add_argument(
+        'repos',
+        nargs="*",
+        metavar="REPO",
+        help='root dirs of git repositories')
+
+    parser.add_argument(
+        "-m", "--manifest",
+        help="file listing one repository per line as PATH or PATH<TAB>NAME")
+
+    parser.add_argument(
+        "-b", "--branch",
+        help="target branch name. default 'origin/HEAD' ",
+        default="origin/HEAD")
+
+    parser.add_argument(
+        "-o", "--output",
+        default=sys.__stdout__,
+        help="combined csv/parquet/feather with a 'repo' column")
+
+    parser.add_argument(
+        "-d", "--output-dir",
+        help="write one file per repository (NAME.csv) into this directory instead")
+
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet", "feather"],
+        default="csv",
+        help="file format for --output-dir")
+
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=4,
+        help="number of repositories extracted at the same time")
+
+    add_extract_options(parser)
+
+    parser.set_defaults(handler=handle_log_many)
     return parser
 
 
@@ -266,6 +562,7 @@ def add_plot_option(parser):
         help="name")
 
     add_file_filter_option(parser)
+    add_compact_option(parser)
     parser.set_defaults(handler=handle_plot)
     return parser
 
@@ -284,7 +581,13 @@ def add_info_option(parser):
         help="resample period like 2W or 7D or 1M ",
         default="2W")
 
+    parser.add_argument(
+        "--by-repo",
+        action="store_true",
+        help="output info for each repository of data made by 'gilot log-many'")
+
     add_file_filter_option(parser)
+    add_compact_option(parser)
 
     parser.set_defaults(handler=handle_info)
     return parser
@@ -313,7 +616,14 @@ def add_hotspot_option(parser):
         "-o", "--output",
         default=sys.__stdout__)
 
+    parser.add_argument(
+        "--by-repo",
+        action="store_true",
+        help="rank files for each repository of data made by 'gilot log-many'")
+
     add_file_filter_option(parser)
+    add_follow_renames_option(parser)
+    add_compact_option(parser)
 
     parser.set_defaults(handler=handle_hotspot)
     return parser
@@ -333,15 +643,36 @@ def add_hotgraph_option(parser):
         type=int,
         default=70)
 
-    # 10秒以上かかる処理だった場合に自動的に閾値を引き上げてリトライする。
+    # 指定すると --rank の代わりに、この大きさに収まる最小の閾値を選ぶ
+    parser.add_argument(
+        "--max-nodes",
+        type=int,
+        default=None,
+        help="choose the smallest threshold which keeps the graph within this number of files")
+
+    parser.add_argument(
+        "--max-edges",
+        type=int,
+        default=None,
+        help="choose the smallest threshold which keeps the graph within this number of pairs")
+
+    # 互換性のために残している。同時変更の集計は打ち切らずに最後まで行う。
     parser.add_argument(
         "--stop-retry",
-        action="store_true")
+        action="store_true",
+        help="no effect (kept for compatibility)")
 
     parser.add_argument(
         "--csv",
         action="store_true",
-        help="dump csv")
+        help="dump edge/node csv instead of drawing (same as --format csv)")
+
+    # 描画せずにグラフをデータとして書き出す。-o の拡張子からも決まる
+    parser.add_argument(
+        "--format",
+        choices=EXPORT_FORMATS,
+        default=None,
+        help="write the graph as data without drawing")
 
     parser.add_argument(
         "-o", "--output",
@@ -353,6 +684,25 @@ def add_hotgraph_option(parser):
         type=float,
         default=0.6)
 
+    # 大きなグラフでは auto で multilevel になる
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="auto",
+        help="node layout algorithm (auto: multilevel for more than 500 files)")
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=2020)
+
+    # 前回の配置を保存し、次回の初期値として使う
+    parser.add_argument(
+        "--layout-cache",
+        metavar="DIR",
+        default=None,
+        help="directory to keep node positions between runs")
+
     parser.add_argument(
         "--font-size",
         type=int,
@@ -364,6 +714,8 @@ def add_hotgraph_option(parser):
         action="store_true")
 
     add_file_filter_option(parser)
+    add_follow_renames_option(parser)
+    add_compact_option(parser)
 
     parser.set_defaults(handler=handle_hotgraph)
     return parser
@@ -397,12 +749,170 @@ def add_author_option(parser):
         "--only",
         nargs="*")
 
+    parser.add_argument(
+        "--by-repo",
+        action="store_true",
+        help="stack commits by repository instead of author, for data made by 'gilot log-many'")
+
     add_file_filter_option(parser)
+    add_compact_option(parser)
 
     parser.set_defaults(handler=handle_author)
     return parser
 
 
+def add_report_option(parser):
+    """
+        gilot report コマンドのオプション
+    """
+    parser.add_argument(
+        '-i', "--input",
+        nargs="*",
+        default=[sys.__stdin__])
+
+    parser.add_argument(
+        "-o", "--output-dir",
+        default="report",
+        help="directory to write the report into")
+
+    parser.add_argument(
+        "--format",
+        choices=REPORT_FORMATS,
+        default="png",
+        help="image format of the charts")
+
+    parser.add_argument(
+        "-n", "--name",
+        default="GIT LOG REPORT",
+        help="name")
+
+    parser.add_argument(
+        '-t', "--timeslot",
+        help="resample period like 2W or 7D or 1M ",
+        default="2W")
+
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="number of authors in the author chart")
+
+    parser.add_argument(
+        '-r', "--rank",
+        type=int,
+        default=70)
+
+    parser.add_argument(
+        "--max-nodes",
+        type=int,
+        default=None,
+        help="choose the smallest threshold which keeps the hotgraph within this number of files")
+
+    parser.add_argument(
+        "--max-edges",
+        type=int,
+        default=None,
+        help="choose the smallest threshold which keeps the hotgraph within this number of pairs")
+
+    parser.add_argument(
+        "-k",
+        type=float,
+        default=0.6)
+
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default="auto",
+        help="node layout algorithm of the hotgraph")
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=2020)
+
+    parser.add_argument(
+        "--layout-cache",
+        metavar="DIR",
+        default=None,
+        help="directory to keep node positions between runs")
+
+    # 描画するグラフは3つなので、それより多くしても速くならない
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=3,
+        help="number of processes to render the charts")
+
+    add_file_filter_option(parser)
+    add_follow_renames_option(parser)
+    add_compact_option(parser)
+
+    parser.set_defaults(handler=handle_report)
+    return parser
+
+
+def add_cache_option(parser):
+    """
+        gilot cache コマンドのオプション
+    """
+    parser.add_argument(
+        "command",
+        choices=["stats", "prune"],
+        help="'stats' shows the cache usage, 'prune' drops least recently used commits")
+
+    parser.add_argument(
+        "repo",
+        nargs="?",
+        default="./",
+        help="REPO must be a root dir of git repository")
+
+    add_cache_dir_option(parser)
+
+    parser.add_argument(
+        "--max-size",
+        type=float,
+        help=f"maximum cache size in MB. default is {DEFAULT_MAX_SIZE // 1024 // 1024}")
+
+    parser.set_defaults(handler=handle_cache)
+    return parser
+
+
+def add_serve_option(parser):
+    """
+        gilot serve コマンドのオプション
+    """
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1")
+
+    parser.add_argument(
+        "-p", "--port",
+        type=int,
+        default=8765)
+
+    parser.add_argument(
+        "--data-dir",
+        default=".",
+        help="directory of the csv/parquet files. 'input' parameters are relative to it")
+
+    parser.add_argument(
+        "-j", "--workers",
+        type=int,
+        default=4,
+        help="number of threads to handle requests")
+
+    parser.add_argument(
+        "--max-datasets",
+        type=int,
+        default=8,
+        help="number of loaded datasets to keep in memory")
+
+    add_compact_option(parser)
+
+    parser.set_defaults(handler=handle_serve)
+    return parser
+
+
 """
     gilot コマンドのオプション
 """
@@ -413,6 +923,8 @@ subparsers = parser.add_subparsers()
 subparsers_list = [
     add_log_option(subparsers.add_parser(
         'log', help='make git log csv data/ see `log -h`')),
+    add_log_many_option(subparsers.add_parser(
+        'log-many', help='make git log data of many repositories at once `log-many -h`')),
     add_plot_option(subparsers.add_parser(
         'plot', help='plot graph using the csv file see `plot -h`')),
     add_info_option(subparsers.add_parser(
@@ -423,17 +935,36 @@ subparsers_list = [
         'hotgraph', help='plot hotpost network `hotgraph -h`')),
     add_author_option(subparsers.add_parser(
         'author', help='author hotpost network `author -h`')),
+    add_report_option(subparsers.add_parser(
+        'report', help='write info, hotspot and all charts into a directory at once `report -h`')),
+    add_cache_option(subparsers.add_parser(
+        'cache', help='show or prune the per-commit stats cache `cache -h`')),
+    add_serve_option(subparsers.add_parser(
+        'serve', help='serve info/hotspot/authors/hotgraph as JSON over HTTP `serve -h`')),
 ]
 
 for p in subparsers_list:
     add_logging_option(p)
+    add_instrument_option(p)
 
 
 def main():
     # コマンドライン引数をパースして対応するハンドラ関数を実行
     args = parser.parse_args()
     if hasattr(args, 'handler'):
-        args.handler(args)
+        if args.timings is None:
+            with profile(args.profile):
+                args.handler(args)
+            return
+        # CLI のプロセスは gilot だけが使うので、ステージごとにピーク RSS をリセットしてよい
+        with collect(reset_peak_rss=True) as timings:
+            try:
+                # コマンド全体を1つのステージにして、その中に各ステージを入れ子で記録する
+                command = args.handler.__name__.replace("handle_", "")
+                with profile(args.profile), timings.stage(command):
+                    args.handler(args)
+            finally:
+                write_timings(timings, args.timings)
     else:
         # 未知のサブコマンドの場合はヘルプを表示
         parser.print_help()
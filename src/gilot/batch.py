@@ -0,0 +1,161 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .core import DEFAULT_DURATION, REPO_COLUMN, CommitDataFrame, Duration, from_dir
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class RepoSpec:
+    name: str
+    path: str
+
+
+@dataclass
+class ExtractOptions:
+    branch: str = "origin/HEAD"
+    duration: Duration = field(default_factory=lambda: DEFAULT_DURATION)
+    full: bool = False
+    jobs: int = 1
+    pathspecs: List[str] = field(default_factory=list)
+    renames: bool = False
+    # cache_dir を指定しない場合、キャッシュはリポジトリごとの .git/gilot/ に置く
+    cache: bool = False
+    cache_dir: Optional[str] = None
+
+
+@dataclass
+class RepoResult:
+    name: str
+    path: str
+    commits: int = 0
+    seconds: float = 0.0
+    output: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def repo_name(path: str) -> str:
+    name = os.path.basename(os.path.normpath(os.path.realpath(path)))
+    return name[:-len(".git")] if name.endswith(".git") and len(name) > len(".git") else name
+
+
+def read_manifest(manifest: str) -> List[str]:
+    """
+        1行に1つ "PATH" または "PATH<TAB>NAME" を書いたファイルを読む。
+        空行と # で始まる行は無視する。
+    """
+    with open(manifest, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f
+                if line.strip() and not line.lstrip().startswith("#")]
+
+
+def to_specs(entries: List[str]) -> List[RepoSpec]:
+    specs = []
+    for entry in entries:
+        path, _, name = entry.partition("\t")
+        specs.append(RepoSpec(name=name.strip() or repo_name(path), path=path.strip()))
+    names = pd.Series([s.name for s in specs])
+    duplicated = sorted(set(names[names.duplicated()]))
+    if duplicated:
+        raise ValueError(
+            f"repository names must be unique: {', '.join(duplicated)}. "
+            "give names in the manifest as PATH<TAB>NAME")
+    return specs
+
+
+def extract_repo(spec: RepoSpec, options: ExtractOptions,
+                 output: Optional[str] = None) -> Tuple[Optional[CommitDataFrame], int, float]:
+    """
+        1つのリポジトリを抽出する。ワーカープロセスで実行される。
+        output を指定した場合は書き出して、データフレームの代わりに None を返す。
+    """
+    start = time.time()
+    cache = None
+    if options.cache or options.cache_dir:
+        from .cache import StatsCache
+        cache = StatsCache.for_repo(spec.path, cache_dir=options.cache_dir)
+    df = from_dir(
+        spec.path,
+        branch=options.branch,
+        duration=options.duration,
+        full=options.full,
+        cache=cache,
+        jobs=options.jobs,
+        pathspecs=options.pathspecs,
+        renames=options.renames)
+    result: Optional[CommitDataFrame] = df
+    if output:
+        df.save(output)
+        result = None
+    return result, len(df), time.time() - start
+
+
+def with_repo(df: CommitDataFrame, name: str) -> CommitDataFrame:
+    df = df.copy()
+    df.insert(0, REPO_COLUMN, name)
+    return df
+
+
+def extract_many(
+        specs: List[RepoSpec],
+        options: ExtractOptions, *,
+        workers: int = 4,
+        output_dir: Optional[str] = None,
+        extension: str = ".csv"):
+    """
+        リポジトリを並列に抽出する。失敗したリポジトリがあっても残りは続ける。
+        output_dir を指定するとリポジトリごとに書き出し、そうでなければ
+        repo 列を付けて1つにまとめたデータフレームを返す。
+    """
+    results: Dict[str, RepoResult] = {s.name: RepoResult(name=s.name, path=s.path) for s in specs}
+    frames: Dict[str, CommitDataFrame] = dict()
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict()
+        for spec in specs:
+            output = os.path.join(output_dir, spec.name + extension) if output_dir else None
+            futures[pool.submit(extract_repo, spec, options, output)] = (spec, output)
+        for future in as_completed(futures):
+            spec, output = futures[future]
+            result = results[spec.name]
+            try:
+                df, result.commits, result.seconds = future.result()
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+                logger.error(f"{spec.name} ({spec.path}) failed: {result.error}")
+                continue
+            result.output = output
+            logger.info(f"{spec.name}: {result.commits} commits in {result.seconds:.2f}s")
+            if df is not None:
+                frames[spec.name] = with_repo(df, spec.name)
+
+    combined = None
+    if not output_dir:
+        # 順序はマニフェストの順にそろえる
+        parts = [frames[s.name] for s in specs if s.name in frames]
+        combined = CommitDataFrame(pd.concat(parts) if parts else CommitDataFrame.DF_NULL.copy())
+    return combined, [results[s.name] for s in specs]
+
+
+def format_results(results: List[RepoResult]) -> str:
+    width = max([len("repo")] + [len(r.name) for r in results])
+    lines = [f"{'repo':<{width}} {'commits':>8} {'seconds':>8}  status"]
+    for r in results:
+        status = "ok" if r.ok else f"failed ({r.error})"
+        lines.append(f"{r.name:<{width}} {r.commits:>8d} {r.seconds:>8.2f}  {status}")
+    failed = sum(not r.ok for r in results)
+    lines.append(f"{len(results) - failed} succeeded, {failed} failed")
+    return "\n".join(lines)
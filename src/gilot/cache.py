@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import git
+
+from .core import LogEntry
+
+logger = getLogger(__name__)
+
+CACHE_DIR_NAME = "gilot"
+CACHE_FILE_NAME = "stats.sqlite3"
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# SQLite のプレースホルダ数の上限より十分小さくする
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    hexsha TEXT PRIMARY KEY,
+    parents TEXT NOT NULL,
+    committed_date INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    insertions INTEGER NOT NULL,
+    deletions INTEGER NOT NULL,
+    lines INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    files_json TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commits_last_used ON commits (last_used);
+"""
+
+
+def _batches(items: List[str], size: int = BATCH_SIZE) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _row_to_entry(row: tuple) -> LogEntry:
+    hexsha, parents, committed_date, author, files_json = row
+    return LogEntry(
+        hexsha=hexsha,
+        parents=parents.split(),
+        committed_date=committed_date,
+        author=author,
+        files=json.loads(files_json))
+
+
+@dataclass
+class StatsCache:
+    """
+        hexsha をキーにしたコミット単位の統計キャッシュ。
+        コミットの内容は変わらないので、期間やブランチが変わっても再利用できる。
+        ファイルサイズが max_size を超えたら、最近使われていないものから捨てる。
+    """
+    path: str
+    max_size: int = DEFAULT_MAX_SIZE
+
+    @classmethod
+    def for_repo(
+            cls,
+            repo_dir: str,
+            cache_dir: Optional[str] = None,
+            max_size: int = DEFAULT_MAX_SIZE) -> StatsCache:
+        if cache_dir is None:
+            cache_dir = os.path.join(git.Repo(repo_dir).common_dir, CACHE_DIR_NAME)
+        os.makedirs(cache_dir, exist_ok=True)
+        return cls(path=os.path.join(cache_dir, CACHE_FILE_NAME), max_size=max_size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def get_many(self, hexshas: Iterable[str]) -> Dict[str, LogEntry]:
+        found: Dict[str, LogEntry] = dict()
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            for batch in _batches(list(hexshas)):
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    "SELECT hexsha, parents, committed_date, author, files_json "
+                    f"FROM commits WHERE hexsha IN ({marks})", batch).fetchall()
+                for row in rows:
+                    found[row[0]] = _row_to_entry(row)
+                conn.execute(
+                    f"UPDATE commits SET last_used = ? WHERE hexsha IN ({marks})",
+                    [now, *batch])
+        return found
+
+    def put_many(self, entries: Iterable[LogEntry]) -> None:
+        now = time.time()
+        rows = []
+        for e in entries:
+            total = e.total()
+            rows.append((
+                e.hexsha, " ".join(e.parents), e.committed_date, e.author,
+                total["insertions"], total["deletions"], total["lines"], total["files"],
+                json.dumps(e.files), now))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO commits VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+        if self.size() > self.max_size:
+            self.prune()
+
+    def size(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path)
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            commits, lines = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(lines), 0) FROM commits").fetchone()
+        return dict(
+            path=self.path,
+            commits=commits,
+            lines=lines,
+            size=self.size(),
+            max_size=self.max_size)
+
+    def prune(self, max_size: Optional[int] = None) -> int:
+        """
+            最近使われていないコミットから削除して max_size 以下にする。
+            削除したコミット数を返す。
+        """
+        limit = self.max_size if max_size is None else max_size
+        size = self.size()
+        if size <= limit:
+            return 0
+
+        with closing(self._connect()) as conn:
+            with conn:
+                count = conn.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+                # 1行あたりの平均サイズから残せる行数を見積もる
+                keep = int(count * limit / size) if size else 0
+                removed = conn.execute(
+                    "DELETE FROM commits WHERE hexsha NOT IN "
+                    "(SELECT hexsha FROM commits ORDER BY last_used DESC LIMIT ?)",
+                    (keep,)).rowcount
+            conn.execute("VACUUM")
+        logger.info(f"pruned {removed} commits from {self.path}")
+        return removed
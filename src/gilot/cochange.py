@@ -0,0 +1,301 @@
+import csv
+import io
+import json
+import os
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Optional, Tuple
+
+import community
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from gilot.hotspot import get_hotspots
+from gilot.timings import timed
+
+logger = getLogger(__name__)
+
+# 予算のノード数の何倍までのファイルを閾値の候補として集計するか
+PLAN_CANDIDATE_RATE = 5
+
+
+def search_threshold(df,rank=70) -> int:
+    vc = df["file_name"].value_counts()
+    if (len(vc) > rank):
+        v = vc.values[rank]
+        return max(v, 3)
+    return vc.values[-1]
+
+
+def incidence_matrix(df: pd.DataFrame, threshold: int = 1):
+    """
+        コミット x ファイルの 0/1 疎行列と、列に対応するファイル名を返す。
+        threshold 回未満しか変更されていないファイルは、
+        threshold 回以上の同時変更も起こりえないので最初に落とす。
+    """
+    pairs = df[["hexsha", "file_name"]].drop_duplicates()
+    counts = pairs["file_name"].value_counts()
+    pairs = pairs[pairs["file_name"].isin(counts.index[counts >= threshold])]
+    commits = pd.Categorical(pairs["hexsha"])
+    files = pd.Categorical(pairs["file_name"])
+    matrix = sp.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (commits.codes, files.codes)),
+        shape=(len(commits.categories), len(files.categories)))
+    return matrix, files.categories
+
+
+@timed("cochange_pairs")
+def cochange_pairs(df: pd.DataFrame, threshold: int = 1,
+                   top_k: Optional[int] = None) -> pd.DataFrame:
+    """
+        同じコミットで変更されたファイルの組と、その回数 (weight) を返す。
+        weight が threshold 未満の組は除き、top_k を指定した場合は
+        各ファイルについて weight の大きい上位 top_k 本の組だけを残す。
+    """
+    matrix, names = incidence_matrix(df, threshold)
+    # ファイル x ファイルの同時変更回数。上三角だけ使う
+    cooccurrence = sp.triu(matrix.T @ matrix, k=1).tocoo()
+    keep = cooccurrence.data >= threshold
+    result = pd.DataFrame({
+        "a": np.asarray(names)[cooccurrence.row[keep]],
+        "b": np.asarray(names)[cooccurrence.col[keep]],
+        "weight": cooccurrence.data[keep].astype(np.int64),
+    })
+    result = result.sort_values(
+        ["weight", "a", "b"], ascending=[False, True, True], kind="stable").reset_index(drop=True)
+    if top_k is not None:
+        result = strongest_pairs(result, top_k)
+    return result
+
+
+def strongest_pairs(pairs: pd.DataFrame, top_k: int) -> pd.DataFrame:
+    """
+        weight の降順に並んだ組から、各ファイルについて上位 top_k 本に入る組だけを残す。
+    """
+    pairs = pairs.reset_index(drop=True)
+    # 両端のファイルそれぞれについて、weight の大きい順に何番目の組かを数える
+    ends = pd.concat([pairs["a"], pairs["b"]]).sort_index(kind="stable")
+    rank = ends.groupby(ends, sort=False).cumcount()
+    return pairs.loc[np.unique(ends.index[rank.values < top_k])].reset_index(drop=True)
+
+
+@dataclass
+class ThresholdPlan:
+    threshold: int
+    nodes: int
+    edges: int
+
+
+def candidate_floor(df: pd.DataFrame, max_nodes: Optional[int] = None,
+                    max_edges: Optional[int] = None) -> int:
+    """
+        閾値 t のグラフに出てくるファイルは t 回以上変更されているので、
+        ノード数は「t 回以上変更されたファイル数」を超えない。
+        これが予算の PLAN_CANDIDATE_RATE 倍以下になる最小の t を集計の下限にする。
+    """
+    node_bound = None if max_edges is None else 2 * max_edges
+    bounds = [n for n in (max_nodes, node_bound) if n is not None]
+    if not bounds:
+        return 1
+    budget = PLAN_CANDIDATE_RATE * min(bounds)
+    counts = df[["hexsha", "file_name"]].drop_duplicates()["file_name"].value_counts().values
+    if len(counts) <= budget:
+        return 1
+    # counts は降順なので budget 番目の値より大きい t なら budget 個以下になる
+    return int(counts[budget]) + 1
+
+
+def plan_threshold(pairs: pd.DataFrame, max_nodes: Optional[int] = None,
+                   max_edges: Optional[int] = None, floor: int = 1) -> ThresholdPlan:
+    """
+        floor 以上の同時変更の組 (cochange_pairs の結果) から、
+        各閾値でのノード数・エッジ数を求め、予算に収まる最小の閾値を選ぶ。
+    """
+    weights = pairs["weight"].values
+    # ファイルが残る閾値の上限は、そのファイルを含む組の weight の最大値
+    node_weights = pd.concat([
+        pd.Series(weights, index=pairs["a"].values),
+        pd.Series(weights, index=pairs["b"].values)]).groupby(level=0).max().values
+
+    candidates = np.unique(np.append(weights, floor))
+    candidates = candidates[candidates >= floor]
+    edges = len(weights) - np.searchsorted(np.sort(weights), candidates, side="left")
+    nodes = len(node_weights) - np.searchsorted(np.sort(node_weights), candidates, side="left")
+
+    ok = np.ones(len(candidates), dtype=bool)
+    if max_nodes is not None:
+        ok &= nodes <= max_nodes
+    if max_edges is not None:
+        ok &= edges <= max_edges
+    if not ok.any():
+        i = len(candidates) - 1
+        logger.warning(f"No threshold fits max_nodes:{max_nodes} max_edges:{max_edges}")
+        return ThresholdPlan(
+            threshold=int(candidates[i]), nodes=int(nodes[i]), edges=int(edges[i]))
+    i = int(np.argmax(ok))
+    # 1つ前の候補より大きければ同じグラフになるので、その中で最小の値を選ぶ
+    threshold = candidates[i - 1] + 1 if i > 0 else candidates[i]
+    return ThresholdPlan(threshold=int(threshold), nodes=int(nodes[i]), edges=int(edges[i]))
+
+
+def fits_budget(plan: ThresholdPlan, max_nodes: Optional[int] = None,
+                max_edges: Optional[int] = None) -> bool:
+    return ((max_nodes is None or plan.nodes <= max_nodes)
+            and (max_edges is None or plan.edges <= max_edges))
+
+
+def search_planned_threshold(df: pd.DataFrame, max_nodes: Optional[int] = None,
+                             max_edges: Optional[int] = None
+                             ) -> Tuple[ThresholdPlan, pd.DataFrame]:
+    """
+        予算に収まる最小の閾値と、その閾値以上の同時変更の組を返す。
+        まず candidate_floor 以上の組だけを集計し、floor でも収まるときは
+        それより小さい閾値を二分探索する (グラフは閾値を上げると小さくなるだけなので単調)。
+    """
+    floor = candidate_floor(df, max_nodes, max_edges)
+    pairs = cochange_pairs(df, floor)
+    plan = plan_threshold(pairs, max_nodes, max_edges, floor=floor)
+    if plan.threshold > floor or not fits_budget(plan, max_nodes, max_edges):
+        # floor..plan.threshold - 1 が収まらないなら、それより小さい閾値も収まらない
+        return plan, pairs
+    # plan.threshold は収まる。lo 未満は収まらないことがわかっている
+    lo = 1
+    while lo < plan.threshold:
+        mid = (lo + plan.threshold) // 2
+        candidate = cochange_pairs(df, mid)
+        probe = plan_threshold(candidate, max_nodes, max_edges, floor=mid)
+        if not fits_budget(probe, max_nodes, max_edges):
+            # mid 以上で収まるのは空のグラフだけなので、それより小さい閾値も収まらない
+            return plan, pairs
+        if probe.threshold > mid:
+            # mid..probe.threshold - 1 は収まらないので、probe.threshold が最小
+            return probe, candidate
+        plan, pairs = probe, candidate
+    return plan, pairs
+
+
+def cochange_graph(pairs: pd.DataFrame) -> nx.Graph:
+    g = nx.Graph()
+    g.add_weighted_edges_from(pairs[["a", "b", "weight"]].itertuples(index=False, name=None))
+    return g
+
+
+@timed("hotspot_points")
+def set_hotspot_point(g, df, now=None, hotspots: Optional[pd.DataFrame] = None):
+    # get_hotspots の結果があれば、計算し直さずに使う
+    h_df = get_hotspots(df, now=now) if hotspots is None else hotspots
+    for (n, d) in g.nodes(data=True):
+        d["hotspot"] = float(h_df.loc[n, "hotspot"]) if n in h_df.index else 0.0
+
+
+@timed("pagerank")
+def set_page_rank(g):
+    pagerank = nx.pagerank(g)
+    for (n, d) in g.nodes(data=True):
+        d["pagerank"] = pagerank[n]
+
+
+@timed("louvain")
+def set_partition_number(g, seed=None):
+    partition_map = community.best_partition(g, random_state=seed)
+    for (n, d) in g.nodes(data=True):
+        d["partition_id"] = partition_map[n]
+
+
+@timed("build_hotgraph")
+def build_hotgraph(df: pd.DataFrame, *,
+                   rank=70,
+                   top_k=None,
+                   max_nodes=None,
+                   max_edges=None,
+                   seed=2020,
+                   hotspots: Optional[pd.DataFrame] = None) -> Optional[nx.Graph]:
+    """
+        展開済みの df から同時変更のグラフを作り、
+        各ノードに hotspot, pagerank, partition_id を設定する。
+        同時に変更されたファイルがなければ None を返す。
+        hotspots には同じ df の get_hotspots の結果を渡せる。
+    """
+    if max_nodes is None and max_edges is None:
+        th = search_threshold(df,rank=rank)
+        pairs = cochange_pairs(df, th)
+    else:
+        plan, pairs = search_planned_threshold(df, max_nodes, max_edges)
+        logger.info(f"planned threshold:{plan.threshold} "
+                    f"predicted nodes:{plan.nodes} edges:{plan.edges}")
+        th = plan.threshold
+        pairs = pairs[pairs["weight"] >= th].reset_index(drop=True)
+    if top_k is not None:
+        pairs = strongest_pairs(pairs, top_k)
+    if len(pairs) == 0:
+        logger.warning("No co-changed files")
+        return None
+
+    g = cochange_graph(pairs)
+    g.graph["threshold"] = int(th)
+    logger.info(f"threshold:{th} actual nodes:{g.number_of_nodes()} edges:{g.number_of_edges()}")
+
+    set_hotspot_point(g, df, hotspots=hotspots)
+    set_page_rank(g)
+    set_partition_number(g, seed=seed)
+    return g
+
+
+def nodes_frame(g: nx.Graph) -> pd.DataFrame:
+    nodes = pd.DataFrame.from_dict(dict(g.nodes(data=True)), orient="index",
+                                   columns=["hotspot", "pagerank", "partition_id"])
+    nodes.index.name = "file_name"
+    return nodes
+
+
+def edges_frame(g: nx.Graph) -> pd.DataFrame:
+    return pd.DataFrame(
+        [(a, b, d["weight"]) for (a, b, d) in g.edges(data=True)],
+        columns=["source", "target", "weight"])
+
+
+def to_node_link(g: nx.Graph) -> dict:
+    """
+        networkx の node-link 形式 (D3 などでそのまま読める) の dict にする。
+    """
+    return dict(
+        directed=False,
+        multigraph=False,
+        graph=dict(g.graph),
+        nodes=[dict(id=n, **d) for (n, d) in g.nodes(data=True)],
+        links=[dict(source=a, target=b, **d) for (a, b, d) in g.edges(data=True)])
+
+
+def nodes_csv_path(output: str) -> str:
+    root, ext = os.path.splitext(output)
+    return f"{root}.nodes{ext or '.csv'}"
+
+
+def export_hotgraph(g: nx.Graph, output, fmt: str) -> None:
+    """
+        グラフを描画せずにデータとして書き出す。
+        csv の場合、output にはエッジを、nodes_csv_path(output) にはノードを書く。
+        output が文字列でなければ (標準出力など) エッジだけを書く。
+    """
+    if fmt == "graphml":
+        if isinstance(output, io.TextIOBase):
+            # write_graphml はバイト列を書くので、標準出力などのテキストのストリームには文字列にして書く
+            buffer = io.BytesIO()
+            nx.write_graphml(g, buffer)
+            output.write(buffer.getvalue().decode("utf-8"))
+        else:
+            nx.write_graphml(g, output)
+    elif fmt == "json":
+        if isinstance(output, str):
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(to_node_link(g), f, ensure_ascii=False)
+        else:
+            json.dump(to_node_link(g), output, ensure_ascii=False)
+    elif fmt == "csv":
+        edges_frame(g).to_csv(output, index=False, quoting=csv.QUOTE_MINIMAL)
+        if isinstance(output, str):
+            nodes_frame(g).to_csv(nodes_csv_path(output))
+    else:
+        raise ValueError(f"unknown format: {fmt}")
@@ -1,16 +1,24 @@
 from __future__ import annotations
 from .filetracker import FileTracker
+from .timings import timed
+
+from concurrent.futures import ProcessPoolExecutor
 
 import git
 import datetime
 import json
+import numpy as np
 import pandas as pd
 from git.objects import Commit
-from typing import Any, Iterator,Type,List,Optional,Callable,cast
-from dataclasses import dataclass,asdict,fields
+from typing import (TYPE_CHECKING, Any, Dict, Iterable, Iterator, Type, List, Optional, Callable,
+                    Tuple, Union, cast)
+from dataclasses import dataclass,asdict,field,fields,replace
 from dateutil.relativedelta import relativedelta
 from logging import getLogger
 
+if TYPE_CHECKING:
+    from .cache import StatsCache
+
 logger = getLogger(__name__)
 
 
@@ -67,28 +75,321 @@ class Duration:
 DEFAULT_DURATION = Duration.months(6)
 
 
+EXCLUDE_MAGIC = ":(exclude)"
+
+
+def to_pathspecs(allow: Optional[List[str]], deny: Optional[List[str]]) -> List[str]:
+    """
+        --allow-files/--ignore-files を git の pathspec にする。
+        :(glob) では * が / にマッチしなくなるので、fnmatch と同じく
+        / をまたいでマッチする通常の pathspec を使う。
+    """
+    return [*(allow or []), *[EXCLUDE_MAGIC + p for p in (deny or [])]]
+
+
+def _has_wildcard(pattern: str) -> bool:
+    return any(c in pattern for c in "*?[")
+
+
+def git_pathspecs(pathspecs: List[str]) -> List[str]:
+    """
+        git に渡す pathspec。git はワイルドカードのないパスをディレクトリとしても扱うので、
+        git で絞り込むのは fnmatch でマッチするファイルを含む範囲までにして、残りは
+        pathspec_filter で落とす。ワイルドカードのない除外はディレクトリごと除外してしまうので渡さない。
+    """
+    return [p for p in pathspecs
+            if not (p.startswith(EXCLUDE_MAGIC) and not _has_wildcard(p[len(EXCLUDE_MAGIC):]))]
+
+
+def pathspec_filter(pathspecs: List[str]) -> Optional[Callable[[str], bool]]:
+    """
+        to_pathspecs の pathspec を、抽出後の filter_files と同じ fnmatch の判定にする
+    """
+    if not pathspecs:
+        return None
+    from .filters import compose_filter
+    allow = [p for p in pathspecs if not p.startswith(EXCLUDE_MAGIC)]
+    deny = [p[len(EXCLUDE_MAGIC):] for p in pathspecs if p.startswith(EXCLUDE_MAGIC)]
+    return compose_filter(allow=allow or None, deny=deny)
+
+
 @dataclass
 class Repo:
     repo: git.Repo
     branch : str
+    # git に渡してファイルを絞り込む pathspec
+    pathspecs: List[str] = field(default_factory=list)
+    # リネームを検出して "old => new" というファイル名で記録する
+    renames: bool = False
 
     @classmethod
     def from_dir(
             cls,
             repo_dir:str,
-            branch: str) -> Repo:
-        return cls(repo=git.Repo(repo_dir), branch=branch)
+            branch: str,
+            pathspecs: Optional[List[str]] = None,
+            renames: bool = False) -> Repo:
+        return cls(repo=git.Repo(repo_dir), branch=branch,
+                   pathspecs=pathspecs or [], renames=renames)
 
     def commits(self, duration: Duration) -> Iterator[Commit]:
 
         return self.repo.iter_commits(self.branch,since=duration.since_text(),until=duration.until_text())
 
+    def has_commit(self, hexsha: str) -> bool:
+        return self.repo.is_valid_object(hexsha, "commit")
+
+    def _log(self, *revs: str, **kwargs: Any) -> Iterator[LogEntry]:
+        # commit.stats のように1コミットごとに git diff を呼ばず、
+        # git log 1プロセスの出力をストリームで読みながらパースする
+        if self.pathspecs:
+            # マージをたどる際に枝を刈り込まず、対象ファイルに触れたコミットをすべて出す
+            kwargs["full_history"] = True
+        if self.renames:
+            kwargs["find_renames"] = True
+        else:
+            kwargs["no_renames"] = True
+        proc = self.repo.git.log(
+            *revs, "--", *git_pathspecs(self.pathspecs),
+            raw=True,
+            numstat=True,
+            z=True,
+            format=LOG_FORMAT,
+            as_process=True,
+            **kwargs)
+        stream = iter(lambda: proc.stdout.read(CHUNK_SIZE), b"")
+        try:
+            yield from parse_log(stream)
+        except GeneratorExit:
+            # 途中で読むのをやめた場合は git log を止める
+            proc.proc.kill()
+            raise
+        proc.wait()
+
+    def log_entries(
+            self,
+            duration: Duration,
+            *,
+            exclude: Optional[List[str]] = None,
+            cache: Optional[StatsCache] = None,
+            jobs: int = 1) -> Iterator[LogEntry]:
+        # exclude に指定したコミットとその祖先はたどらない
+        revs = [self.branch, *["^" + hexsha for hexsha in (exclude or [])]]
+        window: Dict[str, Any] = dict(since=duration.since_text(), until=duration.until_text())
+        if cache and self.pathspecs:
+            # キャッシュには絞り込む前の統計だけを入れる
+            logger.warning("stats cache is not used with file filters")
+            cache = None
+        if cache and self.renames:
+            # キャッシュにはリネームを検出しない統計だけを入れる
+            logger.warning("stats cache is not used with --renames")
+            cache = None
+        if cache is None and jobs <= 1:
+            yield from self._log(*revs, **window)
+            return
+
+        # 対象コミットの一覧だけ rev-list で求め、キャッシュにないものだけ git log で取り出す
+        if self.pathspecs:
+            window["full_history"] = True
+        hexshas = self.repo.git.rev_list(
+            *revs, "--", *git_pathspecs(self.pathspecs), **window).split()
+        found = cache.get_many(hexshas) if cache else dict()
+        missing = [h for h in hexshas if h not in found]
+        if cache:
+            logger.info(f"stats cache: {len(found)} hits, {len(missing)} misses")
+
+        entries = self.extract(missing, jobs=jobs)
+        if cache:
+            cache.put_many(entries)
+        found.update((e.hexsha, e) for e in entries)
+        # 並列数によらず rev-list の順に返す
+        for hexsha in hexshas:
+            if hexsha in found:
+                yield found[hexsha]
+
+    def extract(self, hexshas: List[str], *, jobs: int = 1) -> List[LogEntry]:
+        """
+            指定したコミットだけを git log --no-walk で取り出す。
+            jobs が2以上ならコミットを分割してプロセスプールで並列に取り出す。
+        """
+        if not hexshas:
+            return []
+        size = min(NO_WALK_BATCH, -(-len(hexshas) // max(jobs, 1)))
+        chunks = [hexshas[i:i + size] for i in range(0, len(hexshas), size)]
+        if jobs <= 1 or len(chunks) == 1:
+            return [e for chunk in chunks for e in self._log(*chunk, no_walk="unsorted")]
+
+        repo_dir = self.repo.working_tree_dir or self.repo.git_dir
+        logger.info(f"extracting {len(hexshas)} commits in {len(chunks)} chunks with {jobs} jobs")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                _extract_chunk, [repo_dir] * len(chunks), chunks, [self.pathspecs] * len(chunks),
+                [self.renames] * len(chunks))
+            return [e for entries in results for e in entries]
+
+    def records(
+            self,
+            duration: Duration,
+            *,
+            full: bool = False,
+            exclude: Optional[List[str]] = None,
+            cache: Optional[StatsCache] = None,
+            jobs: int = 1) -> Iterator[CommitRecord]:
+        is_match = pathspec_filter(self.pathspecs)
+        for entry in self.log_entries(duration, exclude=exclude, cache=cache, jobs=jobs):
+            if is_match is not None:
+                # git の pathspec で広めに絞り込んだファイルを、fnmatch の判定で絞り込み直す
+                entry = replace(entry, files={k: v for k, v in entry.files.items() if is_match(k)})
+            if self.pathspecs and (is_merge(entry) or not entry.files):
+                # filter_files と同じく、対象ファイルのないコミットは出さない
+                continue
+            yield CommitRecord.from_log_entry(entry, full=full)
+
+
+def _extract_chunk(repo_dir: str, hexshas: List[str], pathspecs: List[str],
+                   renames: bool = False) -> List[LogEntry]:
+    # ProcessPoolExecutor のワーカーで実行される
+    repo = Repo(repo=git.Repo(repo_dir), branch="HEAD", pathspecs=pathspecs, renames=renames)
+    return list(repo._log(*hexshas, no_walk="unsorted"))
+
 
 def timestamp_to_date_text(timestamp: int) -> str:
     return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
 
 
-def is_merge(commit: Commit) -> bool:
+# コミットの先頭を \x01 で示し、ヘッダの各フィールドを NUL で区切る
+LOG_FORMAT = "%x01%H%x00%P%x00%ct%x00%an"
+CHUNK_SIZE = 1 << 16
+# git log --no-walk に一度に渡すコミット数
+NO_WALK_BATCH = 1000
+
+
+@dataclass
+class LogEntry:
+    """
+        `git log --raw --numstat -z` の1コミット分。
+        files は commit.stats.files と同じ形式。
+    """
+    hexsha: str
+    parents: List[str]
+    committed_date: int
+    author: str
+    files: Dict[str, dict]
+
+    def __str__(self) -> str:
+        return self.hexsha
+
+    def total(self) -> dict:
+        insertions = sum(v["insertions"] for v in self.files.values())
+        deletions = sum(v["deletions"] for v in self.files.values())
+        return dict(
+            insertions=insertions,
+            deletions=deletions,
+            lines=insertions + deletions,
+            files=len(self.files))
+
+
+def _decode(raw: bytes) -> str:
+    return raw.decode("utf-8", "replace")
+
+
+_C_ESCAPES = {
+    0x07: "\\a", 0x08: "\\b", 0x09: "\\t", 0x0a: "\\n", 0x0b: "\\v",
+    0x0c: "\\f", 0x0d: "\\r", 0x22: '\\"', 0x5c: "\\\\"}
+
+
+def _needs_quote(b: int) -> bool:
+    return b < 0x20 or 0x7f <= b or b in _C_ESCAPES
+
+
+def _quote_path(raw: bytes) -> str:
+    # -z なしの git (core.quotepath=true) と同じ表記にそろえ、
+    # commit.stats 由来の既存CSVとファイル名を一致させる
+    if not any(_needs_quote(b) for b in raw):
+        return _decode(raw)
+    quoted = "".join(
+        _C_ESCAPES.get(b) or (f"\\{b:03o}" if _needs_quote(b) else chr(b))
+        for b in raw)
+    return f'"{quoted}"'
+
+
+def _numstat_to_int(raw: bytes) -> int:
+    # バイナリファイルは "-" になる
+    return 0 if raw == b"-" else int(raw)
+
+
+def _tokens(stream: Iterable[bytes]) -> Iterator[bytes]:
+    rest = b""
+    for chunk in stream:
+        parts = (rest + chunk).split(b"\0")
+        rest = parts.pop()
+        yield from parts
+    if rest:
+        yield rest
+
+
+def parse_log(stream: Iterable[bytes]) -> Iterator[LogEntry]:
+    """
+        LOG_FORMAT で出力した `git log --raw --numstat -z --no-renames` を
+        チャンク単位で受け取り、コミットごとの LogEntry を順に返す。
+        --find-renames の出力では、リネームしたファイルを "old => new" という名前にする。
+    """
+    tokens = _tokens(stream)
+    entry: Optional[LogEntry] = None
+    change_types: List[str] = []
+    numstat_count = 0
+
+    for token in tokens:
+        if token.startswith(b"\x01"):
+            if entry is not None:
+                yield entry
+            parents = _decode(next(tokens)).split()
+            committed_date = int(next(tokens))
+            author = _decode(next(tokens))
+            entry = LogEntry(
+                hexsha=_decode(token[1:]),
+                parents=parents,
+                committed_date=committed_date,
+                author=author,
+                files=dict())
+            change_types = []
+            numstat_count = 0
+            continue
+
+        token = token.lstrip(b"\n")
+        if not token or entry is None:
+            continue
+        if token.startswith(b":"):
+            # :100644 100644 abc123 def456 M <NUL> path <NUL>
+            # :100644 100644 abc123 def456 R090 <NUL> old <NUL> new <NUL>
+            status = token.rsplit(b" ", 1)[-1]
+            change_types.append(_decode(status[:1]))
+            next(tokens)
+            if status[:1] in (b"R", b"C"):
+                next(tokens)
+            continue
+
+        raw_insertions, raw_deletions, raw_name = token.split(b"\t", 2)
+        insertions = _numstat_to_int(raw_insertions)
+        deletions = _numstat_to_int(raw_deletions)
+        change_type = change_types[numstat_count] if numstat_count < len(change_types) else ""
+        numstat_count += 1
+        if raw_name:
+            name = _quote_path(raw_name).strip()
+        else:
+            # リネーム・コピーは名前が空で、続く2つのトークンが元と先の名前になる
+            name = f"{_quote_path(next(tokens)).strip()} => {_quote_path(next(tokens)).strip()}"
+        entry.files[name] = dict(
+            insertions=insertions,
+            deletions=deletions,
+            lines=insertions + deletions,
+            change_type=change_type)
+
+    if entry is not None:
+        yield entry
+
+
+def is_merge(commit: Union[Commit, LogEntry]) -> bool:
     ret = (1 < len(commit.parents))
     if ret :
         logger.info(f"merge commit should be treated as 0 {commit}")
@@ -126,6 +427,26 @@ class CommitRecord:
             files_json=file_json
         )
 
+    @ classmethod
+    def from_log_entry(cls, entry: LogEntry, full: bool = False) -> CommitRecord:
+        if is_merge(entry):
+            total = dict(insertions=0, deletions=0, lines=0, files=0)
+            file_json = json.dumps(dict()) if full else None
+        else:
+            total = entry.total()
+            file_json = json.dumps(entry.files) if full else None
+
+        return cls(
+            date=timestamp_to_date_text(entry.committed_date),
+            hexsha=entry.hexsha,
+            author=entry.author,
+            insertions=total["insertions"],
+            deletions=total["deletions"],
+            lines=total["lines"],
+            files=total["files"],
+            files_json=file_json
+        )
+
     def to_dict(self) -> dict:
         return asdict(self)
 
@@ -169,8 +490,162 @@ class CommitRecord:
         return self
 
 
+EXPANDED_COLUMNS = ["date", "hexsha", "author", "file_name", "insertions", "deletions", "lines"]
+FILE_TABLE_COLUMNS = ["hexsha", "file_name", "insertions", "deletions", "lines", "change_type"]
+COUNT_COLUMNS = ["insertions", "deletions", "lines", "files"]
+# 複数のリポジトリをまとめたデータ (gilot log-many) にだけある列
+REPO_COLUMN = "repo"
+
+
+def unique_keys(df: pd.DataFrame) -> List[str]:
+    # 複数のリポジトリをまとめたデータでは、フォークなどで同じコミットが別のリポジトリにもある
+    return [REPO_COLUMN, "hexsha"] if REPO_COLUMN in df.columns else ["hexsha"]
+
+
+def _match_file_names(names: pd.Series, is_match: Callable[[str], bool]) -> pd.Series:
+    # 判定はユニークなファイル名ごとに1回だけ行う
+    decisions = {name: bool(is_match(str(name))) for name in pd.unique(names)}
+    return names.map(decisions).astype(bool)
+
+
+def newest_file_names(names: pd.Series, dates: np.ndarray,
+                      repos: Optional[np.ndarray] = None) -> pd.Series:
+    """
+        リネームの式 (a => b, src/{a => b}/c) を含むファイル名を、リネームをたどった最新の名前に置き換える。
+        FileTracker は新しいリネームを優先するので、日付の新しい順に渡す。
+        repos があればリポジトリごとに別の FileTracker を作る。
+    """
+    codes, uniques = pd.factorize(names.astype(str) if _is_category(names) else names)
+    uniques = np.asarray(uniques, dtype=object)
+    renamed = pd.Index(uniques).str.contains(" => ", regex=False)
+    if len(uniques) == 0 or not renamed.any():
+        return names
+    rows = np.flatnonzero(np.asarray(renamed)[codes])
+    # 同じ日付の中では元の順番 (git log の新しい順) を保つ
+    rows = rows[np.argsort(-pd.to_datetime(dates[rows], utc=True).asi8, kind="stable")]
+    groups = [(None, np.arange(len(codes)))] if repos is None else \
+        [(repo, np.flatnonzero(repos == repo)) for repo in pd.unique(repos)]
+    result = np.empty(len(codes), dtype=object)
+    for repo, members in groups:
+        in_group = rows if repos is None else rows[repos[rows] == repo]
+        tracker = FileTracker.create([uniques[c] for c in codes[in_group]])
+        # 同じ名前は1回だけ引く
+        group_codes = np.unique(codes[members])
+        newest = np.empty(len(uniques), dtype=object)
+        newest[group_codes] = [tracker.newest_name(uniques[c]) for c in group_codes]
+        result[members] = newest[codes[members]]
+    return pd.Series(result, index=names.index, name=names.name)
+
+
+@timed("decode_files")
+def _decode_files_json(files_json: pd.Series) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+        files_json 列をまとめて1つのJSON配列としてデコードし、
+        各ファイルが属するコミットの位置と、1ファイル1行の表を返す。
+    """
+    texts = [v if isinstance(v, str) else "{}" for v in files_json.values]
+    decoded = json.loads("[" + ",".join(texts) + "]")
+    counts = np.fromiter((len(d) for d in decoded), dtype=np.int64, count=len(decoded))
+    positions = np.repeat(np.arange(len(decoded)), counts)
+    infos = [v for d in decoded for v in d.values()]
+    table = pd.DataFrame({
+        "file_name": [k for d in decoded for k in d],
+        "insertions": np.fromiter((v["insertions"] for v in infos), np.int64, len(infos)),
+        "deletions": np.fromiter((v["deletions"] for v in infos), np.int64, len(infos)),
+        "lines": np.fromiter((v["lines"] for v in infos), np.int64, len(infos)),
+        "change_type": [v.get("change_type", "") for v in infos],
+    })
+    return positions, table
+
+
+def positions_of(hexshas: pd.Series, keys: pd.Series) -> pd.Series:
+    # keys の各 hexsha が hexshas の何行目か。見つからないものは NaN
+    position = pd.Series(np.arange(len(hexshas)), index=hexshas.values)
+    position = position[~position.index.duplicated()]
+    return keys.map(position)
+
+
+def _is_category(s: pd.Series) -> bool:
+    return isinstance(s.dtype, pd.CategoricalDtype)
+
+
+def _code_positions(hexshas: pd.Series,
+                    keys: pd.Series) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    # compact なデータではファイル表とコミットがカテゴリを共有するので、コードで引ける
+    if not (_is_category(hexshas) and _is_category(keys)):
+        return None
+    if not hexshas.cat.categories.equals(keys.cat.categories):
+        return None
+    codes = hexshas.cat.codes.values
+    position = np.full(len(hexshas.cat.categories), -1, dtype=np.int64)
+    position[codes] = np.arange(len(codes))
+    if (codes < 0).any() or (position >= 0).sum() != len(codes):
+        # 同じ hexsha が複数ある (複数のリポジトリ)
+        return None
+    key_codes = keys.cat.codes.values
+    found = np.where(key_codes >= 0, position[key_codes], -1)
+    return np.flatnonzero(found >= 0), found[found >= 0]
+
+
+def match_positions(hexshas: pd.Series, keys: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+        keys の何行目が hexshas の何行目に当たるかの組を返す。見つからない行は含まない。
+        同じ hexsha が hexshas に複数あれば (複数のリポジトリ) その全てと組にする。
+    """
+    by_code = _code_positions(hexshas, keys)
+    if by_code is not None:
+        return by_code
+    if _is_category(hexshas) or _is_category(keys):
+        hexshas, keys = hexshas.astype(object), keys.astype(object)
+    if not hexshas.duplicated().any():
+        positions = positions_of(hexshas, keys)
+        found = positions.notna().values
+        return np.flatnonzero(found), positions[found].values.astype(np.int64)
+    merged = pd.DataFrame({"hexsha": keys.values, "key": np.arange(len(keys))}).merge(
+        pd.DataFrame({"hexsha": hexshas.values, "position": np.arange(len(hexshas))}),
+        on="hexsha", how="inner", sort=False)
+    return merged["key"].values, merged["position"].values
+
+
+def _global_codes(values: pd.Series, numbers: Dict[str, int]) -> np.ndarray:
+    # チャンク内で factorize し、チャンクをまたいで共通の番号 (出てきた順) に置き換える
+    codes, uniques = pd.factorize(values)
+    mapping = np.fromiter(
+        (numbers.setdefault(u, len(numbers)) for u in uniques), np.int32, len(uniques))
+    return mapping[codes]
+
+
+def _sorted_categorical(codes: np.ndarray, values: Dict[str, int]) -> pd.Categorical:
+    # 出てきた順の番号 (values) を、astype("category") と同じソート済みのカテゴリの番号に付け替える
+    names = np.array(list(values), dtype=object)
+    order = np.argsort(names, kind="stable")
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return pd.Categorical.from_codes(rank[codes], categories=names[order])
+
+
+def compact_file_table(table: pd.DataFrame, hexshas: pd.Categorical) -> pd.DataFrame:
+    """
+        ファイル表を compact にする。hexsha はコミット側のカテゴリを共有するので、
+        1ファイルあたり int32 のコード1つでコミットを指す。
+    """
+    return pd.DataFrame({
+        "hexsha": pd.Categorical(
+            table["hexsha"].astype(str).values, categories=hexshas.categories),
+        "file_name": table["file_name"].astype("category").values,
+        "insertions": table["insertions"].values.astype(np.int32),
+        "deletions": table["deletions"].values.astype(np.int32),
+        "lines": table["lines"].values.astype(np.int32),
+        "change_type": table["change_type"].astype("category").values,
+    })
+
+
 class CommitDataFrame(pd.DataFrame):
-    _metadata = ['name']
+    _metadata = ['name', 'file_table']
+
+    # files_json の代わりに、1ファイル1行の表 (FILE_TABLE_COLUMNS) を持つことがある。
+    # 列指向のデータセットから読み込んだ場合はこちらを使い、JSONをパースしない。
+    file_table: Optional[pd.DataFrame] = None
 
     @property
     def _constructor(self):
@@ -218,52 +693,155 @@ class CommitDataFrame(pd.DataFrame):
         return cls.from_records(
             [CommitRecord.compose(c, full=full) for c in commits])
 
-    def expand_files(self, filter_func=None):
+    @property
+    def is_compact(self) -> bool:
+        return "hexsha" in self.columns and _is_category(self["hexsha"])
+
+    def compact(self) -> CommitDataFrame:
+        """
+            メモリを節約した形に変換する。author / hexsha / repo はカテゴリに、
+            件数は int32 にし、files_json はファイル表 (file_table) に置き換える。
+            --full なしのデータは files_json (空) をそのまま残す。
+        """
+        if self.is_compact:
+            return self
+        has_files = self.file_table is not None or (
+            "files_json" in self.columns
+            and self["files_json"].map(lambda v: isinstance(v, str)).any())
+        table = self.to_file_table() if has_files else None
+        if table is not None and REPO_COLUMN in self.columns:
+            # 複数のリポジトリにある同じコミットは、ファイル表では1つにまとめる (read_datasets と同じ)
+            table = table.drop_duplicates(subset=["hexsha", "file_name"])
+        commits = self.drop(columns=["files_json"], errors="ignore") if has_files else self
+        df = pd.DataFrame(commits)
+        hexshas = pd.Categorical(df["hexsha"].astype(str).values)
+        df["hexsha"] = hexshas
+        df["author"] = df["author"].astype("category")
+        if REPO_COLUMN in df.columns:
+            df[REPO_COLUMN] = df[REPO_COLUMN].astype("category")
+        df = df.astype({c: "int32" for c in COUNT_COLUMNS if c in df.columns})
+        compact = CommitDataFrame(df)
+        if table is not None:
+            compact = compact.with_file_table(compact_file_table(table, hexshas))
+        return compact
+
+    def with_file_table(self, table: Optional[pd.DataFrame]) -> CommitDataFrame:
+        self.file_table = table
+        return self
+
+    def _file_positions(self) -> Tuple[np.ndarray, pd.DataFrame]:
+        if self.file_table is None:
+            return _decode_files_json(self["files_json"])
+        keys, positions = match_positions(self["hexsha"], self.file_table["hexsha"])
+        return positions, self.file_table.iloc[keys]
+
+    def to_file_table(self) -> pd.DataFrame:
+        if self.file_table is not None:
+            return self.file_table
+        positions, table = self._file_positions()
+        table.insert(0, "hexsha", self["hexsha"].values[positions])
+        return table
+
+    @timed("expand_files")
+    def expand_files(self, filter_func=None, follow_renames: bool = False):
+        """
+            1ファイル1行に展開する。follow_renames を指定すると、リネームされたファイルは
+            リネーム後の最新の名前にまとめる (filter_func も最新の名前で判定する)
+        """
         if len(self) == 0:
             # 空のDataFrameの場合、最低限必要なカラムを持つDataFrameを返す
-            df = pd.DataFrame(columns=["date", "hexsha", "author", "file_name", "insertions", "deletions", "lines"])
+            df = pd.DataFrame(columns=EXPANDED_COLUMNS)
             df.set_index("date", inplace=True)
             return CommitDataFrame(df)
 
-        records = []
-        for index, row in self.iterrows():
-            files = json.loads(str(row["files_json"]))
-            for file_name, file_info in files.items():
-                if filter_func and not filter_func(file_name):
-                    continue
-                record = {
-                    "date": index,
-                    "hexsha": row["hexsha"],
-                    "author": row["author"],
-                    "file_name": file_name,
-                    "insertions": file_info["insertions"],
-                    "deletions": file_info["deletions"],
-                    "lines": file_info["lines"]
-                }
-                records.append(record)
-        
-        if not records:
+        positions, table = self._file_positions()
+        if follow_renames:
+            repos = self[REPO_COLUMN].values[positions] if REPO_COLUMN in self.columns else None
+            table = table.assign(file_name=newest_file_names(
+                table["file_name"], self.index.values[positions], repos).values)
+        if filter_func:
+            keep = _match_file_names(table["file_name"], filter_func).values
+            positions = positions[keep]
+            table = table[keep]
+
+        if len(table) == 0:
             # フィルタリング後にレコードがない場合も同様の空のDataFrameを返す
-            df = pd.DataFrame(columns=["date", "hexsha", "author", "file_name", "insertions", "deletions", "lines"])
+            df = pd.DataFrame(columns=EXPANDED_COLUMNS)
             df.set_index("date", inplace=True)
             return CommitDataFrame(df)
-        
-        df = pd.DataFrame.from_records(records)
+
+        df = pd.DataFrame({
+            "date": self.index.values[positions],
+            "hexsha": self["hexsha"].values[positions],
+            "author": self["author"].values[positions],
+            "file_name": table["file_name"].astype(str).values,
+            "insertions": table["insertions"].values,
+            "deletions": table["deletions"].values,
+            "lines": table["lines"].values,
+        })
+        if REPO_COLUMN in self.columns:
+            df[REPO_COLUMN] = self[REPO_COLUMN].values[positions]
         df.set_index("date", inplace=True)
         return CommitDataFrame(df)
 
+    @timed("filter_files")
     def filter_files(self, is_match: Callable[[str], bool]) -> CommitDataFrame:
+        # CommitRecord.filter_files と同じく、マッチしたファイルだけで集計し直す。
+        # ファイル情報のない行はそのまま残し、マッチするファイルがない行は落とす
+        empty_df = pd.DataFrame([], columns=[i.name for i in fields(CommitRecord)])
+        empty_df.index = pd.DatetimeIndex([])
         if len(self) == 0:
-            empty_df = pd.DataFrame([], columns=[i.name for i in fields(CommitRecord)])
-            empty_df.index = pd.DatetimeIndex([])
             return CommitDataFrame(empty_df)
-        records = [cr.filter_files(is_match) for cr in self.to_records()]
-        filtered = [r for r in records if r is not None]
-        if not filtered:
-            empty_df = pd.DataFrame([], columns=[i.name for i in fields(CommitRecord)])
-            empty_df.index = pd.DatetimeIndex([])
+
+        positions, table = self._file_positions()
+        keep = _match_file_names(table["file_name"], is_match).values
+        positions = positions[keep]
+        table = table[keep]
+
+        if self.file_table is not None:
+            has_files = np.ones(len(self), dtype=bool)
+        else:
+            has_files = self["files_json"].map(lambda v: isinstance(v, str) and v != "").values
+        files = np.bincount(positions, minlength=len(self))
+        rows = ~has_files | (files > 0)
+        if not rows.any():
             return CommitDataFrame(empty_df)
-        return CommitDataFrame.from_records(filtered)
+
+        df = pd.DataFrame(self.drop(columns=["files_json"], errors="ignore"))
+        # compact なデータの int32 の列にも int64 の合計を入れられるようにする
+        df = df.astype({c: "int64" for c in COUNT_COLUMNS})
+        df["files_json"] = None if self.file_table is not None else self["files_json"].values
+        updated = has_files & rows
+        for column in ["insertions", "deletions", "lines"]:
+            sums = np.bincount(positions, weights=table[column].values, minlength=len(self))
+            df.loc[updated, column] = sums[updated].astype(np.int64)
+        df.loc[updated, "files"] = files[updated]
+        df.loc[updated, "files_json"] = None
+        columns = [i.name for i in fields(CommitRecord) if i.name != "date"]
+        if REPO_COLUMN in df.columns:
+            columns.append(REPO_COLUMN)
+        df = df[rows][columns]
+        return CommitDataFrame.from_dataframe(df.reset_index())
+
+    def save(self, output) -> None:
+        from .dataset import is_dataset_path, write_dataset
+        if is_dataset_path(output):
+            write_dataset(self, output)
+        else:
+            self.to_csv(output)
+
+    def newest_hexsha(self) -> Optional[str]:
+        if len(self) == 0:
+            return None
+        return str(self["hexsha"].iloc[self.index.argmax()])
+
+    def trim(self, duration: Duration) -> CommitDataFrame:
+        # Duration の外側にはみ出した行を落とす (until は当日を含む)
+        since = pd.Timestamp(duration.since)
+        in_window = self.index >= since
+        if duration.until:
+            in_window &= self.index < pd.Timestamp(duration.until) + pd.Timedelta(days=1)
+        return CommitDataFrame(self[in_window]).with_file_table(self.file_table)
 
     def to_records(self) -> List[CommitRecord]:
         def convert(index, row):
@@ -271,19 +849,171 @@ class CommitDataFrame(pd.DataFrame):
         return [convert(index, row) for index, row in self.iterrows()]
 
 
-def from_csv(csvFileName: str) -> CommitDataFrame:
-    return CommitDataFrame.from_dataframe(pd.read_csv(csvFileName))
+# csv を読み込むときの1チャンクの行数
+CSV_CHUNK_ROWS = 1 << 14
+# compact の場合はチャンクごとに files_json をデコードするので、一時的なメモリを抑えるため小さくする
+COMPACT_CHUNK_ROWS = 1 << 13
+# 型推論を省き、読み込み中のメモリを抑える。件数は最後に up で int64 に戻す
+CSV_DTYPES = {
+    "author": "category",
+    "insertions": "int32",
+    "deletions": "int32",
+    "lines": "int32",
+    "files": "int32",
+}
+# files_json を使わない集計 (plot / info / author) に必要な列
+SUMMARY_COLUMNS = ["date", "hexsha", "author", "insertions", "deletions", "lines", "files"]
 
 
-def from_csvs(csvFileNames: List[str]) -> CommitDataFrame:
-    df = pd.concat([pd.read_csv(i) for i in csvFileNames])
-    return CommitDataFrame.from_dataframe(df.drop_duplicates(subset="hexsha"))
+def from_csv(csvFileName: str) -> CommitDataFrame:
+    return CommitDataFrame.from_dataframe(pd.read_csv(csvFileName))
 
 
+def read_csv_chunks(
+        source: Any,
+        columns: Optional[List[str]] = None,
+        chunksize: int = CSV_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+        csv をチャンクごとに読む。columns を指定すると、その列 (と repo 列) だけを読む。
+    """
+    usecols = None if columns is None else (lambda c: c in columns or c == REPO_COLUMN)
+    with pd.read_csv(source, dtype=CSV_DTYPES, usecols=usecols, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk["date"] = pd.to_datetime(chunk["date"])
+            yield chunk
+
+
+@timed("from_csvs", count_input=False)
+def from_csvs(
+        csvFileNames: List[Any], *,
+        columns: Optional[List[str]] = None,
+        chunksize: int = CSV_CHUNK_ROWS,
+        compact: bool = False) -> CommitDataFrame:
+    """
+        複数の csv をチャンクごとに読み、既に読んだコミットをその場で捨てながらまとめる。
+        すべてを読み込んでから重複を除くのに比べて、ピーク時のメモリが小さい。
+        compact を指定すると、files_json もチャンクごとにファイル表へ変換して捨てる。
+        ファイル表は文字列を持たず、コミットの行番号とファイル名・変更種別の番号 (int32) だけをためる。
+    """
+    from .dataset import is_dataset_path, read_datasets
+    if any(is_dataset_path(i) for i in csvFileNames):
+        df = read_datasets(csvFileNames, columns=columns)
+        return df.compact() if compact else df
+
+    if compact:
+        chunksize = min(chunksize, COMPACT_CHUNK_ROWS)
+    seen: set = set()
+    file_names: Dict[str, int] = dict()
+    change_types: Dict[str, int] = dict()
+    parts = []
+    tables: List[Dict[str, np.ndarray]] = []
+    rows = 0
+    has_files = False
+    for name in csvFileNames:
+        for chunk in read_csv_chunks(name, columns, chunksize):
+            subset = unique_keys(chunk)
+            keys = (pd.MultiIndex.from_frame(chunk[subset]) if len(subset) > 1
+                    else pd.Index(chunk["hexsha"]))
+            # 同じチャンク内の重複も先に出てきた行だけを残す
+            fresh = ~chunk.duplicated(subset=subset).values & ~keys.isin(seen)
+            if not fresh.any():
+                continue
+            seen.update(keys[fresh])
+            part = chunk[fresh]
+            if compact and "files_json" in part.columns:
+                has_files = has_files or part["files_json"].map(lambda v: isinstance(v, str)).any()
+                positions, table = _decode_files_json(part["files_json"])
+                tables.append(dict(
+                    row=(positions + rows).astype(np.int32),
+                    file_name=_global_codes(table["file_name"], file_names),
+                    change_type=_global_codes(table["change_type"], change_types),
+                    **{c: table[c].values.astype(np.int32)
+                       for c in ["insertions", "deletions", "lines"]}))
+                part = part.drop(columns=["files_json"])
+            parts.append(part)
+            rows += len(part)
+    if not parts:
+        df = CommitDataFrame.from_dataframe(pd.DataFrame())
+        return df.compact() if compact else df
+
+    df = pd.concat(parts)
+    if not compact:
+        if isinstance(df["author"].dtype, pd.CategoricalDtype):
+            # カテゴリから戻すので、同じ作者の文字列は1つのオブジェクトを共有する
+            df["author"] = df["author"].astype(object)
+        return CommitDataFrame.from_dataframe(df)
+
+    result = CommitDataFrame.from_dataframe(df)
+    if tables and not has_files:
+        # --full なしのデータは files_json を空の列として残す
+        result["files_json"] = None
+    result = result.compact()
+    if not has_files:
+        return result
+
+    def column(name: str) -> np.ndarray:
+        return np.concatenate([t[name] for t in tables])
+    hexshas = result["hexsha"].values
+    table = pd.DataFrame({
+        "hexsha": pd.Categorical.from_codes(
+            hexshas.codes[column("row")], categories=hexshas.categories),
+        "file_name": _sorted_categorical(column("file_name"), file_names),
+        **{c: column(c) for c in ["insertions", "deletions", "lines"]},
+        "change_type": _sorted_categorical(column("change_type"), change_types),
+    })
+    if REPO_COLUMN in result.columns:
+        # 複数のリポジトリにある同じコミットは、ファイル表では1つにまとめる (compact と同じ)
+        table = table.drop_duplicates(subset=["hexsha", "file_name"]).reset_index(drop=True)
+    return result.with_file_table(table)
+
+
+@timed("from_dir", count_input=False)
 def from_dir(
         dirName: str = "./",*,
         branch: str = "origin/HEAD",
         duration: Duration = DEFAULT_DURATION,
-        full : bool = False) -> CommitDataFrame:
-    commits = Repo.from_dir(dirName, branch=branch).commits(duration)
-    return CommitDataFrame.from_commits(commits,full=full)
+        full : bool = False,
+        cache: Optional[StatsCache] = None,
+        jobs: int = 1,
+        pathspecs: Optional[List[str]] = None,
+        renames: bool = False) -> CommitDataFrame:
+    records = Repo.from_dir(dirName, branch=branch, pathspecs=pathspecs, renames=renames).records(
+        duration, full=full, cache=cache, jobs=jobs)
+    return CommitDataFrame.from_records(list(records))
+
+
+def append_dir(
+        df: CommitDataFrame,
+        dirName: str = "./",*,
+        branch: str = "origin/HEAD",
+        duration: Duration = DEFAULT_DURATION,
+        full : bool = False,
+        cache: Optional[StatsCache] = None,
+        jobs: int = 1,
+        pathspecs: Optional[List[str]] = None,
+        renames: bool = False) -> CommitDataFrame:
+    """
+        既存の CommitDataFrame に、それより新しいコミットだけを取り出して追加する。
+        最新の既知コミット以前の履歴は git にたどらせず、期間外の行は取り除く。
+    """
+    repo = Repo.from_dir(dirName, branch=branch, pathspecs=pathspecs, renames=renames)
+    newest = df.newest_hexsha()
+    if newest and not repo.has_commit(newest):
+        logger.warning(f"{newest} is not found in {dirName}, extracting all commits")
+        newest = None
+    if newest is None:
+        return from_dir(
+            dirName, branch=branch, duration=duration, full=full, cache=cache, jobs=jobs,
+            pathspecs=pathspecs, renames=renames)
+
+    records = list(repo.records(duration, full=full, exclude=[newest], cache=cache, jobs=jobs))
+    logger.info(f"{len(records)} commits are newer than {newest}")
+    added = CommitDataFrame.from_records(records)
+    table = None
+    if df.file_table is not None:
+        # 列指向のデータセットに追加する場合はファイル表の形にそろえる
+        table = pd.concat([added.to_file_table(), df.file_table], ignore_index=True)
+        added = CommitDataFrame(added.drop(columns=["files_json"]))
+    merged = pd.concat([added, df]) if len(added) else df
+    merged = merged[~merged["hexsha"].duplicated()]
+    return CommitDataFrame(merged).with_file_table(table).trim(duration)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from logging import getLogger
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .core import (COUNT_COLUMNS, REPO_COLUMN, CommitDataFrame, from_csvs, match_positions,
+                   unique_keys)
+
+logger = getLogger(__name__)
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+FEATHER_EXTENSIONS = (".feather", ".arrow")
+
+FILE_COLUMNS = ["file_name", "insertions", "deletions", "lines", "change_type"]
+
+
+def is_dataset_path(path: Any) -> bool:
+    return isinstance(path, str) and path.lower().endswith(PARQUET_EXTENSIONS + FEATHER_EXTENSIONS)
+
+
+def _arrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "pyarrow is required to read or write parquet/feather. "
+            "install it with `pip install gilot[parquet]`") from e
+    return pyarrow
+
+
+def _files_array(df: CommitDataFrame, pa):
+    # コミットごとのファイル表を list<struct> 列にする。
+    # file_name は辞書エンコードするので、同じパスを何度も持たない
+    table = df.to_file_table()
+    keys, order = match_positions(df["hexsha"], table["hexsha"])
+    sort = np.argsort(order, kind="stable")
+    table = table.iloc[keys[sort]]
+
+    counts = np.bincount(order, minlength=len(df))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    values = pa.StructArray.from_arrays(
+        [
+            pa.array(table["file_name"].astype(str).values).dictionary_encode(),
+            pa.array(table["insertions"].values, pa.int64()),
+            pa.array(table["deletions"].values, pa.int64()),
+            pa.array(table["lines"].values, pa.int64()),
+            pa.array(table["change_type"].astype(str).values).dictionary_encode(),
+        ],
+        names=FILE_COLUMNS)
+    mask = None
+    if df.file_table is None and "files_json" in df.columns:
+        # --full なしのデータは null にして、マージコミット ({}) と区別する
+        mask = pa.array(df["files_json"].isna().values)
+    return pa.ListArray.from_arrays(pa.array(offsets), values, mask=mask)
+
+
+def to_arrow(df: CommitDataFrame):
+    pa = _arrow()
+    dates = df.index.values.astype("datetime64[s]")
+    columns = {
+        "date": pa.array(dates, pa.timestamp("s")),
+        "hexsha": pa.array(df["hexsha"].astype(str).values),
+        "author": pa.array(df["author"].astype(str).values).dictionary_encode(),
+    }
+    if REPO_COLUMN in df.columns:
+        columns[REPO_COLUMN] = pa.array(df[REPO_COLUMN].astype(str).values).dictionary_encode()
+    for c in COUNT_COLUMNS:
+        columns[c] = pa.array(df[c].values, pa.int64())
+    columns["file_stats"] = _files_array(df, pa)
+    return pa.table(columns)
+
+
+def from_arrow(table) -> CommitDataFrame:
+    _arrow()
+    import pyarrow.compute as pc
+
+    has_files = "file_stats" in table.column_names
+    commits = (table.drop_columns(["file_stats"]) if has_files else table).to_pandas()
+    commits["date"] = commits["date"].astype("datetime64[ns]")
+    commits["author"] = commits["author"].astype(object)
+    if REPO_COLUMN in commits.columns:
+        commits[REPO_COLUMN] = commits[REPO_COLUMN].astype(object)
+    df = CommitDataFrame.from_dataframe(commits)
+    if not has_files:
+        # 列を絞って読んだ場合はファイルの情報を持たない
+        return df
+    files = table.column("file_stats").combine_chunks()
+    if len(df) == 0 or files.null_count == len(files):
+        # --full なしのデータは csv と同じく files_json が空の列になる
+        df["files_json"] = None
+        return df
+
+    values = pc.list_flatten(files)
+    parents = pc.list_parent_indices(files)
+    file_table = pd.DataFrame({
+        "hexsha": table.column("hexsha").take(parents).to_pandas(),
+        "file_name": values.field("file_name").to_pandas(),
+        "insertions": values.field("insertions").to_numpy(),
+        "deletions": values.field("deletions").to_numpy(),
+        "lines": values.field("lines").to_numpy(),
+        "change_type": values.field("change_type").to_pandas(),
+    })
+    return df.with_file_table(file_table)
+
+
+def write_dataset(df: CommitDataFrame, path: str) -> None:
+    _arrow()
+    table = to_arrow(df)
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+    logger.info(f"{table.num_rows} commits are written to {path}")
+
+
+def read_dataset(path: str, columns: Optional[List[str]] = None) -> CommitDataFrame:
+    """
+        columns を指定すると、その列 (と repo 列) だけを読む。file_stats も読まない。
+    """
+    _arrow()
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        read: Any = pq.read_table
+    else:
+        import pyarrow.feather as feather
+        names = feather.read_table(path, memory_map=True).column_names
+        read = feather.read_table
+    if columns is None:
+        return from_arrow(read(path))
+    return from_arrow(read(path, columns=[c for c in names if c in columns or c == REPO_COLUMN]))
+
+
+def read_datasets(paths: List[Any], columns: Optional[List[str]] = None) -> CommitDataFrame:
+    """
+        parquet/feather と csv が混ざっていてもよい。
+        csv の files_json は一度だけファイル表に変換して、まとめて扱う。
+    """
+    frames = [read_dataset(p, columns) if is_dataset_path(p) else from_csvs([p], columns=columns)
+              for p in paths]
+    if all(f.file_table is None for f in frames):
+        df = pd.concat(frames)
+        return CommitDataFrame(df[~df.duplicated(subset=unique_keys(df))])
+
+    tables = [f.to_file_table() for f in frames]
+    commits = pd.concat([f.drop(columns=["files_json"], errors="ignore") for f in frames])
+    commits = commits[~commits.duplicated(subset=unique_keys(commits))]
+    table = pd.concat(tables, ignore_index=True).drop_duplicates(subset=["hexsha", "file_name"])
+    return CommitDataFrame(commits).with_file_table(table)
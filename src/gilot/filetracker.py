@@ -44,15 +44,25 @@ def match(str:str) -> Optional[Tuple[str,str]]:
 class FileTracker():
     track_map : Dict[str,str]
 
-    def _search_recursive(self, file_name: str) -> str:
-        if (file_name not in self.track_map):
-            return file_name
-        return self._search_recursive(self.track_map[file_name])
+    def _search(self, file_name: str) -> str:
+        # 再帰せずにリネームの連鎖をたどり、たどった名前はすべて最新の名前に付け替える (経路圧縮)。
+        # 次に同じ連鎖を引くときは1回でたどり着く
+        path = []
+        visited = set()
+        name = file_name
+        while name in self.track_map and name not in visited:
+            visited.add(name)
+            path.append(name)
+            name = self.track_map[name]
+        for p in path:
+            if p != name:
+                self.track_map[p] = name
+        return name
 
     def newest_name(self, file_expression: str) -> str:
-        result = match(file_expression)
+        result = match(file_expression) if TRANS in file_expression else None
         name = file_expression if not result else result[1]
-        newest_name = self._search_recursive(name)
+        newest_name = self._search(name)
         logger.debug(f"newestname {newest_name}")
         return newest_name
 
@@ -60,7 +70,7 @@ class FileTracker():
     def create(cls, file_expressions: List[str]) -> FileTracker:
         track_map = dict()
         for fe in reversed(file_expressions):
-            result = match(fe)
+            result = match(fe) if TRANS in fe else None
             if result:
                 before = result[0]
                 after = result[1]
@@ -0,0 +1,29 @@
+import os
+import re
+from fnmatch import translate
+from functools import lru_cache
+from typing import Callable, List, Optional, Pattern
+
+
+def compile_patterns(patterns: List[str]) -> Optional[Pattern[str]]:
+    # 複数の glob を1つの正規表現にまとめる (fnmatch と同じく normcase する)
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{translate(os.path.normcase(p))})" for p in patterns))
+
+
+def compose_filter(allow: Optional[List[str]], deny: Optional[List[str]]) -> Callable[[str], bool]:
+    allow_re = compile_patterns(allow or ["*"])
+    deny_re = compile_patterns(deny or [])
+
+    @lru_cache(maxsize=None)
+    def match(file_name: str) -> bool:
+        name = os.path.normcase(file_name)
+        # いずれかのallow条件にmatchするか
+        is_allowed = allow_re is not None and allow_re.match(name) is not None
+        # いずれかのdeny条件にmatchするか
+        is_denyed = deny_re is not None and deny_re.match(name) is not None
+        # 許可されており、拒否リストに含まれていない。
+        return (is_allowed and not is_denyed)
+
+    return match
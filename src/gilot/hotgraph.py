@@ -1,30 +1,21 @@
 import os
-from itertools import combinations
 from logging import getLogger
-from typing import List
+from typing import Optional
 
-import community
-import matplotlib.pyplot as plt
+import matplotlib
 import networkx as nx
+import numpy as np
 import pandas as pd
-import timeout_decorator
-from pyfpgrowth import find_frequent_patterns
 
-from gilot.hotspot import get_hotspots
+from gilot.cochange import build_hotgraph
+from gilot.layout import LayoutCache, layout_graph
+from gilot.render import figure_style, new_figure, output_figure
+from gilot.timings import timed
 
 logger = getLogger(__name__)
 
-
-def all_commit_list(df: pd.DataFrame) -> List[List[str]]:
-    return df.groupby("hexsha").agg({"file_name": list})["file_name"].tolist()
-
-
-def search_threshold(df,rank=70) -> int:
-    vc = df["file_name"].value_counts()
-    if (len(vc) > rank):
-        v = vc.values[rank]
-        return max(v, 3)
-    return vc.values[-1]
+# これより多いノードがある場合は node_size の大きいものだけにラベルを付ける
+MAX_LABELS = 300
 
 
 def short_name(path:str, newline:bool) -> str:
@@ -33,66 +24,16 @@ def short_name(path:str, newline:bool) -> str:
     return filepath.replace("/", "/\n") if newline else filepath
 
 
-def add_edge_with_weight(graph,pair,weight=1) :
-    if(graph.has_edge(*pair)):
-        graph.edges[pair[0],pair[1]]["weight"] += 1
-    else:
-        graph.add_edge(*pair, weight=weight)
-
-
-def gen_commit_to_pattern(stop_retry: bool, timeout=10, max_retry=5, auto_increase_rate=1.3):
-
-    if (stop_retry):
-        logger.info(f"stop-retry {stop_retry}")
-        return find_frequent_patterns
-    logger.info(
-        f"retry-info timeout {timeout }sec,max_retry {max_retry},auto_increasing_rate:{auto_increase_rate}")
-
-    @timeout_decorator.timeout(timeout, timeout_exception=StopIteration)
-    def commit_to_pattern(edge_info, th):
-        return find_frequent_patterns(edge_info, th)
-
-    def retry_commit_to_pattern(edge_info, th):
-        nonlocal max_retry
-        max_retry -= 1
-        if (max_retry == 0):
-            return None
-
-        try:
-            logger.info(f"trial threshold:{th}")
-            return commit_to_pattern(edge_info, th)
-        except StopIteration:
-            retry_th = int(th * auto_increase_rate)
-            logger.warning(f"timedout : retrying  {retry_th}")
-            return retry_commit_to_pattern(edge_info, retry_th)
-
-    return retry_commit_to_pattern
-
-
-def set_hotspot_point(g, df):
-    h_df = get_hotspots(df)
-    for (n, d) in g.nodes(data=True):
-        d["hotspot"] = h_df.loc[n, "hotspot"] if n in h_df.index else 0
-
-
-def set_page_rank(g):
-    pagerank = nx.pagerank(g)
-    for (n, d) in g.nodes(data=True):
-        d["pagerank"] = pagerank[n]
-
-
-def set_partition_number(g):
-    partition_map = community.best_partition(g)
-    for (n, d) in g.nodes(data=True):
-        d["partition_id"] = partition_map[n]
-
-
 def graph_edge_size(g):
     return [min(d['weight'] * 0.5,5) for (a,b,d) in g.edges(data=True)]
 
 
-def graph_label_name(g, newline):
-    return dict([(n,short_name(n, newline)) for (n,d) in g.nodes(data=True)])
+def graph_label_name(g, newline, node_size=None, max_labels=MAX_LABELS):
+    nodes = list(g.nodes)
+    if node_size is not None and len(nodes) > max_labels:
+        logger.info(f"label only {max_labels} of {len(nodes)} files")
+        nodes = [nodes[i] for i in np.argsort(node_size, kind="stable")[::-1][:max_labels]]
+    return dict([(n,short_name(n, newline)) for n in nodes])
 
 
 def graph_node_size(g):
@@ -109,60 +50,101 @@ def plot_hotgraph(df: pd.DataFrame, *,
                   stop_retry=False,
                   k=0.6,
                   font_size=10,
-                  newline=False
-                  ) -> None:
-
-    commit_to_pattern = gen_commit_to_pattern(stop_retry)
-    commit_list = all_commit_list(df)
-    th = search_threshold(df,rank=rank)
-    patterns = commit_to_pattern(commit_list, th)
-
-    g = nx.Graph()
-    for edge in patterns.keys():
-        for a, b in combinations(edge, 2):
-            add_edge_with_weight(g, (a, b))
-
-    set_hotspot_point(g,df)
-    set_page_rank(g)
-    set_partition_number(g)
-
+                  newline=False,
+                  top_k=None,
+                  max_nodes=None,
+                  max_edges=None,
+                  layout="auto",
+                  seed=2020,
+                  layout_cache: Optional[LayoutCache] = None
+                  ):
+    # stop_retry は互換性のために残している (同時変更の集計は打ち切り不要)
+    g = build_hotgraph(
+        df, rank=rank, top_k=top_k, max_nodes=max_nodes, max_edges=max_edges, seed=seed)
+    if g is None:
+        return None
+    return draw_hotgraph(
+        g,
+        output_file_name=output_file_name,
+        k=k,
+        font_size=font_size,
+        newline=newline,
+        layout=layout,
+        seed=seed,
+        layout_cache=layout_cache)
+
+
+@timed("hotgraph_figure")
+def hotgraph_figure(g: nx.Graph, *,
+                    k=0.6,
+                    font_size=10,
+                    newline=False,
+                    layout="auto",
+                    seed=2020,
+                    layout_cache: Optional[LayoutCache] = None,
+                    fig=None):
+    """
+        build_hotgraph で作ったグラフを描いた Figure を返す。pyplot の状態は使わない
+    """
     edge_width = graph_edge_size(g)
-    labels = graph_label_name(g, newline)
     node_size = graph_node_size(g)
+    labels = graph_label_name(g, newline, node_size)
     node_color = graph_node_color(g)
-
-    plt.figure(figsize=(16,9))
-    pos = nx.spring_layout(g, k=k, seed=2020)
-
-    nx.draw_networkx_nodes(
-        g,
-        pos,
-        node_color=node_color,
-        cmap=plt.cm.Set3,
-        edgecolors="blue",
-        alpha=0.8,
-        node_size=node_size)
-
-    nx.draw_networkx_labels(
-        g,
-        pos,
-        labels=labels,
-        font_size=font_size,
-        font_color="#333",
-        font_weight="bold")
-
-    nx.draw_networkx_edges(
-        g,
-        pos,
-        alpha=0.3,
-        edge_color='#05e',
-        width=edge_width)
-
-    plt.tight_layout(pad=0.1, w_pad=0)
-    plt.axis("off")
-
+    pos = layout_graph(g, layout=layout, k=k, seed=seed, cache=layout_cache)
+
+    with figure_style():
+        fig = new_figure(fig)
+        ax = fig.add_subplot(1, 1, 1)
+
+        nx.draw_networkx_nodes(
+            g,
+            pos,
+            ax=ax,
+            node_color=node_color,
+            cmap=matplotlib.colormaps["Set3"],
+            edgecolors="blue",
+            alpha=0.8,
+            node_size=node_size)
+
+        nx.draw_networkx_labels(
+            g,
+            pos,
+            ax=ax,
+            labels=labels,
+            font_size=font_size,
+            font_color="#333",
+            font_weight="bold")
+
+        nx.draw_networkx_edges(
+            g,
+            pos,
+            ax=ax,
+            alpha=0.3,
+            edge_color='#05e',
+            width=edge_width)
+
+        fig.tight_layout(pad=0.1, w_pad=0)
+        ax.axis("off")
+    return fig
+
+
+def draw_hotgraph(g: nx.Graph, *,
+                  output_file_name=None,
+                  k=0.6,
+                  font_size=10,
+                  newline=False,
+                  layout="auto",
+                  seed=2020,
+                  layout_cache: Optional[LayoutCache] = None
+                  ):
+    """
+        build_hotgraph で作ったグラフを描画する
+    """
     if (output_file_name):
         logger.info(output_file_name)
-        plt.savefig(output_file_name, dpi=150, bbox_inches='tight')
-    else:
-        plt.show()
+
+    def build(fig):
+        return hotgraph_figure(
+            g, k=k, font_size=font_size, newline=newline, layout=layout, seed=seed,
+            layout_cache=layout_cache, fig=fig)
+    return output_figure(build, output_file_name)
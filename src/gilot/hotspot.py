@@ -1,32 +1,50 @@
 import datetime
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 
+from gilot.timings import timed
 
-def remove_outer_lines(df : pd.DataFrame) -> pd.DataFrame:
+
+def _inner_lines(df : pd.DataFrame) -> np.ndarray:
     outer_sup = np.percentile(df["lines"].values,99.5)
     outer_sub = np.percentile(df["lines"].values,0.5)
-    return df[(outer_sub < df["lines"]) & (df["lines"] < outer_sup)].copy()
+    return ((outer_sub < df["lines"]) & (df["lines"] < outer_sup)).values
+
+
+def remove_outer_lines(df : pd.DataFrame) -> pd.DataFrame:
+    return df[_inner_lines(df)].copy()
 
 
-def get_hotspots(df : pd.DataFrame) -> pd.DataFrame:
-    df = remove_outer_lines(df)
-    now = datetime.datetime.now()
+@timed("get_hotspots")
+def get_hotspots(df : pd.DataFrame, *, now: Optional[datetime.datetime] = None) -> pd.DataFrame:
+    # now を固定すると結果が再現できる (省略時は現在時刻)
+    df = df[_inner_lines(df)]
+    now = now or datetime.datetime.now()
     a_year = relativedelta(months=-12)
     last = now + a_year
     oldest = last - now
 
-    df["ntd"] = 1 - (df.index - now) / oldest
-    df.loc[df['ntd'] < 0,'ntd'] = 0
-    score = 1 / (1 + np.exp((-12 * df["ntd"]) + 12))
+    ntd = np.maximum(1 - ((df.index - now) / oldest).values, 0)
+    score = 1 / (1 + np.exp((-12 * ntd) + 12))
 
-    df["hotspot"] = score * np.log10(df["lines"])
-    by_file = df.groupby("file_name").sum()
-    by_file = by_file.drop(columns=["ntd"])
-    by_file["authors"] = df.groupby("file_name").nunique()["author"]
-    by_file["commits"] = df.groupby("file_name").nunique()["hexsha"]
+    # 呼び出し元の DataFrame に列を足さず、1回の groupby でまとめて集計する
+    by_file = pd.DataFrame({
+        "file_name": df["file_name"].astype("category").values,
+        "hexsha": df["hexsha"].values,
+        "author": df["author"].values,
+        "insertions": df["insertions"].values,
+        "lines": df["lines"].values,
+        "hotspot": score * np.log10(df["lines"].values),
+    }).groupby("file_name", observed=True).agg(
+        hotspot=("hotspot", "sum"),
+        commits=("hexsha", "nunique"),
+        authors=("author", "nunique"),
+        insertions=("insertions", "sum"),
+        lines=("lines", "sum"))
+    by_file.index = by_file.index.astype(object)
     by_file["edit_rate"] = by_file["insertions"] / by_file["lines"]
     result = by_file.sort_values("hotspot",ascending=False)
     return result.loc[:, ['hotspot', 'commits', 'authors', 'edit_rate', "lines"]].copy()
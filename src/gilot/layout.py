@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Dict, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from gilot.timings import timed
+
+logger = getLogger(__name__)
+
+# auto の場合、これより大きいグラフは multilevel で配置する
+AUTO_MULTILEVEL_NODES = 500
+# multilevel の仕上げの反復回数
+REFINE_ITERATIONS = 20
+# 仕上げで一度に計算する距離行列の要素数の上限
+REFINE_CHUNK_ELEMENTS = 1 << 22
+
+Positions = Dict[Any, np.ndarray]
+
+
+def node_digest(g: nx.Graph) -> str:
+    names = "\0".join(sorted(str(n) for n in g.nodes))
+    return hashlib.sha1(names.encode("utf-8")).hexdigest()
+
+
+def _groups(g: nx.Graph, seed: int) -> Dict[Any, int]:
+    groups = nx.get_node_attributes(g, "partition_id")
+    if len(groups) == g.number_of_nodes():
+        return groups
+    import community
+    return community.best_partition(g, random_state=seed)
+
+
+def refine_layout(g: nx.Graph, pos: Positions, *,
+                  k=0.6, iterations=REFINE_ITERATIONS) -> Positions:
+    """
+        Fruchterman-Reingold を初期位置から少ない反復で適用する。
+        距離行列は行を区切って計算するので、ノード数が多くてもメモリは一定で済む。
+    """
+    nodes = list(g.nodes)
+    n = len(nodes)
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight="weight", format="csr")
+    xy = np.array([pos[v] for v in nodes], dtype=float)
+    chunk = max(1, REFINE_CHUNK_ELEMENTS // max(n, 1))
+
+    t = max(np.ptp(xy, axis=0).max(), 1e-3) * 0.1
+    dt = t / (iterations + 1)
+    for _ in range(iterations):
+        displacement = np.zeros_like(xy)
+        for start in range(0, n, chunk):
+            rows = slice(start, start + chunk)
+            dx = xy[rows, 0, None] - xy[None, :, 0]
+            dy = xy[rows, 1, None] - xy[None, :, 1]
+            distance = np.maximum(np.sqrt(dx * dx + dy * dy), 0.01)
+            force = k * k / (distance * distance) - adjacency[rows].toarray() * distance / k
+            displacement[rows, 0] = (dx * force).sum(axis=1)
+            displacement[rows, 1] = (dy * force).sum(axis=1)
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 0.01)
+        xy += displacement * (t / length)[:, None]
+        t -= dt
+    xy = nx.rescale_layout(xy)
+    return dict(zip(nodes, xy))
+
+
+def multilevel_layout(g: nx.Graph, *, k=0.6, seed=2020,
+                      pos: Optional[Positions] = None) -> Positions:
+    """
+        コミュニティ (partition_id) をまとめたグラフを先に配置し、
+        各ファイルを所属するコミュニティの位置から少ない反復で仕上げる。
+    """
+    groups = _groups(g, seed)
+    edges = nx.to_pandas_edgelist(g)
+    edges["source"] = edges["source"].map(groups)
+    edges["target"] = edges["target"].map(groups)
+    edges = edges[edges["source"] != edges["target"]]
+    coarse = nx.Graph()
+    coarse.add_nodes_from(set(groups.values()))
+    weights = edges.groupby(["source", "target"])["weight"].sum().reset_index()
+    coarse.add_weighted_edges_from(weights.itertuples(index=False, name=None))
+    centers = nx.spring_layout(coarse, k=k, seed=seed)
+
+    sizes = pd.Series(groups).value_counts()
+    rng = np.random.default_rng(seed)
+    init: Positions = dict()
+    for n in g.nodes:
+        if pos is not None and n in pos:
+            init[n] = np.asarray(pos[n])
+            continue
+        group = groups[n]
+        # コミュニティが大きいほど広く散らす
+        radius = 0.5 * np.sqrt(sizes[group] / g.number_of_nodes())
+        init[n] = centers[group] + rng.uniform(-radius, radius, 2)
+    return refine_layout(g, init, k=k)
+
+
+def compute_layout(g: nx.Graph, *, layout="auto", k=0.6, seed=2020,
+                   pos: Optional[Positions] = None) -> Positions:
+    """
+        pos を渡すと、そのノードの位置を初期値として使う。
+    """
+    if layout == "auto":
+        layout = "multilevel" if g.number_of_nodes() > AUTO_MULTILEVEL_NODES else "spring"
+    logger.info(f"layout:{layout} nodes:{g.number_of_nodes()} edges:{g.number_of_edges()}")
+    if layout == "spring":
+        if pos is not None:
+            pos = {n: pos[n] for n in g.nodes if n in pos}
+        return nx.spring_layout(g, k=k, pos=pos or None, seed=seed)
+    if layout == "spectral":
+        return nx.spectral_layout(g)
+    if layout == "multilevel":
+        return multilevel_layout(g, k=k, seed=seed, pos=pos)
+    raise ValueError(f"unknown layout: {layout}")
+
+
+@dataclass
+class LayoutCache:
+    """
+        配置の結果をディレクトリに保存する。layout, k, seed ごとに 1 ファイル。
+        ノードの集合が同じなら保存した位置をそのまま使い、
+        違う場合も共通するノードの位置を初期値にする。
+    """
+    directory: str
+
+    def path(self, layout: str, k: float, seed: int) -> str:
+        return os.path.join(self.directory, f"layout-{layout}-k{k}-seed{seed}.json")
+
+    def load(self, g: nx.Graph, layout: str, k: float,
+             seed: int) -> Tuple[Optional[Positions], bool]:
+        """
+            (位置, ノードの集合が一致したかどうか) を返す。
+        """
+        path = self.path(layout, k, seed)
+        if not os.path.exists(path):
+            return None, False
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"ignore broken layout cache: {path}")
+            return None, False
+        pos = {n: np.asarray(xy) for n, xy in saved["pos"].items()}
+        return pos, saved["nodes"] == node_digest(g)
+
+    def save(self, g: nx.Graph, pos: Positions, layout: str, k: float, seed: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        saved = dict(
+            nodes=node_digest(g),
+            pos={str(n): [float(v) for v in xy] for n, xy in pos.items()})
+        with open(self.path(layout, k, seed), "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+
+
+@timed("layout")
+def layout_graph(g: nx.Graph, *, layout="auto", k=0.6, seed=2020,
+                 cache: Optional[LayoutCache] = None) -> Positions:
+    if cache is None:
+        return compute_layout(g, layout=layout, k=k, seed=seed)
+
+    previous, exact = cache.load(g, layout, k, seed)
+    if exact and previous is not None:
+        logger.info(f"reuse layout: {cache.path(layout, k, seed)}")
+        return previous
+    if previous is not None:
+        logger.info(f"start layout from {len(set(previous) & set(g.nodes))} cached positions")
+    pos = compute_layout(g, layout=layout, k=k, seed=seed, pos=previous)
+    cache.save(g, pos, layout, k, seed)
+    return pos
@@ -1,30 +1,51 @@
 import re
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from .core import COUNT_COLUMNS
+from .timings import timed
+
+# matplotlib / seaborn は読み込みに時間がかかるので、描画する関数の中で import する
 
 
 TITLE_SIZE = 15
 
 
-def gini(x):
-    # Mean absolute difference
-    mad = np.abs(np.subtract.outer(x, x)).mean()
-    rmad = mad / np.mean(x)
-    # Gini coefficient
-    return 0.5 * rmad
+def gini(x, weights=None):
+    # Mean absolute difference を n x n の行列を作らずにソートと累積和で求める。
+    # sum_ij w_i w_j |x_i - x_j| / (2 * sum(w) * sum(w * x))
+    x = np.asarray(x, dtype=np.float64)
+    w = np.ones_like(x) if weights is None else np.asarray(weights, dtype=np.float64)
+    order = np.argsort(x, kind="stable")
+    x = x[order]
+    w = w[order]
+    total_weight = np.sum(w)
+    below = np.cumsum(w) - w
+    above = total_weight - below - w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Gini coefficient
+        return np.sum(w * x * (below - above)) / (total_weight * np.sum(w * x))
 
 
-def lorenz(v):
+def lorenz(v, weights=None):
     x = np.linspace(0., 100., 21)
-    total = np.sum(v, dtype=np.float64)
-    y = []
-    for xi in x:
-        yi_vals = v[v <= np.percentile(v, xi)]
-        yi = (np.sum(yi_vals) / total) * 100.0
-        y.append(yi)
-    return x, y
+    v = np.asarray(v)
+    w = np.ones(len(v)) if weights is None else np.asarray(weights, dtype=np.float64)
+    order = np.argsort(v, kind="stable")
+    sorted_v = v[order]
+    w = w[order]
+    # 値を重みの数だけ並べた配列の np.percentile (linear) を、累積重みから求める
+    cw = np.cumsum(w)
+    pos = x / 100.0 * (cw[-1] - 1)
+    lo = sorted_v[np.searchsorted(cw, np.floor(pos), side="right")]
+    hi = sorted_v[np.minimum(np.searchsorted(cw, np.ceil(pos), side="right"), len(v) - 1)]
+    thresholds = lo + (pos - np.floor(pos)) * (hi - lo)
+    # 各パーセンタイル以下の値の合計を、ソート済みの累積和から引く
+    cumsum = np.concatenate([[0], np.cumsum(w * sorted_v)])
+    total = cumsum[-1]
+    counts = np.searchsorted(sorted_v, thresholds, side="right")
+    y = (cumsum[counts] / total) * 100.0
+    return x, y.tolist()
 
 
 def _ts_to_string(ts):
@@ -47,7 +68,8 @@ def _in_sprint(df, timeslot="2W"):
         empty_df["authors"] = 0
         empty_df["addedlines"] = 0
         return empty_df
-    df_resampled = df.resample(timeslot).sum()
+    # 文字列やカテゴリの列は集計しない (compact なデータではカテゴリを合計できない)
+    df_resampled = df[COUNT_COLUMNS].resample(timeslot).sum()
 
     df_resampled["authors"] = df["author"].resample(timeslot).nunique()
 
@@ -55,77 +77,75 @@ def _in_sprint(df, timeslot="2W"):
     return df_resampled
 
 
-def _plot_gini(df, plt):
+def _plot_gini(df, ax):
     v = df.lines.values
     bins, result = lorenz(v)
     gi = gini(v)
-    plt.plot(bins, result, label="commit")
-    plt.plot(bins, bins, '--', label="perfect equality")
-    plt.xlabel("Percentile")
-    plt.ylabel("Ratio")
-    plt.xlim(0, 100)
-    plt.fill_between(bins, bins, result, color="blue", alpha=0.2)
-    plt.fill_between(bins, result, color="red", alpha=0.2)
+    ax.plot(bins, result, label="commit")
+    ax.plot(bins, bins, '--', label="perfect equality")
+    ax.set_xlabel("Percentile")
+    ax.set_ylabel("Ratio")
+    ax.set_xlim(0, 100)
+    ax.fill_between(bins, bins, result, color="blue", alpha=0.2)
+    ax.fill_between(bins, result, color="red", alpha=0.2)
     title_label = f"GINI COEFFICIENT: {gi:.1%}"
-    plt.title(title_label, fontsize=TITLE_SIZE)
-    plt.legend()
-    pass
+    ax.set_title(title_label, fontsize=TITLE_SIZE)
+    ax.legend()
 
 
-def _plot_hist(df, plt, ts):
+def _plot_hist(df, ax, ts):
     v = df.lines.values
     median = np.median(v)
     timeslot = _ts_to_string(ts)
     # 非推奨API回避: pandas+matplotlibでヒストグラム描画
-    plt.hist(v, bins='auto', color='C0', alpha=0.7, edgecolor='black')
-    plt.xlim(0,)
+    ax.hist(v, bins='auto', color='C0', alpha=0.7, edgecolor='black')
+    ax.set_xlim(0,)
 
-    plt.title("Histgram of Code Output", fontsize=TITLE_SIZE)
-    _plot_text(plt, f"median={int(median) :,d} lines")
-    plt.ylabel("")
-    plt.xlabel(f"Code Output in {timeslot}")
+    ax.set_title("Histgram of Code Output", fontsize=TITLE_SIZE)
+    _plot_text(ax, f"median={int(median) :,d} lines")
+    ax.set_ylabel("")
+    ax.set_xlabel(f"Code Output in {timeslot}")
 
 
-def _plot_text(plt, text):
-    ax = plt.gca()
-    plt.text(0.99, 0.1, text,
-             horizontalalignment='right',
-             verticalalignment='top',
-             bbox=dict(facecolor='#cccccc', alpha=0.5),
-             transform=ax.transAxes)
+def _plot_text(ax, text):
+    ax.text(0.99, 0.1, text,
+            horizontalalignment='right',
+            verticalalignment='top',
+            bbox=dict(facecolor='#cccccc', alpha=0.5),
+            transform=ax.transAxes)
 
 
-def _plot_authors(df, plt):
+def _plot_authors(df, ax):
     date = df.index.values
     authors = df["authors"]
     mean = authors.mean()
-    plt.title(" Number of Actual Authors", fontsize=TITLE_SIZE)
-    plt.plot(date, authors, marker=".", label="commit authors")
-    plt.plot(date, np.ones(len(authors)) * mean, "--", label="mean")
-    _plot_text(plt, f"mean = {mean :.1f} authors/timeslot")
+    ax.set_title(" Number of Actual Authors", fontsize=TITLE_SIZE)
+    ax.plot(date, authors, marker=".", label="commit authors")
+    ax.plot(date, np.ones(len(authors)) * mean, "--", label="mean")
+    _plot_text(ax, f"mean = {mean :.1f} authors/timeslot")
     if len(date) > 1 :
-        plt.xlim(date[0], date[-1])
-    plt.ylabel("Unique number of committed author")
-    plt.legend()
+        ax.set_xlim(date[0], date[-1])
+    ax.set_ylabel("Unique number of committed author")
+    ax.legend()
 
 
-def _plot_code(df, plt):
+def _plot_code(df, ax):
     date = df.index.values
     total_change = df.lines.sum()
     total_added = (df.insertions - df.deletions).sum()
     refactor = 1 - total_added / total_change
-    plt.title("Code Output and Productivity", fontsize=TITLE_SIZE)
-    plt.plot(date, df.lines, label="lines")
-    plt.plot(date, df.insertions, color="g", label="insertions")
-    plt.plot(date, df.deletions, color="r", label="deletions")
+    ax.set_title("Code Output and Productivity", fontsize=TITLE_SIZE)
+    ax.plot(date, df.lines, label="lines")
+    ax.plot(date, df.insertions, color="g", label="insertions")
+    ax.plot(date, df.deletions, color="r", label="deletions")
     _plot_text(
-        plt,
+        ax,
         f"lines={total_change:,d} ,added={total_added:,d}, refactor={refactor:.2f}")
 
     if len(date) != 1:
-        plt.xlim(date[0], date[-1])
-    plt.ylabel("Lines")
-    plt.fill_between(
+        ax.set_xlim(date[0], date[-1])
+    ax.set_ylabel("Lines")
+    ax.fill_between(
         date,
         df.insertions,
         df.deletions,
@@ -133,7 +153,7 @@ def _plot_code(df, plt):
         color="g",
         alpha=0.5,
         interpolate=True)
-    plt.fill_between(
+    ax.fill_between(
         date,
         df.insertions,
         df.deletions,
@@ -141,11 +161,11 @@ def _plot_code(df, plt):
         color="r",
         alpha=0.5,
         interpolate=True)
-    plt.legend()
-    _plot_productivity(df,plt)
+    ax.legend()
+    _plot_productivity(df, ax)
 
 
-def _plot_productivity(df,plt):
+def _plot_productivity(df, ax):
     time = 0.5  # 2 weeks mostly 0.5 months
     beta = 0.3
     df["effort"] = df["authors"] * time
@@ -157,7 +177,6 @@ def _plot_productivity(df,plt):
     level = prod_to_level(prod)
     max_level = int(level.max() + 3)
     df["level"] = level.rolling(3,center=True).mean()
-    ax = plt.gca()
     ax2 = ax.twinx()
     ax2.grid(False)
     date = df.index.values
@@ -171,40 +190,45 @@ def prod_to_level(prod) :
     return np.maximum(np.log(prod / a) / np.log(b),0)
 
 
-def plot(df, timeslot='2W', output=False, name="[This Graph]"):
-    sns.set()
+@timed("plot_figure")
+def plot_figure(df, timeslot='2W', name="[This Graph]", fig=None):
+    """
+        plot のグラフを描いた Figure を返す。pyplot の状態は使わない
+    """
+    from .render import figure_style, new_figure, seaborn_style
     suptitle = f"{name} : created by 'gilot'"
     dfs = _in_sprint(df, timeslot=timeslot)
-    plt.figure(figsize=(16, 9))
-    plt.tight_layout(pad=0.05, w_pad=0)
-    plt.suptitle(suptitle, fontsize=13, y=0.95, x=0.8)
-    plt.subplots_adjust(wspace=0.15, hspace=0.4)
-    # PLOT GINI / LORENTZ
-    plt.subplot(2, 2, 1)
-    _plot_gini(dfs, plt)
-
-    # PlOT HIST
-    plt.subplot(2, 2, 3)
-    _plot_hist(dfs, plt, timeslot)
-
-    # PLOT CODE
-    plt.subplot(2, 2, 2)
-    _plot_code(dfs, plt)
-
-    # PLOT AUTHORS
-    plt.subplot(2, 2, 4)
-    _plot_authors(dfs, plt)
-    if(output):
-        plt.savefig(output, dpi=150, bbox_inches='tight')
-    else:
-        plt.show()
+    # sns.set() と同じスタイル
+    with figure_style(seaborn_style("darkgrid", context="notebook", palette="deep")):
+        fig = new_figure(fig)
+        fig.suptitle(suptitle, fontsize=13, y=0.95, x=0.8)
+        fig.subplots_adjust(wspace=0.15, hspace=0.4)
+        # PLOT GINI / LORENTZ
+        _plot_gini(dfs, fig.add_subplot(2, 2, 1))
+
+        # PlOT HIST
+        _plot_hist(dfs, fig.add_subplot(2, 2, 3), timeslot)
+
+        # PLOT CODE
+        _plot_code(dfs, fig.add_subplot(2, 2, 2))
 
+        # PLOT AUTHORS
+        _plot_authors(dfs, fig.add_subplot(2, 2, 4))
+    return fig
 
+
+def plot(df, timeslot='2W', output=False, name="[This Graph]"):
+    from .render import output_figure
+    return output_figure(
+        lambda fig: plot_figure(df, timeslot=timeslot, name=name, fig=fig), output)
+
+
+@timed("info")
 def info(df, timeslot="2W"):
     rdf = _in_sprint(df, timeslot)
     desc = rdf.describe().drop("count")
     dic = desc.to_dict()
-    sdf = df.sum()
+    sdf = df[COUNT_COLUMNS].sum()
     lines = int(sdf.lines)
     added = int(sdf.insertions - sdf.deletions)
     # 0による除算を防ぐ
@@ -253,55 +277,76 @@ def info(df, timeslot="2W"):
 
 
 def _top_authors(df,num):
-    return df.author.value_counts()[:num].index.tolist()
+    counts = df.author.value_counts()
+    # カテゴリの場合、この期間にいない作者も 0 件として数えられる
+    return counts[counts > 0][:num].index.tolist()
 
 
+@timed("count_commits")
 def _count_commits(df, top=15, only=None):
     authors = only if only else _top_authors(df,top)
-    index = df.resample("1W").sum().index
-    result = pd.DataFrame([],index=index , columns=[*authors,'Others'])
-
-    for a in authors:
-        result[a] = df["hexsha"][df.author == a].resample("1W").nunique()
-
-    result["Others"] = df["hexsha"][~df.author.isin(authors)].resample("1W").nunique()
-
-    result.fillna(value=0,inplace=True)
+    columns = [*authors, 'Others']
+    hexsha = df["hexsha"]
+    if isinstance(hexsha.dtype, pd.CategoricalDtype):
+        hexsha = hexsha.cat.codes
+    index = hexsha.resample("1W").size().index
+
+    # 対象の作者以外を Others にまとめ、(週, 作者) ごとのコミット数を1回の groupby で数える
+    author = df["author"].astype(object)
+    bucket = author.where(author.isin(authors), 'Others')
+    counts = pd.DataFrame({"hexsha": hexsha.values, "author": bucket.values}, index=df.index) \
+        .groupby([pd.Grouper(freq="1W"), "author"])["hexsha"].nunique().unstack()
+    result = counts.reindex(index=index, columns=columns)
+    result.columns = pd.Index(columns)
+    if len(result) == 0:
+        return result.fillna(0)
+
+    # 作者ごとに resample していたときと同じ型にする。
+    # 最初と最後の週の両方にコミットがある (またはコミットがない) 作者は int64、それ以外は float64
+    whole = result.iloc[[0, -1]].notna().all().values | result.isna().all().values
+    result = result.fillna(0)
+    for i in np.flatnonzero(whole):
+        result.isetitem(i, result.iloc[:, i].astype(np.int64))
     return result
 
 
 def _commit_ratio(df):
-    def ratio(s):
-        total = np.sum(s)
-        if total == 0:
-            return s * 0.0
-        return s / total
-    return df.apply(ratio, axis=1)
-
-
-def authors(df, output=False, top=None, name="--", only=None):
-    sns.set_style("darkgrid")
-    #plt.rcParams["font.family"] = "IPAGothic"
+    # 週ごとの合計で割る。合計が 0 の週はすべて 0 にする
+    values = df.values.astype(np.float64)
+    total = values.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(total == 0, values * 0.0, values / total)
+    return pd.DataFrame(ratio, index=df.index, columns=df.columns)
+
+
+@timed("authors_figure")
+def authors_figure(df, top=None, name="--", only=None, fig=None):
+    """
+        author のグラフを描いた Figure を返す。pyplot の状態は使わない
+    """
+    from .render import figure_style, new_figure, seaborn_style
     result = _count_commits(df, top=top, only=only)
+    ratio = _commit_ratio(result)
 
-    fig = plt.figure(figsize=(16, 9))
-    plt.suptitle(f"GIT LOG {name} AUTHORS REPORT created by gilot", fontsize=13, y=0.95, x=0.7)
-    gs = fig.add_gridspec(10, 10)
+    with figure_style(seaborn_style("darkgrid")):
+        fig = new_figure(fig)
+        fig.suptitle(f"GIT LOG {name} AUTHORS REPORT created by gilot", fontsize=13, y=0.95, x=0.7)
+        gs = fig.add_gridspec(10, 10)
 
-    plt.tight_layout(pad=0.05, w_pad=0)
+        ax = fig.add_subplot(gs[0:5,0:8])
+        ax.set_ylabel("number of commits")
+        ax.set_title("Changes in the number of commits (stack graph by author)")
+        result.plot.area(ax=ax, colormap="Spectral")
+        ax.legend(loc='upper left', bbox_to_anchor=(1.0, 1.01))
+        ax.set_xlabel("")
+        ax = fig.add_subplot(gs[5:10,0:8])
+        ax.set_ylabel("commit ratio")
+        ratio.plot.area(ax=ax, colormap="Spectral",legend=None)
+        ax.set_ylim(0,1)
+    return fig
 
-    plt.subplot(gs[0:5,0:8])
-    plt.ylabel("number of commits")
-    plt.title("Changes in the number of commits (stack graph by author)")
-    result.plot.area(ax=plt.gca(), colormap="Spectral")
-    plt.legend(loc='upper left', bbox_to_anchor=(1.0, 1.01))
-    plt.xlabel("")
-    plt.subplot(gs[5:10,0:8])
-    plt.ylabel("commit ratio")
-    ratio = _commit_ratio(result)
-    ratio.plot.area(ax=plt.gca(), colormap="Spectral",legend=None)
-    plt.ylim(0,1)
-    if(output):
-        plt.savefig(output, dpi=150, bbox_inches='tight')
-    else:
-        plt.show()
+
+def authors(df, output=False, top=None, name="--", only=None):
+    from .render import output_figure
+    return output_figure(
+        lambda fig: authors_figure(df, top=top, name=name, only=only, fig=fig), output)
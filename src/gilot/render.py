@@ -0,0 +1,81 @@
+import io
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .timings import timed
+
+# matplotlib / seaborn は読み込みに時間がかかるので、関数の中で import する
+
+DPI = 150
+FIGSIZE = (16, 9)
+IMAGE_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+# rcParams はプロセス全体で共有されるので、スタイルを切り替えて Figure を組み立てる間はロックする。
+# 組み立てた Figure は pyplot に登録しないので、savefig はロックの外で並行して呼べる。
+_STYLE_LOCK = threading.RLock()
+
+
+def seaborn_style(style: str = "darkgrid", context: Optional[str] = None,
+                  palette: Optional[str] = None) -> Dict[str, Any]:
+    """
+        sns.set() などが書き換える rcParams を、グローバルを変えずに辞書として返す
+    """
+    import seaborn as sns
+    from cycler import cycler
+    rc = dict(sns.axes_style(style))
+    if context:
+        rc.update(sns.plotting_context(context))
+    if palette:
+        rc["axes.prop_cycle"] = cycler("color", sns.color_palette(palette))
+    return rc
+
+
+@contextmanager
+def figure_style(rc: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+    import matplotlib
+    with _STYLE_LOCK, matplotlib.rc_context(rc or {}):
+        yield
+
+
+def new_figure(fig=None, figsize=FIGSIZE):
+    """
+        pyplot の状態を使わない Figure を作る。fig が渡されればそれを使う
+    """
+    if fig is None:
+        from matplotlib.figure import Figure
+        return Figure(figsize=figsize)
+    fig.set_size_inches(*figsize)
+    return fig
+
+
+@timed("savefig", count_input=False)
+def save_figure(fig, output, format: Optional[str] = None, dpi: int = DPI) -> None:
+    fig.savefig(output, format=format, dpi=dpi, bbox_inches="tight")
+
+
+def figure_to_bytes(fig, format: str = "png", dpi: int = DPI) -> bytes:
+    """
+        Figure をメモリ上で描画して、画像のバイト列を返す
+    """
+    if format not in IMAGE_FORMATS:
+        raise ValueError(f"unknown image format {format}, choose from {list(IMAGE_FORMATS)}")
+    buffer = io.BytesIO()
+    save_figure(fig, buffer, format=format, dpi=dpi)
+    return buffer.getvalue()
+
+
+def output_figure(build: Callable[[Any], Any], output=False):
+    """
+        output があれば保存し、なければ pyplot のウィンドウに表示する。作った Figure を返す
+    """
+    if output:
+        fig = build(None)
+        save_figure(fig, output)
+        return fig
+    # 表示するときだけ pyplot に登録し、閉じてから返す
+    import matplotlib.pyplot as plt
+    fig = build(plt.figure())
+    plt.show()
+    plt.close(fig)
+    return fig
@@ -0,0 +1,187 @@
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Callable, Dict, List, Optional
+
+from .cochange import build_hotgraph
+from .core import SUMMARY_COLUMNS, CommitDataFrame, from_csvs
+from .hotspot import get_hotspots
+from .plotter import info
+from .timings import Timings, collect
+
+logger = getLogger(__name__)
+
+REPORT_FORMATS = ["png", "svg"]
+METADATA_FILE = "report.json"
+INFO_FILE = "info.json"
+HOTSPOT_FILE = "hotspot.csv"
+
+
+@dataclass
+class ReportOptions:
+    name: str = "GIT LOG REPORT"
+    timeslot: str = "2W"
+    fmt: str = "png"
+    top: int = 10
+    rank: int = 70
+    max_nodes: Optional[int] = None
+    max_edges: Optional[int] = None
+    k: float = 0.6
+    layout: str = "auto"
+    seed: int = 2020
+    layout_cache: Optional[str] = None
+    workers: int = 3
+
+
+def _init_worker() -> None:
+    # ワーカーでは画面を使わずにファイルへ描画する
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_plot(df: CommitDataFrame, path: str, options: ReportOptions) -> float:
+    from .plotter import plot_figure
+    return _render(lambda: plot_figure(df, name=options.name, timeslot=options.timeslot), path)
+
+
+def render_author(df: CommitDataFrame, path: str, options: ReportOptions) -> float:
+    from .plotter import authors_figure
+    return _render(lambda: authors_figure(df, name=options.name, top=options.top), path)
+
+
+def render_hotgraph(g, path: str, options: ReportOptions) -> float:
+    from .hotgraph import hotgraph_figure
+    from .layout import LayoutCache
+    layout_cache = LayoutCache(options.layout_cache) if options.layout_cache else None
+    return _render(lambda: hotgraph_figure(
+        g, k=options.k, layout=options.layout, seed=options.seed, layout_cache=layout_cache), path)
+
+
+def _render(build: Callable[[], Any], path: str) -> float:
+    from .render import save_figure
+    start = time.perf_counter()
+    # pyplot に登録しない Figure なので、ワーカーを使い回しても図は残らない
+    save_figure(build(), path)
+    return time.perf_counter() - start
+
+
+RENDERERS: Dict[str, Callable[[Any, str, ReportOptions], float]] = {
+    "plot": render_plot,
+    "author": render_author,
+    "hotgraph": render_hotgraph,
+}
+
+
+def decode_files_once(df: CommitDataFrame) -> CommitDataFrame:
+    """
+        filter_files と expand_files がそれぞれ files_json をデコードしないように、
+        先にファイル表に変換しておく。ファイル情報のない行がある場合はそのまま返す。
+    """
+    if df.file_table is not None or "files_json" not in df.columns:
+        return df
+    if not df["files_json"].map(lambda v: isinstance(v, str)).all():
+        return df
+    return CommitDataFrame(df).with_file_table(df.to_file_table())
+
+
+def make_report(inputs: List[Any], output_dir: str, options: ReportOptions, *,
+                is_match: Optional[Callable[[str], bool]] = None,
+                compact: bool = False,
+                follow_renames: bool = False) -> Optional[dict]:
+    """
+        データを1回だけ読み込み・絞り込み・展開して、output_dir に
+        info.json, hotspot.csv, 各グラフの画像と report.json (メタデータ) を書く。
+        グラフはワーカープロセスで並列に描画する。データがなければ None を返す。
+    """
+    with collect() as timings:
+        metadata = _make_report(inputs, output_dir, options, timings,
+                                is_match=is_match, compact=compact, follow_renames=follow_renames)
+    if metadata is None:
+        return None
+    # report.json にはこの関数の中のステージ (入れ子のステージを除く) だけを書く
+    metadata["timings"] = timings.seconds(depth=0)
+    with open(os.path.join(output_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=4)
+    return metadata
+
+
+def _make_report(inputs: List[Any], output_dir: str, options: ReportOptions, timings: Timings, *,
+                 is_match: Optional[Callable[[str], bool]],
+                 compact: bool,
+                 follow_renames: bool) -> Optional[dict]:
+    start = time.perf_counter()
+    with timings.stage("load"):
+        df = from_csvs(inputs, compact=compact)
+    if len(df) == 0:
+        return None
+    os.makedirs(output_dir, exist_ok=True)
+
+    with timings.stage("decode"):
+        df = decode_files_once(df)
+    with timings.stage("filter"):
+        commits = df.filter_files(is_match) if is_match else df
+    with timings.stage("expand"):
+        expanded = df.expand_files(is_match, follow_renames=follow_renames)
+
+    with timings.stage("info"):
+        result = info(commits, timeslot=options.timeslot)
+        with open(os.path.join(output_dir, INFO_FILE), "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+    # ファイル情報がない (--full なしの log や、どのファイルにも一致しないフィルタ) 場合は
+    # hotspot と hotgraph を作らない
+    has_files = len(expanded) > 0
+    g = None
+    if has_files:
+        with timings.stage("hotspot"):
+            hotspots = get_hotspots(expanded)
+            hotspots.to_csv(os.path.join(output_dir, HOTSPOT_FILE))
+        with timings.stage("hotgraph"):
+            g = build_hotgraph(
+                expanded,
+                rank=options.rank,
+                max_nodes=options.max_nodes,
+                max_edges=options.max_edges,
+                seed=options.seed,
+                hotspots=hotspots)
+
+    files = dict(info=INFO_FILE, hotspot=HOTSPOT_FILE) if has_files else dict(info=INFO_FILE)
+    skipped = [] if has_files else ["hotspot", "hotgraph"]
+    jobs: Dict[str, Any] = dict()
+    if len(commits) > 0:
+        # 描画に使う列だけをワーカーに渡す
+        summary = commits[[c for c in SUMMARY_COLUMNS if c in commits.columns]]
+        jobs.update(plot=summary, author=summary)
+    else:
+        skipped += ["plot", "author"]
+    if g is not None:
+        jobs["hotgraph"] = g
+    rendered: Dict[str, float] = dict()
+    with timings.stage("render"):
+        with ProcessPoolExecutor(max_workers=max(1, min(options.workers, len(jobs))),
+                                 initializer=_init_worker) as pool:
+            futures = dict()
+            for kind, data in jobs.items():
+                files[kind] = f"{kind}.{options.fmt}"
+                futures[kind] = pool.submit(
+                    RENDERERS[kind], data, os.path.join(output_dir, files[kind]), options)
+            rendered.update({kind: future.result() for kind, future in futures.items()})
+    # ワーカーの中のステージは記録できないので、ワーカーが測った時間を記録する
+    for kind, seconds in rendered.items():
+        timings.record(f"render_{kind}", seconds)
+    timings.record("total", time.perf_counter() - start)
+
+    return dict(
+        name=options.name,
+        inputs=[getattr(i, "name", str(i)) for i in inputs],
+        created_at=datetime.datetime.now().isoformat(timespec="seconds"),
+        commits=len(commits),
+        file_rows=len(expanded),
+        files=files,
+        # ファイル情報がない、または絞り込みで何も残らなかったので作らなかったもの
+        skipped=skipped,
+        hotgraph=None if g is None else dict(
+            threshold=g.graph["threshold"], nodes=g.number_of_nodes(), edges=g.number_of_edges()))
@@ -0,0 +1,302 @@
+import datetime
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging import getLogger
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import gilot
+from gilot.filters import compose_filter
+from gilot.render import IMAGE_FORMATS, figure_to_bytes
+
+logger = getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_DATASETS = 8
+
+
+class RequestError(Exception):
+    """
+        クライアントに status を返すエラー
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class DatasetCache:
+    """
+        読み込んだ CommitDataFrame と展開済みのファイル表を保持する LRU キャッシュ。
+        キーには入力ファイルのパスと mtime, サイズを含めるので、
+        ファイルが更新されれば次のリクエストで読み直す。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_DATASETS):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        # 読み込みは重いのでロックの外で行う (同時に来た場合は二重に読むだけ)
+        value = load()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(entries=len(self.entries), max_entries=self.max_entries,
+                        hits=self.hits, misses=self.misses)
+
+
+def _to_builtin(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+class Datasets:
+    """
+        data_dir 以下の csv / parquet / feather をキャッシュしながら読み込む
+    """
+
+    def __init__(self, data_dir: str = ".", max_entries: int = DEFAULT_MAX_DATASETS,
+                 compact: bool = False):
+        self.data_dir = os.path.realpath(data_dir)
+        self.cache = DatasetCache(max_entries)
+        self.compact = compact
+
+    def resolve(self, name: str) -> str:
+        path = os.path.realpath(os.path.join(self.data_dir, name))
+        if os.path.commonpath([path, self.data_dir]) != self.data_dir:
+            raise RequestError(403, f"{name} is outside of the data directory")
+        if not os.path.isfile(path):
+            raise RequestError(404, f"{name} is not found")
+        return path
+
+    def key(self, names: List[str]) -> Tuple:
+        if not names:
+            raise RequestError(400, "input is required")
+        paths = [self.resolve(n) for n in names]
+        return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths)
+
+    def frame(self, names: List[str]):
+        key = self.key(names)
+        return self.cache.get(
+            ("frame", key),
+            lambda: gilot.from_csvs([p for (p, _, _) in key], compact=self.compact))
+
+    def expanded(self, names: List[str], allow: List[str], deny: List[str]):
+        key = self.key(names)
+        return self.cache.get(
+            ("expanded", key, tuple(allow), tuple(deny)),
+            lambda: self.frame(names).expand_files(compose_filter(allow=allow, deny=deny)))
+
+    def filtered(self, names: List[str], allow: List[str], deny: List[str]):
+        if not (allow or deny):
+            return self.frame(names)
+        key = self.key(names)
+        return self.cache.get(
+            ("filtered", key, tuple(allow), tuple(deny)),
+            lambda: self.frame(names).filter_files(compose_filter(allow=allow, deny=deny)))
+
+
+def _int(query: Dict[str, List[str]], name: str, default=None):
+    if name not in query:
+        return default
+    try:
+        return int(query[name][-1])
+    except ValueError:
+        raise RequestError(400, f"{name} must be an integer")
+
+
+def _str(query: Dict[str, List[str]], name: str, default: str) -> str:
+    return query[name][-1] if name in query else default
+
+
+def info_endpoint(datasets: Datasets, query) -> Any:
+    df = datasets.filtered(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    if len(df) == 0:
+        raise RequestError(404, "no data to analyze")
+    return gilot.info(df, timeslot=_str(query, "timeslot", "2W"))
+
+
+def hotspot_endpoint(datasets: Datasets, query) -> Any:
+    df = datasets.expanded(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    result = gilot.get_hotspots(df)[:_int(query, "num", 20)]
+    return result.reset_index().to_dict(orient="records")
+
+
+def authors_endpoint(datasets: Datasets, query) -> Any:
+    from gilot.plotter import _count_commits
+    df = datasets.filtered(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    result = _count_commits(df, top=_int(query, "top", 15), only=query.get("only"))
+    return dict(
+        weeks=[d.isoformat() for d in result.index],
+        commits={c: result[c].astype(int).tolist() for c in result.columns})
+
+
+def hotgraph_endpoint(datasets: Datasets, query) -> Any:
+    from gilot.cochange import build_hotgraph, to_node_link
+    df = datasets.expanded(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    g = build_hotgraph(
+        df,
+        rank=_int(query, "rank", 70),
+        max_nodes=_int(query, "max_nodes"),
+        max_edges=_int(query, "max_edges"),
+        seed=_int(query, "seed", 2020))
+    if g is None:
+        raise RequestError(404, "no co-changed files")
+    return to_node_link(g)
+
+
+def plot_chart(datasets: Datasets, query) -> Any:
+    from gilot.plotter import plot_figure
+    df = datasets.filtered(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    if len(df) == 0:
+        raise RequestError(404, "no data to plot")
+    return plot_figure(
+        df, timeslot=_str(query, "timeslot", "2W"), name=_str(query, "name", "[This Graph]"))
+
+
+def authors_chart(datasets: Datasets, query) -> Any:
+    from gilot.plotter import authors_figure
+    df = datasets.filtered(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    if len(df) == 0:
+        raise RequestError(404, "no data to plot")
+    return authors_figure(
+        df, top=_int(query, "top", 15), name=_str(query, "name", "--"), only=query.get("only"))
+
+
+def hotgraph_chart(datasets: Datasets, query) -> Any:
+    from gilot.cochange import build_hotgraph
+    from gilot.hotgraph import hotgraph_figure
+    df = datasets.expanded(query.get("input", []), query.get("allow", []), query.get("ignore", []))
+    seed = _int(query, "seed", 2020)
+    g = build_hotgraph(
+        df,
+        rank=_int(query, "rank", 70),
+        max_nodes=_int(query, "max_nodes"),
+        max_edges=_int(query, "max_edges"),
+        seed=seed)
+    if g is None:
+        raise RequestError(404, "no co-changed files")
+    return hotgraph_figure(g, layout=_str(query, "layout", "auto"), seed=seed)
+
+
+ENDPOINTS: Dict[str, Callable[[Datasets, Dict[str, List[str]]], Any]] = {
+    "/info": info_endpoint,
+    "/hotspot": hotspot_endpoint,
+    "/authors": authors_endpoint,
+    "/hotgraph": hotgraph_endpoint,
+    "/stats": lambda datasets, query: datasets.cache.stats(),
+}
+
+# /plot.png, /authors.svg のように拡張子で画像の形式を選ぶ
+CHARTS: Dict[str, Callable[[Datasets, Dict[str, List[str]]], Any]] = {
+    "/plot": plot_chart,
+    "/authors": authors_chart,
+    "/hotgraph": hotgraph_chart,
+}
+
+
+class GilotRequestHandler(BaseHTTPRequestHandler):
+    datasets: Datasets
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        chart, ext = os.path.splitext(url.path)
+        try:
+            if chart in CHARTS and ext[1:] in IMAGE_FORMATS:
+                fig = CHARTS[chart](self.datasets, parse_qs(url.query))
+                self._send(200, IMAGE_FORMATS[ext[1:]], figure_to_bytes(fig, ext[1:]))
+                return
+            if url.path not in ENDPOINTS:
+                raise RequestError(404, f"unknown endpoint {url.path}")
+            body = ENDPOINTS[url.path](self.datasets, parse_qs(url.query))
+            self._send_json(200, body)
+        except RequestError as e:
+            self._send_json(e.status, dict(error=str(e)))
+        except Exception as e:
+            logger.exception(e)
+            self._send_json(500, dict(error=str(e)))
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, default=_to_builtin, ensure_ascii=False).encode("utf-8")
+        self._send(status, "application/json; charset=utf-8", data)
+
+    def _send(self, status: int, content_type: str, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class GilotServer(HTTPServer):
+    """
+        リクエストを固定数のスレッドで処理する HTTP サーバ
+    """
+
+    def __init__(self, address: Tuple[str, int], datasets: Datasets,
+                 workers: int = DEFAULT_WORKERS):
+        handler = type("Handler", (GilotRequestHandler,), dict(datasets=datasets))
+        super().__init__(address, handler)
+        self.datasets = datasets
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def serve(host: str = "127.0.0.1", port: int = DEFAULT_PORT, *, data_dir: str = ".",
+          workers: int = DEFAULT_WORKERS, max_datasets: int = DEFAULT_MAX_DATASETS,
+          compact: bool = False) -> None:
+    datasets = Datasets(data_dir, max_datasets, compact=compact)
+    server = GilotServer((host, port), datasets, workers=workers)
+    print(f"serving {server.datasets.data_dir} on http://{host}:{server.server_port}",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
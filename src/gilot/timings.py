@@ -0,0 +1,222 @@
+import functools
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+logger = getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class StageTiming:
+    name: str
+    seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    # ステージ中のピーク RSS。ピークをリセットしない場合はプロセス開始からのピーク
+    peak_rss_mib: Optional[float] = None
+    depth: int = 0
+
+
+def _rows(value: Any) -> Optional[int]:
+    # DataFrame は行数、グラフはノード数、それ以外 (None や複数の戻り値など) は数えない
+    if isinstance(value, tuple):
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _peak_rss_mib() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS はバイト、Linux は KiB
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def _reset_peak_rss() -> None:
+    # Linux ではピーク RSS (VmHWM) を現在の RSS に戻せる。プロセス全体の値を書き換える
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Timings:
+    """
+        ステージごとの経過時間、入出力の行数、ピーク RSS を記録する。
+        入れ子の collect では、内側で記録したステージを外側にも記録する。
+        reset_peak_rss を指定すると、ステージごとにプロセスのピーク RSS をリセットする (内側も従う)。
+    """
+
+    def __init__(self, parent: Optional["Timings"] = None, reset_peak_rss: bool = False):
+        self.stages: List[StageTiming] = []
+        self.parent = parent
+        self.reset_peak_rss: bool = reset_peak_rss or (
+            parent is not None and parent.reset_peak_rss)
+        self._open: List[StageTiming] = []
+        self._offset = parent._depth() if parent else 0
+
+    def _depth(self) -> int:
+        return self._offset + len(self._open)
+
+    def _ancestors_open(self) -> List[StageTiming]:
+        timings: Optional[Timings] = self
+        opened: List[StageTiming] = []
+        while timings is not None:
+            opened.extend(timings._open)
+            timings = timings.parent
+        return opened
+
+    def _add(self, timing: StageTiming) -> None:
+        self.stages.append(timing)
+        if self.parent:
+            self.parent._add(timing)
+
+    def record(self, name: str, seconds: float, **kwargs: Any) -> StageTiming:
+        timing = StageTiming(name=name, seconds=round(seconds, 3), depth=self._depth(), **kwargs)
+        self._add(timing)
+        logger.info(f"{name}: {seconds:.2f}s")
+        return timing
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None) -> Iterator[StageTiming]:
+        """
+            with の中を1つのステージとして測る。rows_out は返されたオブジェクトに設定する
+        """
+        opened = self._ancestors_open()
+        peak = _peak_rss_mib()
+        # 外側のステージのピークを確定させてから、このステージ用にリセットする
+        for outer in opened:
+            outer.peak_rss_mib = max(outer.peak_rss_mib or 0.0, peak or 0.0)
+        if self.reset_peak_rss:
+            _reset_peak_rss()
+        timing = StageTiming(name=name, rows_in=rows_in, depth=self._depth())
+        # 始まった順 (外側が先) に並ぶように、始めた時点で記録しておく
+        self._add(timing)
+        self._open.append(timing)
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds = round(time.perf_counter() - start, 3)
+            peak = _peak_rss_mib()
+            if peak is not None:
+                timing.peak_rss_mib = round(max(timing.peak_rss_mib or 0.0, peak), 1)
+            self._open.remove(timing)
+            for outer in self._ancestors_open():
+                outer.peak_rss_mib = max(outer.peak_rss_mib or 0.0, timing.peak_rss_mib or 0.0)
+            logger.info(f"{name}: {timing.seconds:.2f}s")
+
+    def seconds(self, depth: Optional[int] = None) -> Dict[str, float]:
+        return {s.name: s.seconds for s in self.stages
+                if depth is None or s.depth - self._offset == depth}
+
+    def to_list(self) -> List[dict]:
+        return [asdict(s) for s in self.stages]
+
+    def to_json(self) -> str:
+        return json.dumps(dict(stages=self.to_list()), indent=4)
+
+    def format_table(self) -> str:
+        def number(v: Optional[int]) -> str:
+            return "" if v is None else f"{v:,d}"
+        lines = [f"{'stage':<28} {'seconds':>9} {'rows in':>11} {'rows out':>11} "
+                 f"{'peak RSS MiB':>13}"]
+        for s in self.stages:
+            name = "  " * (s.depth - self._offset) + s.name
+            rss = "" if s.peak_rss_mib is None else f"{s.peak_rss_mib:.1f}"
+            lines.append(f"{name:<28} {s.seconds:>9.3f} {number(s.rows_in):>11} "
+                         f"{number(s.rows_out):>11} {rss:>13}")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[Timings]] = ContextVar("gilot_timings", default=None)
+
+
+@contextmanager
+def collect(reset_peak_rss: bool = False) -> Iterator[Timings]:
+    """
+        with の中で実行した gilot の各ステージを記録する。
+        ピーク RSS は、reset_peak_rss を指定しなければプロセス開始からのピークになる。
+        指定すると Linux ではステージごとのピークになるが、プロセス全体のピークも書き換える。
+
+        with collect() as timings:
+            gilot.get_hotspots(gilot.from_csvs(["repo.csv"]).expand_files())
+        print(timings.format_table())
+    """
+    timings = Timings(parent=_current.get(), reset_peak_rss=reset_peak_rss)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[Optional[StageTiming]]:
+    """
+        collect の中であればステージとして記録する。外では何もしない
+    """
+    timings = _current.get()
+    if timings is None:
+        yield None
+        return
+    with timings.stage(name, rows_in=rows_in) as timing:
+        yield timing
+
+
+def timed(name: str, count_input: bool = True) -> Callable[[F], F]:
+    """
+        関数をステージとして記録するデコレータ。第1引数と戻り値の長さを rows_in / rows_out にする
+    """
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            timings = _current.get()
+            if timings is None:
+                return func(*args, **kwargs)
+            rows_in = _rows(args[0]) if count_input and args else None
+            with timings.stage(name, rows_in=rows_in) as timing:
+                result = func(*args, **kwargs)
+                timing.rows_out = _rows(result)
+            return result
+        return wrapper  # type: ignore
+    return decorator
+
+
+@contextmanager
+def profile(output: Optional[str]) -> Iterator[None]:
+    """
+        output を指定した場合、with の中を cProfile で実行して output に書き出す
+    """
+    if not output:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output)
+        logger.info(f"profile is written to {output}")
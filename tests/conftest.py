@@ -1,2 +1,13 @@
+import os
+import shutil
 import sys
 sys.path.insert(0,"./src")
+
+import pytest
+
+
+@pytest.fixture
+def tempdir():
+    os.makedirs("./temp/", exist_ok=True)
+    yield
+    shutil.rmtree("./temp/")
@@ -1,19 +1,13 @@
 import sys
 import os
-import shutil
 import pytest
-from gilot.app import parser,args_to_duration
+import pandas as pd
+from gilot.app import parser,args_to_duration,compose_filter
+import gilot
 import json
 import subprocess
 
 
-@pytest.fixture
-def tempdir():
-    os.makedirs("./temp/", exist_ok=True)
-    yield
-    shutil.rmtree("./temp/")
-
-
 def test_log_repo():
     a = parser.parse_args(["log","./"])
     assert a.repo == "./"
@@ -38,6 +32,60 @@ def test_log_output():
     assert b.output == sys.__stdout__
 
 
+def test_log_append():
+    a = parser.parse_args(["log","./","--append","old.csv"])
+    assert a.append == "old.csv"
+    b = parser.parse_args(["log","./"])
+    assert b.append is None
+
+
+def test_log_file_filter():
+    a = parser.parse_args(["log","./","--allow-files","*.py","--ignore-files","tests/*"])
+    assert a.allow_files == ["*.py"]
+    assert a.ignore_files == ["tests/*"]
+
+
+@pytest.mark.parametrize("allow, deny", [
+    (["src/*.py"], None),
+    # ワイルドカードのないディレクトリ名は、filter_files と同じくその名前のファイルにしかマッチしない
+    (["src/gilot", "README.md"], None),
+    (None, ["src/gilot"]),
+    (["*.py"], ["tests/*", "setup.py"]),
+])
+def test_log_file_filter_matches_filter_files(tempdir, allow, deny):
+    log = parser.parse_args(["log", "./", "--full", "--month", "60", "--output", "temp/all.csv"])
+    log.handler(log)
+    argv = ["log", "./", "--full", "--month", "60", "--output", "temp/filtered.csv"]
+    argv += ["--allow-files", *allow] if allow else []
+    argv += ["--ignore-files", *deny] if deny else []
+    log = parser.parse_args(argv)
+    log.handler(log)
+
+    expected = gilot.from_csvs(["temp/all.csv"]).filter_files(compose_filter(allow=allow, deny=deny))
+    actual = gilot.from_csvs(["temp/filtered.csv"])
+    assert len(actual) == len(expected)
+    assert actual.drop(columns=["files_json"]).to_csv() == \
+        expected.drop(columns=["files_json"]).to_csv()
+
+
+def test_log_jobs():
+    a = parser.parse_args(["log","./","-j","4"])
+    assert a.jobs == 4
+    b = parser.parse_args(["log","./"])
+    assert b.jobs == 1
+
+
+def test_cache_option():
+    a = parser.parse_args(["log","./","--cache"])
+    assert a.cache
+    assert a.cache_dir is None
+    b = parser.parse_args(["cache","prune","--max-size","10","--cache-dir","temp/cache"])
+    assert b.command == "prune"
+    assert b.repo == "./"
+    assert b.max_size == 10
+    assert b.cache_dir == "temp/cache"
+
+
 def test_log_duration():
     d = args_to_duration(parser.parse_args(["log","./"]))
     assert d.until_text() == "now"
@@ -66,6 +114,17 @@ def test_log_duration():
     assert d.until_text() == "2019-07-01"
 
 
+def test_compose_filter():
+    match = compose_filter(allow=["src/*", "*.rb"], deny=["*.gen.rb", "src/vendor/*"])
+    assert match("src/app.py")
+    assert match("lib/a.rb")
+    assert not match("lib/a.gen.rb")
+    assert not match("src/vendor/x.py")
+    assert not match("README.md")
+    assert compose_filter(allow=None, deny=None)("anything")
+    assert not compose_filter(allow=None, deny=["*"])("anything")
+
+
 def test_hotspot_option():
     a = parser.parse_args(["hotspot","--ignore-files","*.rb"])
     assert a.ignore_files == ["*.rb"]
@@ -76,6 +135,22 @@ def test_hotspot_option():
     assert c.input == ["input.csv"]
 
 
+def test_follow_renames(tempdir):
+    log = parser.parse_args(
+        ["log", "./", "--full", "--renames", "--output", "temp/_renames.csv", "--month", "60"])
+    assert log.renames
+    log.handler(log)
+    hotspot = parser.parse_args(
+        ["hotspot", "-i", "temp/_renames.csv", "--follow-renames", "--csv",
+         "--output", "temp/_hotspot.csv"])
+    assert hotspot.follow_renames
+    hotspot.handler(hotspot)
+    names = pd.read_csv("temp/_hotspot.csv")["file_name"]
+    assert "tests/test_cochange.py" in set(names)
+    assert not names.str.contains(" => ").any()
+    assert not parser.parse_args(["hotgraph"]).follow_renames
+
+
 def test_handlers(tempdir):
     # log をえて、出力
     log = parser.parse_args(["log", "./", "--full", "--output", "temp/_test.csv", "--month", "60"])
@@ -121,6 +196,36 @@ def test_handlers(tempdir):
                                   "./temp/hoge.png"])
     assert hotgraph.handler
 
+    hotgraph = parser.parse_args(["hotgraph",
+                                  "-i",
+                                  "./temp/_test.csv",
+                                  "--max-nodes","10",
+                                  "--max-edges","20",
+                                  "--output",
+                                  "./temp/hoge.png"])
+    assert hotgraph.max_nodes == 10
+    hotgraph.handler(hotgraph)
+
+    hotgraph = parser.parse_args(["hotgraph",
+                                  "-i",
+                                  "./temp/_test.csv",
+                                  "--layout","multilevel",
+                                  "--layout-cache","./temp/layout",
+                                  "--output",
+                                  "./temp/hoge.png"])
+    hotgraph.handler(hotgraph)
+    assert os.path.exists("./temp/layout/layout-multilevel-k0.6-seed2020.json")
+
+    # 描画せずに書き出す
+    hotgraph = parser.parse_args(
+        ["hotgraph", "-i", "./temp/_test.csv", "--output", "./temp/hoge.graphml"])
+    hotgraph.handler(hotgraph)
+    assert os.path.exists("./temp/hoge.graphml")
+    hotgraph = parser.parse_args(
+        ["hotgraph", "-i", "./temp/_test.csv", "--csv", "--output", "./temp/hoge.csv"])
+    hotgraph.handler(hotgraph)
+    assert os.path.exists("./temp/hoge.csv") and os.path.exists("./temp/hoge.nodes.csv")
+
     author = parser.parse_args(["author",
                                 "-i",
                                 "./temp/_test.csv",
@@ -224,3 +329,47 @@ def test_gilot_info_react_csv_matches_readme():
                 assert approx_equal(d1[k], d2[k]), f"Mismatch at {k}: {d1[k]} vs {d2[k]}"
 
     recursive_compare(expected, output)
+
+
+IMPORT_CHECK = """
+import sys
+sys.path.insert(0, "./src")
+sys.argv = {argv!r}
+from gilot.app import main
+try:
+    main()
+except SystemExit:
+    pass
+print("imported:" + ",".join(m for m in {modules!r} if m in sys.modules), file=sys.stderr)
+"""
+
+
+def imported_modules(argv, modules):
+    code = IMPORT_CHECK.format(argv=argv, modules=modules)
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    line = [line for line in result.stderr.splitlines() if line.startswith("imported:")][-1]
+    return [m for m in line[len("imported:"):].split(",") if m]
+
+
+def test_log_help_does_not_import_matplotlib():
+    heavy = ["matplotlib", "seaborn", "networkx", "scipy", "community"]
+    assert imported_modules(["gilot", "log", "--help"], heavy) == []
+    assert imported_modules(["gilot", "hotgraph", "--help"], heavy) == []
+
+
+def test_hotgraph_export_does_not_import_matplotlib(tempdir):
+    log = parser.parse_args(["log", "./", "--full", "--output", "temp/_lazy.csv", "--month", "60"])
+    log.handler(log)
+    argv = ["gilot", "hotgraph", "-i", "temp/_lazy.csv", "-o", "temp/_lazy.graphml"]
+    assert imported_modules(argv, ["matplotlib", "networkx"]) == ["networkx"]
+    assert os.path.exists("temp/_lazy.graphml")
+
+
+def test_lazy_attributes():
+    import gilot
+    assert "plot" in dir(gilot)
+    assert callable(gilot.plot_hotgraph)
+    assert callable(gilot.get_hotspots)
+    with pytest.raises(AttributeError):
+        gilot.no_such_function
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import gilot
+from gilot.app import parser
+from gilot.batch import (ExtractOptions, RepoSpec, extract_many, format_results, read_manifest,
+                         to_specs)
+from gilot.core import Duration
+
+
+def test_to_specs(tempdir):
+    with open("./temp/manifest.txt", "w") as f:
+        f.write("# repositories\n./\n\n./\tfork\n")
+    specs = to_specs(read_manifest("./temp/manifest.txt"))
+    assert specs == [
+        RepoSpec(name=os.path.basename(os.getcwd()), path="./"), RepoSpec(name="fork", path="./")]
+    with pytest.raises(ValueError):
+        to_specs(["./", "./"])
+
+
+def test_extract_many():
+    # 同じリポジトリを別名で2回取り出し、フォークのように同じコミットを持たせる
+    specs = [
+        RepoSpec(name="a", path="./"), RepoSpec(name="b", path="./"),
+        RepoSpec(name="x", path="./none")]
+    options = ExtractOptions(duration=Duration.months(60), full=True)
+    df, results = extract_many(specs, options, workers=2)
+    assert [r.ok for r in results] == [True, True, False]
+    assert "NoSuchPathError" in results[2].error
+    assert results[0].commits == results[1].commits > 0
+    assert list(df["repo"].unique()) == ["a", "b"]
+    assert len(df) == results[0].commits * 2
+    assert "2 succeeded, 1 failed" in format_results(results)
+
+    # repo 列は絞り込みや展開の後も残る
+    assert set(df.filter_files(lambda f: f.endswith(".py"))["repo"]) == {"a", "b"}
+    expanded = df.expand_files()
+    assert (expanded["repo"] == "a").sum() == (expanded["repo"] == "b").sum()
+
+
+def test_log_many(tempdir):
+    args = parser.parse_args(["log-many", "./", "--month", "60", "--full", "-o", "temp/all.csv"])
+    args.handler(args)
+    df = gilot.from_csvs(["temp/all.csv"])
+    assert list(df["repo"].unique()) == [os.path.basename(os.getcwd())]
+
+    args = parser.parse_args(["log-many", "./", "-d", "temp/out", "--month", "60"])
+    args.handler(args)
+    assert os.listdir("temp/out") == [os.path.basename(os.getcwd()) + ".csv"]
+
+    args = parser.parse_args(["log-many", "./", "./none", "-o", "temp/fail.csv"])
+    with pytest.raises(SystemExit):
+        args.handler(args)
+    assert os.path.exists("temp/fail.csv")
+
+
+def test_by_repo(tempdir, capsys):
+    with open("./temp/manifest.txt", "w") as f:
+        f.write("./\ta\n./\tb\n")
+    args = parser.parse_args(
+        ["log-many", "-m", "temp/manifest.txt", "--month", "60", "--full", "-o", "temp/all.csv"])
+    args.handler(args)
+    capsys.readouterr()
+
+    info = parser.parse_args(["info", "-i", "temp/all.csv", "--by-repo"])
+    info.handler(info)
+    assert '"a":' in capsys.readouterr().out
+
+    hotspot = parser.parse_args(
+        ["hotspot", "-i", "temp/all.csv", "--by-repo", "--csv", "-o", "temp/hotspot.csv"])
+    hotspot.handler(hotspot)
+    with open("temp/hotspot.csv") as f:
+        assert "repo" in f.readline()
+
+    author = parser.parse_args(
+        ["author", "-i", "temp/all.csv", "--by-repo", "-o", "temp/author.png"])
+    author.handler(author)
+    assert os.path.exists("temp/author.png")
+
+    # repo 列のないデータではエラーにする
+    log = parser.parse_args(["log", "./", "--month", "60", "-o", "temp/one.csv"])
+    log.handler(log)
+    info = parser.parse_args(["info", "-i", "temp/one.csv", "--by-repo"])
+    with pytest.raises(SystemExit):
+        info.handler(info)
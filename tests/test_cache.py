@@ -0,0 +1,21 @@
+import gilot.core
+from gilot.cache import StatsCache
+from gilot.core import Duration
+
+
+def test_stats_cache(tempdir):
+    duration = Duration.months(60)
+    cache = StatsCache.for_repo("./", cache_dir="./temp/cache")
+    expected = gilot.core.from_dir("./", full=True, duration=duration)
+
+    first = gilot.core.from_dir("./", full=True, duration=duration, cache=cache)
+    assert cache.stats()["commits"] == len(expected)
+    second = gilot.core.from_dir("./", full=True, duration=duration, cache=cache)
+    short = gilot.core.from_dir("./", duration=duration, cache=cache)
+
+    assert first.to_csv() == expected.to_csv()
+    assert second.to_csv() == expected.to_csv()
+    assert short.to_csv() == gilot.core.from_dir("./", duration=duration).to_csv()
+
+    assert cache.prune(0) == len(expected)
+    assert cache.stats()["commits"] == 0
@@ -0,0 +1,184 @@
+import io
+import json
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from gilot.cochange import (build_hotgraph, candidate_floor, cochange_graph, cochange_pairs,
+                            export_hotgraph, nodes_csv_path, plan_threshold,
+                            search_planned_threshold)
+
+
+def sample_df():
+    commits = {
+        "c1": ["a.py", "b.py", "c.py"],
+        "c2": ["a.py", "b.py"],
+        "c3": ["a.py", "b.py", "d.py"],
+        "c4": ["c.py", "d.py"],
+        "c5": ["e.py"],
+    }
+    rows = [(h, f) for h, files in commits.items() for f in files]
+    # 同じコミットが重複していても 1 回として数える
+    rows.append(("c1", "a.py"))
+    return pd.DataFrame(rows, columns=["hexsha", "file_name"])
+
+
+def test_cochange_pairs():
+    pairs = cochange_pairs(sample_df(), 1)
+    assert list(pairs.columns) == ["a", "b", "weight"]
+    assert list(pairs.itertuples(index=False, name=None)) == [
+        ("a.py", "b.py", 3),
+        ("a.py", "c.py", 1),
+        ("a.py", "d.py", 1),
+        ("b.py", "c.py", 1),
+        ("b.py", "d.py", 1),
+        ("c.py", "d.py", 1),
+    ]
+    assert list(cochange_pairs(sample_df(), 2).itertuples(index=False, name=None)) == [
+        ("a.py", "b.py", 3)]
+    assert len(cochange_pairs(sample_df(), 4)) == 0
+
+
+def test_cochange_pairs_top_k():
+    pairs = cochange_pairs(sample_df(), 1, top_k=1)
+    # 各ファイルの最も強い組だけが残る
+    assert list(pairs.itertuples(index=False, name=None)) == [
+        ("a.py", "b.py", 3),
+        ("a.py", "c.py", 1),
+        ("a.py", "d.py", 1),
+    ]
+
+
+def test_cochange_graph():
+    g = cochange_graph(cochange_pairs(sample_df(), 1))
+    assert sorted(g.nodes) == ["a.py", "b.py", "c.py", "d.py"]
+    assert g["a.py"]["b.py"]["weight"] == 3
+    assert g["c.py"]["d.py"]["weight"] == 1
+
+
+def test_plan_threshold():
+    pairs = cochange_pairs(sample_df(), 1)
+    plan = plan_threshold(pairs, max_nodes=4)
+    assert (plan.threshold, plan.nodes, plan.edges) == (1, 4, 6)
+    plan = plan_threshold(pairs, max_edges=5)
+    assert (plan.threshold, plan.nodes, plan.edges) == (2, 2, 1)
+    plan = plan_threshold(pairs, max_nodes=2, max_edges=1)
+    assert plan.threshold == 2
+    # 予測どおりの大きさになる
+    g = cochange_graph(pairs[pairs["weight"] >= plan.threshold])
+    assert (g.number_of_nodes(), g.number_of_edges()) == (plan.nodes, plan.edges)
+
+
+def test_candidate_floor():
+    df = sample_df()
+    assert candidate_floor(df) == 1
+    assert candidate_floor(df, max_nodes=1) == 1
+    # f{i} は i + 1 回変更されている
+    rows = [(f"c{j}", f"f{i}") for i in range(10) for j in range(i + 1)]
+    many = pd.DataFrame(rows, columns=["hexsha", "file_name"])
+    assert candidate_floor(many, max_nodes=1) == 6
+    assert candidate_floor(many, max_nodes=1, max_edges=100) == 6
+    assert candidate_floor(many, max_nodes=2) == 1
+
+
+def brute_force_threshold(df, max_nodes=None, max_edges=None):
+    # すべての閾値でグラフを作り、予算に収まる最小の閾値を探す
+    pairs = cochange_pairs(df, 1)
+    for t in range(1, int(pairs["weight"].max()) + 2):
+        g = cochange_graph(pairs[pairs["weight"] >= t])
+        if ((max_nodes is None or g.number_of_nodes() <= max_nodes)
+                and (max_edges is None or g.number_of_edges() <= max_edges)):
+            return t, g.number_of_nodes(), g.number_of_edges()
+
+
+def test_search_planned_threshold_matches_brute_force():
+    # 単独で何度も変更されるファイルが多く、candidate_floor より小さい閾値でも収まる
+    rows = [(f"s{i}-{j}", f"solo{i}.py") for i in range(20) for j in range(5)]
+    rows += [("p1", "a.py"), ("p1", "b.py")]
+    df = pd.DataFrame(rows, columns=["hexsha", "file_name"])
+    assert candidate_floor(df, max_nodes=2) == 6
+    plan, pairs = search_planned_threshold(df, max_nodes=2)
+    assert (plan.threshold, plan.nodes, plan.edges) == brute_force_threshold(df, max_nodes=2)
+    assert len(pairs) == 1
+
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        files = [f"f{i}.py" for i in range(12)]
+        rows = [(f"c{c}", f) for c in range(40)
+                for f in rng.choice(files, rng.integers(1, 5), replace=False)]
+        df = pd.DataFrame(rows, columns=["hexsha", "file_name"])
+        for max_nodes, max_edges in [(1, None), (3, None), (6, None), (None, 2), (None, 10),
+                                     (5, 4), (12, None)]:
+            plan, pairs = search_planned_threshold(df, max_nodes, max_edges)
+            expected = brute_force_threshold(df, max_nodes, max_edges)
+            if expected[2] == 0:
+                # 空のグラフしか収まらないときは、最も大きい閾値のグラフになる
+                assert plan.edges == 0 or plan.threshold == cochange_pairs(df)["weight"].max()
+                continue
+            assert (plan.threshold, plan.nodes, plan.edges) == expected
+            g = cochange_graph(pairs[pairs["weight"] >= plan.threshold])
+            assert (g.number_of_nodes(), g.number_of_edges()) == expected[1:]
+
+
+def expanded_df():
+    df = sample_df()
+    df["author"] = "x"
+    df["insertions"] = 1
+    df["deletions"] = 0
+    df["lines"] = 1
+    df.index = pd.to_datetime(["2020-01-01"] * len(df))
+    df.index.name = "date"
+    return df
+
+
+def test_build_hotgraph():
+    g = build_hotgraph(expanded_df(), rank=70)
+    assert g.graph["threshold"] == 1
+    assert sorted(g.nodes) == ["a.py", "b.py", "c.py", "d.py"]
+    for (n, d) in g.nodes(data=True):
+        assert set(d) == {"hotspot", "pagerank", "partition_id"}
+    assert build_hotgraph(expanded_df(), max_edges=1).number_of_edges() == 1
+    assert build_hotgraph(expanded_df()[expanded_df()["hexsha"] == "c5"]) is None
+
+
+def test_export_hotgraph(tempdir):
+    g = build_hotgraph(expanded_df())
+
+    export_hotgraph(g, "./temp/g.graphml", "graphml")
+    loaded = nx.read_graphml("./temp/g.graphml")
+    assert sorted(loaded.nodes) == sorted(g.nodes)
+    assert loaded["a.py"]["b.py"]["weight"] == 3
+    assert loaded.nodes["a.py"]["partition_id"] == g.nodes["a.py"]["partition_id"]
+
+    export_hotgraph(g, "./temp/g.json", "json")
+    with open("./temp/g.json") as f:
+        data = json.load(f)
+    assert {n["id"] for n in data["nodes"]} == set(g.nodes)
+    assert len(data["links"]) == g.number_of_edges()
+    assert {(e["source"], e["target"]): e["weight"] for e in data["links"]}[("a.py", "b.py")] == 3
+
+    export_hotgraph(g, "./temp/g.csv", "csv")
+    edges = pd.read_csv("./temp/g.csv")
+    nodes = pd.read_csv(nodes_csv_path("./temp/g.csv"), index_col="file_name")
+    assert list(edges.columns) == ["source", "target", "weight"]
+    assert len(edges) == g.number_of_edges()
+    assert list(nodes.columns) == ["hotspot", "pagerank", "partition_id"]
+    assert sorted(nodes.index) == sorted(g.nodes)
+
+    out = io.StringIO()
+    export_hotgraph(g, out, "csv")
+    assert out.getvalue().startswith("source,target,weight")
+
+
+def test_export_hotgraph_graphml_to_stream():
+    g = build_hotgraph(expanded_df())
+    # 標準出力と同じテキストのストリームにも、バイナリのストリームにも書ける
+    text = io.StringIO()
+    export_hotgraph(g, text, "graphml")
+    binary = io.BytesIO()
+    export_hotgraph(g, binary, "graphml")
+    assert text.getvalue().encode("utf-8") == binary.getvalue()
+    loaded = nx.read_graphml(io.BytesIO(binary.getvalue()))
+    assert sorted(loaded.nodes) == sorted(g.nodes)
+    assert loaded["a.py"]["b.py"]["weight"] == 3
@@ -1,18 +1,8 @@
 import gilot.core
-import pytest
-import os
-import shutil
 from fnmatch import fnmatch
 from gilot.core import Duration
 
 
-@pytest.fixture
-def tempdir():
-    os.makedirs("./temp/", exist_ok=True)
-    yield
-    shutil.rmtree("./temp/")
-
-
 def echo(p):
     assert isinstance(p,Duration)
     return p
@@ -61,3 +51,250 @@ def test_expander_with_filter():
     assert (len(edf["file_name"]) > 0)
     assert (len(odf["file_name"]) > 0)
     assert (len(odf["file_name"]) > len(edf["file_name"]))
+
+
+def test_parse_log():
+    stream = [
+        b"\x01aaa\x00bbb ccc\x001590000000\x00alice\x00",
+        b"\x01bbb\x00ddd\x001580000000\x00bob\x00\n",
+        b":100644 100644 0000000 1111111 M\x00src/a.py\x00",
+        b":000000 100644 0000000 2222222 A\x00img.png\x00",
+        b"3\t1\tsrc/a.py\x00-\t-\timg.png\x00",
+    ]
+    entries = list(gilot.core.parse_log(stream))
+    assert [e.hexsha for e in entries] == ["aaa", "bbb"]
+    assert gilot.core.is_merge(entries[0])
+    assert entries[1].files == {
+        "src/a.py": dict(insertions=3, deletions=1, lines=4, change_type="M"),
+        "img.png": dict(insertions=0, deletions=0, lines=0, change_type="A"),
+    }
+
+    merge = gilot.core.CommitRecord.from_log_entry(entries[0], full=True)
+    assert (merge.lines, merge.files, merge.files_json) == (0, 0, "{}")
+    record = gilot.core.CommitRecord.from_log_entry(entries[1])
+    assert (record.insertions, record.deletions, record.lines, record.files) == (3, 1, 4, 2)
+    assert record.files_json is None
+
+
+def test_parse_log_renames():
+    stream = [
+        b"\x01aaa\x00bbb\x001590000000\x00alice\x00\n",
+        b":100644 100644 0000000 1111111 R090\x00src/old.py\x00src/new.py\x00",
+        b":100644 100644 0000000 2222222 M\x00README.md\x00",
+        b"2\t1\t\x00src/old.py\x00src/new.py\x001\t0\tREADME.md\x00",
+    ]
+    entries = list(gilot.core.parse_log(stream))
+    assert entries[0].files == {
+        "src/old.py => src/new.py": dict(insertions=2, deletions=1, lines=3, change_type="R"),
+        "README.md": dict(insertions=1, deletions=0, lines=1, change_type="M"),
+    }
+
+
+def test_from_dir_renames():
+    # tests/test_hotgraph.py は tests/test_cochange.py にリネームされている
+    df = gilot.core.from_dir("./", full=True, renames=True, duration=Duration.months(60))
+    names = set(df.expand_files()["file_name"])
+    assert "tests/test_hotgraph.py => tests/test_cochange.py" in names
+    followed = set(df.expand_files(follow_renames=True)["file_name"])
+    assert "tests/test_hotgraph.py" not in followed and "tests/test_cochange.py" in followed
+    assert not any(" => " in name for name in followed)
+    # コミットは同じで、リネームしたファイルの行数は差分だけになる
+    plain = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    assert df["insertions"].sum() <= plain["insertions"].sum()
+    assert list(df["hexsha"]) == list(plain["hexsha"])
+
+
+def test_log_entries_match_commit_stats():
+    duration = Duration.months(60)
+    repo = gilot.core.Repo.from_dir("./", branch="origin/HEAD")
+    for full in (False, True):
+        expected = gilot.core.CommitDataFrame.from_commits(list(repo.commits(duration)), full=full)
+        actual = gilot.core.from_dir("./", full=full, duration=duration)
+        assert actual.to_csv() == expected.to_csv()
+
+
+def test_append_dir(tempdir):
+    duration = Duration.months(60)
+    df = gilot.core.from_dir("./", full=True, duration=duration)
+    df[1:].to_csv("./temp/old.csv")
+    appended = gilot.core.append_dir(
+        gilot.core.from_csv("./temp/old.csv"), "./", full=True, duration=duration)
+    assert appended.to_csv() == df.to_csv()
+
+    trimmed = df.trim(Duration.range("2000-01-01", "2000-02-01"))
+    assert len(trimmed) == 0
+
+
+def test_from_dir_jobs():
+    duration = Duration.months(60)
+    expected = gilot.core.from_dir("./", full=True, duration=duration)
+    actual = gilot.core.from_dir("./", full=True, duration=duration, jobs=2)
+    assert actual.to_csv() == expected.to_csv()
+
+
+def test_expand_files_columns():
+    import json
+    import pandas as pd
+    files = [
+        {"a.py": dict(insertions=1, deletions=2, lines=3),
+         "b.js": dict(insertions=4, deletions=0, lines=4)},
+        {},
+        {"a.py": dict(insertions=5, deletions=5, lines=10)},
+    ]
+    df = gilot.core.CommitDataFrame.from_dataframe(pd.DataFrame(dict(
+        date=["2020-01-03", "2020-01-02", "2020-01-01"],
+        hexsha=["c", "b", "a"],
+        author=["x", "y", "z"],
+        insertions=[5, 0, 5], deletions=[2, 0, 5], lines=[7, 0, 10], files=[2, 0, 1],
+        files_json=[json.dumps(f) for f in files])))
+
+    edf = df.expand_files()
+    assert list(edf.columns) == [
+        "hexsha", "author", "file_name", "insertions", "deletions", "lines"]
+    assert edf["hexsha"].tolist() == ["c", "c", "a"]
+    assert edf["file_name"].tolist() == ["a.py", "b.js", "a.py"]
+    assert edf["lines"].tolist() == [3, 4, 10]
+    expected_dates = pd.to_datetime(["2020-01-03", "2020-01-03", "2020-01-01"])
+    assert edf.index.tolist() == expected_dates.tolist()
+
+    seen = []
+
+    def is_match(file_name):
+        seen.append(file_name)
+        return file_name.endswith(".py")
+
+    assert df.expand_files(is_match)["author"].tolist() == ["x", "z"]
+    assert sorted(seen) == ["a.py", "b.js"]
+
+
+def test_expand_files_follow_renames():
+    import json
+    import pandas as pd
+    files = [
+        {"src/{b => c}/x.py": 2, "README.md": 1},
+        {"src/a/x.py => src/b/x.py": 3},
+        {"src/a/x.py": 4, "other.py": 5},
+    ]
+    df = gilot.core.CommitDataFrame.from_dataframe(pd.DataFrame(dict(
+        date=["2020-03-01", "2020-02-01", "2020-01-01"],
+        hexsha=["c3", "c2", "c1"],
+        author=["a", "b", "a"],
+        insertions=[3, 3, 9], deletions=[0, 0, 0], lines=[3, 3, 9], files=[2, 1, 2],
+        files_json=[json.dumps({k: dict(insertions=v, deletions=0, lines=v, change_type="M")
+                                for k, v in f.items()}) for f in files])))
+    expanded = df.expand_files(follow_renames=True)
+    assert expanded.groupby("file_name")["lines"].sum().to_dict() == {
+        "src/c/x.py": 9, "README.md": 1, "other.py": 5}
+    # リネームなしでは、リネームの式も別のファイルとして数える
+    assert df.expand_files()["file_name"].nunique() == 5
+    # フィルタは最新の名前で判定する
+    followed = df.expand_files(lambda f: f.startswith("src/c/"), follow_renames=True)
+    assert set(followed["hexsha"]) == {"c1", "c2", "c3"}
+    compact = df.compact().expand_files(follow_renames=True)
+    assert compact["file_name"].tolist() == expanded["file_name"].tolist()
+
+    # リポジトリごとに別々にたどる
+    other = df.assign(repo="other", files_json=[json.dumps({"src/a/x.py": dict(
+        insertions=1, deletions=0, lines=1, change_type="M")})] * 3)
+    both = gilot.core.CommitDataFrame(pd.concat([df.assign(repo="main"), other]))
+    names = both.expand_files(follow_renames=True).groupby("repo")["file_name"].unique()
+    assert set(names["main"]) == {"src/c/x.py", "README.md", "other.py"}
+    assert set(names["other"]) == {"src/a/x.py"}
+
+
+def test_filter_files():
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    filtered = df.filter_files(lambda file_name: file_name.endswith(".py"))
+    expanded = df.expand_files(lambda file_name: file_name.endswith(".py"))
+    assert filtered["lines"].sum() == expanded["lines"].sum()
+    assert filtered["files"].sum() == len(expanded)
+    assert filtered["files_json"].isna().all()
+
+    short = gilot.core.from_dir("./", duration=Duration.months(60))
+    assert short.filter_files(lambda file_name: False).to_csv() == short.to_csv()
+
+
+def test_from_dir_pathspecs():
+    def is_match(file_name):
+        return fnmatch(file_name, "*.py") and not fnmatch(file_name, "tests/*")
+
+    duration = Duration.months(60)
+    expected = gilot.core.from_dir("./", full=True, duration=duration).filter_files(is_match)
+    pathspecs = gilot.core.to_pathspecs(["*.py"], ["tests/*"])
+    assert pathspecs == ["*.py", ":(exclude)tests/*"]
+    actual = gilot.core.from_dir("./", duration=duration, pathspecs=pathspecs)
+    assert actual.drop(columns=["files_json"]).to_csv() == \
+        expected.drop(columns=["files_json"]).to_csv()
+
+
+def test_from_csvs_chunked(tempdir):
+    import pandas as pd
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    df.to_csv("./temp/all.csv")
+    df[::2].to_csv("./temp/half.csv")
+    names = ["./temp/half.csv", "./temp/all.csv"]
+
+    frames = pd.concat([pd.read_csv(i) for i in names])
+    expected = gilot.core.CommitDataFrame.from_dataframe(frames.drop_duplicates(subset=["hexsha"]))
+    # チャンクをまたいだ重複も、先に読んだ行だけが残る
+    actual = gilot.core.from_csvs(names, chunksize=3)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual["author"].dtype == object
+
+    projected = gilot.core.from_csvs(names, columns=gilot.core.SUMMARY_COLUMNS, chunksize=3)
+    assert "files_json" not in projected.columns
+    pd.testing.assert_frame_equal(projected, expected.drop(columns=["files_json"]))
+
+
+def test_compact(tempdir):
+    import pandas as pd
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    df.to_csv("./temp/self.csv")
+    compact = df.compact()
+    assert compact.is_compact and not df.is_compact
+    assert "files_json" not in compact.columns
+    assert compact["author"].dtype == "category"
+    assert compact["lines"].dtype == "int32"
+    assert compact.file_table["hexsha"].cat.categories.equals(compact["hexsha"].cat.categories)
+
+    loaded = gilot.core.from_csvs(["./temp/self.csv"], compact=True, chunksize=3)
+    pd.testing.assert_frame_equal(loaded, compact)
+    pd.testing.assert_frame_equal(loaded.file_table, compact.file_table)
+
+    def is_match(file_name):
+        return file_name.endswith(".py")
+
+    expected = df.expand_files(is_match)
+    actual = compact.expand_files(is_match)
+    assert actual["hexsha"].astype(str).tolist() == expected["hexsha"].tolist()
+    assert actual["lines"].tolist() == expected["lines"].tolist()
+    assert (actual.index == expected.index).all()
+    filtered = df.filter_files(is_match)["lines"].tolist()
+    assert compact.filter_files(is_match)["lines"].tolist() == filtered
+
+    # --full なしのデータは files_json を残す
+    short = gilot.core.from_dir("./", duration=Duration.months(60))
+    short.to_csv("./temp/short.csv")
+    short_compact = gilot.core.from_csvs(["./temp/short.csv"], compact=True)
+    assert short_compact.file_table is None
+    assert short_compact["files_json"].isna().all()
+    assert len(short_compact.filter_files(is_match)) == len(short.filter_files(is_match))
+
+
+def test_compact_aggregations():
+    import datetime
+    import pandas as pd
+    from gilot import plotter
+    from gilot.hotspot import get_hotspots
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    compact = df.compact()
+
+    assert plotter.info(compact)["output"] == plotter.info(df)["output"]
+    pd.testing.assert_frame_equal(
+        plotter._in_sprint(compact), plotter._in_sprint(df), check_dtype=False)
+    assert (plotter._count_commits(compact).values == plotter._count_commits(df).values).all()
+
+    now = datetime.datetime(2030, 1, 1)
+    pd.testing.assert_frame_equal(
+        get_hotspots(compact.expand_files(), now=now),
+        get_hotspots(df.expand_files(), now=now), check_dtype=False)
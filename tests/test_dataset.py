@@ -0,0 +1,55 @@
+from fnmatch import fnmatch
+
+import pandas as pd
+import pytest
+
+import gilot.core
+from gilot.core import Duration
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.mark.parametrize("ext", ["parquet", "feather"])
+def test_dataset_roundtrip(tempdir, ext):
+    def is_match(file_name):
+        return fnmatch(file_name, "*.py")
+
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    df.to_csv("./temp/self.csv")
+    df.save(f"./temp/self.{ext}")
+
+    csv_df = gilot.core.from_csvs(["./temp/self.csv"])
+    dataset_df = gilot.core.from_csvs([f"./temp/self.{ext}"])
+    assert dataset_df.file_table is not None
+    assert "files_json" not in dataset_df.columns
+    assert dataset_df.expand_files().equals(csv_df.expand_files())
+    assert dataset_df.expand_files(is_match).equals(csv_df.expand_files(is_match))
+    assert dataset_df.filter_files(is_match).to_csv() == csv_df.filter_files(is_match).to_csv()
+
+    mixed = gilot.core.from_csvs([f"./temp/self.{ext}", "./temp/self.csv"])
+    assert len(mixed) == len(csv_df)
+    assert mixed.expand_files().equals(csv_df.expand_files())
+
+
+def test_dataset_without_files(tempdir):
+    df = gilot.core.from_dir("./", duration=Duration.months(60))
+    df.to_csv("./temp/self.csv")
+    df.save("./temp/self.parquet")
+    assert gilot.core.from_csvs(["./temp/self.parquet"]).to_csv() == \
+        gilot.core.from_csvs(["./temp/self.csv"]).to_csv()
+
+
+def test_dataset_with_repo(tempdir):
+    # 同じコミットを持つ2つのリポジトリをまとめたデータ
+    df = gilot.core.from_dir("./", full=True, duration=Duration.months(60))
+    both = gilot.core.CommitDataFrame(pd.concat([df.assign(repo="a"), df.assign(repo="b")]))
+    both.to_csv("./temp/both.csv")
+    both.save("./temp/both.parquet")
+
+    csv_df = gilot.core.from_csvs(["./temp/both.csv"])
+    dataset_df = gilot.core.from_csvs(["./temp/both.parquet"])
+    assert len(dataset_df) == len(csv_df) == 2 * len(df)
+    assert list(dataset_df["repo"]) == list(csv_df["repo"])
+    expanded = dataset_df.expand_files()
+    assert len(expanded) == len(csv_df.expand_files())
+    assert (expanded["repo"] == "a").sum() == (expanded["repo"] == "b").sum()
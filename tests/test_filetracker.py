@@ -0,0 +1,34 @@
+from gilot.filetracker import FileTracker, match
+
+
+def test_match():
+    assert match("a.py => b.py") == ("a.py", "b.py")
+    assert match("src/{old => new}/a.py") == ("src/old/a.py", "src/new/a.py")
+    assert match("src/a.py") is None
+
+
+def test_newest_name():
+    # git log と同じく新しい順
+    tracker = FileTracker.create(["src/{b => c}/x.py", "src/a/x.py => src/b/x.py", "README.md"])
+    assert tracker.newest_name("src/a/x.py") == "src/c/x.py"
+    assert tracker.newest_name("src/a/x.py => src/b/x.py") == "src/c/x.py"
+    assert tracker.newest_name("src/c/x.py") == "src/c/x.py"
+    assert tracker.newest_name("README.md") == "README.md"
+
+
+def test_cyclic_rename():
+    # a => b => a と戻した場合は、最新のリネームが優先される
+    tracker = FileTracker.create(["b => a", "a => b"])
+    assert tracker.newest_name("a") == "a"
+    assert tracker.newest_name("b") == "a"
+    assert FileTracker(track_map={"a": "b", "b": "a"}).newest_name("a") in ["a", "b"]
+
+
+def test_long_rename_chain():
+    # 再帰の上限より長い連鎖も引け、1度引いた後は直接最新の名前を指す
+    n = 50000
+    tracker = FileTracker.create([f"f{i} => f{i + 1}" for i in reversed(range(n))])
+    assert tracker.newest_name("f0") == f"f{n}"
+    assert tracker.track_map["f0"] == f"f{n}"
+    assert tracker.track_map[f"f{n // 2}"] == f"f{n}"
+    assert all(tracker.newest_name(f"f{i}") == f"f{n}" for i in range(n))
@@ -0,0 +1,34 @@
+import datetime
+
+import pandas as pd
+
+from gilot.hotspot import get_hotspots
+
+
+def test_get_hotspots():
+    # 先頭と末尾の行は remove_outer_lines で外れ値として除かれる
+    dates = pd.to_datetime(
+        ["2020-06-01"] * 4 + ["2020-01-01"] * 3 + ["2019-01-01"] * 4)
+    df = pd.DataFrame(dict(
+        hexsha=["o", "a", "a", "b", "c", "c", "d", "e", "f", "f", "p"],
+        author=["w", "x", "x", "y", "x", "x", "y", "z", "z", "z", "w"],
+        file_name=["min", "new.py", "both.py", "new.py", "both.py", "old.py", "old.py",
+                   "x", "y", "x", "max"],
+        insertions=[1, 10, 10, 10, 10, 10, 10, 10, 10, 10, 1000],
+        deletions=[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+        lines=[1, 10, 10, 10, 10, 10, 10, 10, 10, 10, 1000],
+    ), index=dates)
+    df.index.name = "date"
+    before = df.copy()
+
+    now = datetime.datetime(2020, 6, 2)
+    result = get_hotspots(df, now=now)
+    assert df.equals(before)
+    assert result.equals(get_hotspots(df, now=now))
+    assert list(result.columns) == ["hotspot", "commits", "authors", "edit_rate", "lines"]
+    assert "min" not in result.index and "max" not in result.index
+    assert result.index[0] == "new.py"
+    assert result.loc["new.py", "commits"] == 2
+    assert result.loc["new.py", "authors"] == 2
+    assert result.loc["both.py", "lines"] == 20
+    assert result.loc["x", "hotspot"] < 1e-3
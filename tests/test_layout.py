@@ -0,0 +1,45 @@
+import os
+
+import networkx as nx
+
+from gilot.layout import LayoutCache, compute_layout, layout_graph, node_digest
+
+
+def sample_graph():
+    g = nx.Graph()
+    for group in range(4):
+        nodes = [f"g{group}/f{i}.py" for i in range(6)]
+        g.add_weighted_edges_from((a, b, 2) for a, b in zip(nodes, nodes[1:]))
+        g.add_edge(nodes[0], f"g{(group + 1) % 4}/f0.py", weight=1)
+    return g
+
+
+def test_compute_layout():
+    g = sample_graph()
+    for layout in ["auto", "spring", "spectral", "multilevel"]:
+        pos = compute_layout(g, layout=layout, seed=1)
+        assert set(pos) == set(g.nodes)
+        again = compute_layout(g, layout=layout, seed=1)
+        assert all((pos[n] == again[n]).all() for n in g.nodes)
+
+
+def test_layout_cache(tempdir):
+    cache = LayoutCache("./temp/layout")
+    g = sample_graph()
+    assert cache.load(g, "spring", 0.6, 1) == (None, False)
+
+    pos = layout_graph(g, layout="spring", k=0.6, seed=1, cache=cache)
+    assert os.path.exists(cache.path("spring", 0.6, 1))
+    cached, exact = cache.load(g, "spring", 0.6, 1)
+    assert exact
+    assert all((cached[n] == pos[n]).all() for n in g.nodes)
+    reused = layout_graph(g, layout="spring", k=0.6, seed=1, cache=cache)
+    assert all((reused[n] == cached[n]).all() for n in g.nodes)
+
+    # ノードが変わった場合は再計算して保存し直す
+    g.add_edge("g0/f0.py", "new.py", weight=1)
+    assert not cache.load(g, "spring", 0.6, 1)[1]
+    pos = layout_graph(g, layout="spring", k=0.6, seed=1, cache=cache)
+    assert "new.py" in pos
+    assert cache.load(g, "spring", 0.6, 1)[1]
+    assert node_digest(g) != node_digest(sample_graph())
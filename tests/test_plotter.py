@@ -0,0 +1,135 @@
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import gilot
+from gilot.core import Duration
+from gilot.plotter import _commit_ratio, _count_commits, _top_authors, gini, lorenz
+from gilot.render import figure_to_bytes
+
+
+def reference_gini(x):
+    mad = np.abs(np.subtract.outer(x, x)).mean()
+    return 0.5 * mad / np.mean(x)
+
+
+def reference_lorenz(v):
+    x = np.linspace(0., 100., 21)
+    total = np.sum(v, dtype=np.float64)
+    return x, [(np.sum(v[v <= np.percentile(v, xi)]) / total) * 100.0 for xi in x]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_gini_lorenz_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    for v in [
+        rng.integers(0, 1000, size=13),
+        rng.integers(0, 5, size=40),
+        rng.exponential(100.0, size=101),
+        np.array([0, 0, 0, 7]),
+        np.array([3]),
+    ]:
+        assert np.isclose(gini(v), reference_gini(v))
+        x, y = lorenz(v)
+        ex, ey = reference_lorenz(v)
+        assert np.allclose(x, ex)
+        assert np.allclose(y, ey)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_weighted_gini_lorenz(seed):
+    # 重み付きの結果は、値を重みの数だけ並べたときの結果と同じ
+    rng = np.random.default_rng(seed)
+    for v, w in [
+        (rng.integers(1, 100, size=30), rng.integers(1, 5, size=30)),
+        (rng.integers(0, 5, size=40), rng.integers(0, 4, size=40)),
+        (rng.exponential(100.0, size=17), rng.integers(1, 10, size=17)),
+        (np.array([0, 0, 7]), np.array([5, 1, 2])),
+        (np.array([3]), np.array([4])),
+    ]:
+        assert np.isclose(gini(v, weights=w), reference_gini(np.repeat(v, w)))
+        x, y = lorenz(v, weights=w)
+        ex, ey = reference_lorenz(np.repeat(v, w))
+        assert np.allclose(x, ex)
+        assert np.allclose(y, ey)
+    v = rng.integers(1, 100, size=30)
+    assert np.isclose(gini(v, weights=np.ones(30)), gini(v))
+    assert np.allclose(lorenz(v, weights=np.ones(30))[1], lorenz(v)[1])
+    assert gini(np.ones(10)) == 0
+
+
+def reference_count_commits(df, top=15, only=None):
+    authors = only if only else _top_authors(df, top)
+    index = df.resample("1W").size().index
+    result = pd.DataFrame([], index=index, columns=[*authors, 'Others'])
+    for a in authors:
+        result[a] = df["hexsha"][df.author == a].resample("1W").nunique()
+    result["Others"] = df["hexsha"][~df.author.isin(authors)].resample("1W").nunique()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        result.fillna(value=0, inplace=True)
+    return result
+
+
+def reference_commit_ratio(df):
+    def ratio(s):
+        total = np.sum(s)
+        if total == 0:
+            return s * 0.0
+        return s / total
+    return df.apply(ratio, axis=1)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_count_commits_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    n = 400
+    dates = pd.to_datetime("2020-01-01") + pd.to_timedelta(rng.integers(0, 300, n), unit="D")
+    df = pd.DataFrame(dict(
+        hexsha=[f"h{i}" for i in rng.integers(0, 300, n)],
+        author=rng.choice(list("abcdefgh"), n, p=[.3, .2, .1, .1, .1, .1, .05, .05]),
+        lines=1,
+    ), index=pd.DatetimeIndex(dates, name="date")).sort_index()
+    # 期間の途中で止まった作者と、途中から来た作者
+    late = df.index > "2020-06-01"
+    df.loc[late, "author"] = df.loc[late, "author"].replace("b", "a")
+    early = df.index < "2020-03-01"
+    df.loc[early, "author"] = df.loc[early, "author"].replace("c", "a")
+
+    for kw in [dict(top=3), dict(top=None), dict(top=20),
+               dict(only=["a", "nobody"]), dict(only=["h"])]:
+        expected = reference_count_commits(df, **kw)
+        actual = _count_commits(df, **kw)
+        # 列ごとの型も含めて、作者ごとに resample していたときと同じ
+        pd.testing.assert_frame_equal(actual, expected)
+        assert actual.equals(expected)
+
+        ratio = _commit_ratio(actual)
+        pd.testing.assert_frame_equal(ratio, reference_commit_ratio(expected))
+
+    zero = pd.DataFrame(dict(a=[0, 1], b=[0, 3]))
+    assert _commit_ratio(zero).equals(reference_commit_ratio(zero))
+
+
+def test_figures_without_pyplot():
+    import matplotlib.pyplot as plt
+    df = gilot.from_dir("./", duration=Duration.months(60))
+    figures = plt.get_fignums()
+    fig = gilot.plot_figure(df, name="self")
+    assert fig.axes and plt.get_fignums() == figures
+    assert figure_to_bytes(fig).startswith(b"\x89PNG")
+    with pytest.raises(ValueError):
+        figure_to_bytes(fig, "gif")
+
+    # 別々のスレッドで描画しても、1つずつ描いたときと同じ画像になる
+    def render(kind):
+        fig = gilot.plot_figure(df) if kind == "plot" else gilot.authors_figure(df, top=5)
+        return figure_to_bytes(fig, dpi=50)
+    kinds = ["plot", "author"] * 3
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(render, kinds))
+    assert results == [render(kind) for kind in kinds]
+    assert plt.get_fignums() == figures
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pandas as pd
+
+import gilot
+from gilot.core import Duration
+from gilot.report import ReportOptions, decode_files_once, make_report
+
+
+def test_make_report(tempdir):
+    df = gilot.from_dir("./", full=True, duration=Duration.months(60))
+    df.to_csv("./temp/self.csv")
+
+    def is_match(file_name):
+        return file_name.endswith(".py")
+
+    options = ReportOptions(name="self", fmt="svg", workers=2)
+    metadata = make_report(["./temp/self.csv"], "./temp/report", options, is_match=is_match)
+    with open("./temp/report/report.json") as f:
+        assert json.load(f) == metadata
+    for name in metadata["files"].values():
+        assert os.path.getsize(os.path.join("./temp/report", name)) > 0
+    assert metadata["files"]["plot"] == "plot.svg"
+    for stage in ["load", "filter", "expand", "info", "hotspot",
+                  "render_plot", "render_author", "total"]:
+        assert stage in metadata["timings"]
+
+    expected = df.filter_files(is_match)
+    assert metadata["commits"] == len(expected)
+    with open("./temp/report/info.json") as f:
+        assert json.load(f)["output"] == gilot.info(expected)["output"]
+    hotspots = pd.read_csv("./temp/report/hotspot.csv", index_col=0)
+    assert list(hotspots.index) == list(gilot.get_hotspots(df.expand_files(is_match)).index)
+    assert all(is_match(name) for name in hotspots.index)
+
+
+def test_make_report_without_data(tempdir):
+    empty = gilot.from_dir("./", duration=Duration.range("2000-01-01", "2000-02-01"))
+    empty.to_csv("./temp/empty.csv")
+    assert make_report(["./temp/empty.csv"], "./temp/report", ReportOptions()) is None
+    assert not os.path.exists("./temp/report")
+
+
+def test_make_report_without_files(tempdir):
+    # --full なしの log には files_json がないので、hotspot と hotgraph は作らない
+    gilot.from_dir("./", duration=Duration.months(60)).to_csv("./temp/short.csv")
+    metadata = make_report(["./temp/short.csv"], "./temp/short", ReportOptions(workers=1))
+    assert metadata["skipped"] == ["hotspot", "hotgraph"]
+    assert sorted(metadata["files"]) == ["author", "info", "plot"]
+    assert not os.path.exists("./temp/short/hotspot.csv")
+    assert metadata["hotgraph"] is None
+
+    # どのファイルにも一致しないフィルタではコミットも残らない
+    gilot.from_dir("./", full=True, duration=Duration.months(60)).to_csv("./temp/self.csv")
+    metadata = make_report(["./temp/self.csv"], "./temp/none", ReportOptions(workers=1),
+                           is_match=lambda name: False)
+    assert metadata["commits"] == 0 and metadata["file_rows"] == 0
+    assert metadata["skipped"] == ["hotspot", "hotgraph", "plot", "author"]
+    assert sorted(os.listdir("./temp/none")) == ["info.json", "report.json"]
+
+
+def test_decode_files_once():
+    full = gilot.from_dir("./", full=True, duration=Duration.months(60))
+    decoded = decode_files_once(full)
+    assert decoded.file_table is not None and full.file_table is None
+    assert decoded.expand_files().equals(full.expand_files())
+
+    # ファイル情報がないデータはそのまま
+    short = gilot.from_dir("./", duration=Duration.months(60))
+    assert decode_files_once(short).file_table is None
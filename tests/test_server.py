@@ -0,0 +1,124 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gilot.app import parser
+from gilot.server import Datasets, DatasetCache, GilotServer
+
+
+@pytest.fixture
+def server(tempdir):
+    log = parser.parse_args(["log", "./", "--full", "--output", "temp/repo.csv", "--month", "60"])
+    log.handler(log)
+    server = GilotServer(("127.0.0.1", 0), Datasets("./temp", max_entries=4), workers=4)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def get(server, path):
+    # ダッシュボードの代わりにリクエストするクライアント
+    url = f"http://127.0.0.1:{server.server_port}{path}"
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_dataset_cache():
+    cache = DatasetCache(max_entries=2)
+    assert cache.get("a", lambda: 1) == 1
+    assert cache.get("a", lambda: 2) == 1
+    cache.get("b", lambda: 2)
+    cache.get("c", lambda: 3)
+    assert cache.get("a", lambda: 4) == 4
+    assert cache.stats() == dict(entries=2, max_entries=2, hits=1, misses=4)
+
+
+def test_serve(server):
+    status, info = get(server, "/info?input=repo.csv")
+    assert status == 200
+    assert set(["gini", "output", "since", "until"]) <= set(info)
+
+    status, hotspots = get(server, "/hotspot?input=repo.csv&num=5&allow=*.py")
+    assert status == 200
+    assert 0 < len(hotspots) <= 5
+    assert all(h["file_name"].endswith(".py") for h in hotspots)
+
+    status, authors = get(server, "/authors?input=repo.csv&top=3")
+    assert status == 200
+    assert len(authors["commits"]["Others"]) == len(authors["weeks"])
+
+    status, graph = get(server, "/hotgraph?input=repo.csv&max_nodes=10")
+    assert status == 200
+    assert 0 < len(graph["nodes"]) <= 10
+
+    # 2回目以降はキャッシュから返す
+    stats = get(server, "/stats")[1]
+    get(server, "/info?input=repo.csv")
+    assert get(server, "/stats")[1]["hits"] > stats["hits"]
+
+    # 同時のリクエストもワーカーで処理する
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: get(server, "/info?input=repo.csv"), range(16)))
+    assert all(r == (200, info) for r in results)
+
+
+def test_serve_errors(server):
+    assert get(server, "/info")[0] == 400
+    assert get(server, "/info?input=none.csv")[0] == 404
+    assert get(server, "/info?input=../README.md")[0] == 403
+    assert get(server, "/hotspot?input=repo.csv&num=x")[0] == 400
+    assert get(server, "/unknown")[0] == 404
+
+
+def test_serve_reloads_updated_file(server):
+    before = get(server, "/info?input=repo.csv")[1]
+    stats = get(server, "/stats")[1]
+    os.utime("./temp/repo.csv", ns=(0, 0))
+    assert get(server, "/info?input=repo.csv")[1] == before
+    assert get(server, "/stats")[1]["misses"] == stats["misses"] + 1
+
+
+def test_serve_option():
+    args = parser.parse_args(["serve", "--port", "0", "--data-dir", "temp", "-j", "2"])
+    assert (args.port, args.data_dir, args.workers, args.max_datasets) == (0, "temp", 2, 8)
+    assert args.handler
+
+
+def test_serve_charts(server):
+    def fetch(path):
+        url = f"http://127.0.0.1:{server.server_port}{path}"
+        with urllib.request.urlopen(url) as response:
+            return response.headers["Content-Type"], response.read()
+
+    paths = ["/plot.png?input=repo.csv", "/authors.svg?input=repo.csv&top=3",
+             "/hotgraph.png?input=repo.csv&max_nodes=10&layout=spring"]
+    # 複数のスレッドで同時に描画する
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(fetch, paths * 2))
+    # svg には描画ごとに変わる id が、hotgraph には現在時刻による重みが入るので plot だけを比べる
+    assert results[0] == results[3]
+    assert [t for (t, _) in results[:3]] == ["image/png", "image/svg+xml", "image/png"]
+    assert results[0][1].startswith(b"\x89PNG")
+    assert b"<svg" in results[1][1]
+    assert get(server, "/plot.gif?input=repo.csv")[0] == 404
+
+
+def test_server_does_not_import_cli():
+    code = ('import sys; sys.path.insert(0, "./src"); import gilot.server; '
+            'print("gilot.app" in sys.modules)')
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,87 @@
+import json
+import pstats
+import sys
+
+import gilot
+from gilot.app import main, parser
+from gilot.core import Duration
+from gilot.timings import collect, stage, timed
+
+
+def test_collect_records_nested_stages():
+    @timed("double")
+    def double(values):
+        return values + values
+
+    with collect() as timings:
+        with stage("outer", rows_in=3) as outer:
+            double([1, 2, 3])
+            outer.rows_out = 6
+    assert [(s.name, s.depth, s.rows_in, s.rows_out) for s in timings.stages] == [
+        ("outer", 0, 3, 6), ("double", 1, 3, 6)]
+    assert timings.stages[0].seconds >= timings.stages[1].seconds
+    assert timings.seconds(depth=0).keys() == {"outer"}
+    assert [s["name"] for s in json.loads(timings.to_json())["stages"]] == ["outer", "double"]
+    assert "double" in timings.format_table()
+
+
+def test_nested_collect_forwards_stages():
+    with collect() as outer:
+        with stage("command"):
+            with collect() as inner:
+                with stage("load"):
+                    pass
+    assert inner.seconds(depth=0).keys() == {"load"}
+    assert [(s.name, s.depth) for s in outer.stages] == [("command", 0), ("load", 1)]
+
+
+def test_stage_without_collect():
+    with stage("ignored") as timing:
+        pass
+    assert timing is None
+    with collect() as timings:
+        pass
+    assert timings.stages == []
+
+
+def test_reset_peak_rss_only_on_request(monkeypatch):
+    calls = []
+    monkeypatch.setattr(gilot.timings, "_reset_peak_rss", lambda: calls.append(1))
+    with collect():
+        with stage("library"):
+            pass
+    assert calls == []
+    with collect(reset_peak_rss=True):
+        with stage("command"):
+            # 内側の collect も外側に従う
+            with collect():
+                with stage("load"):
+                    pass
+    assert len(calls) == 2
+
+
+def test_pipeline_stages(tempdir):
+    df = gilot.from_dir("./", full=True, duration=Duration.months(60))
+    df.to_csv("./temp/self.csv")
+    with collect() as timings:
+        expanded = gilot.from_csvs(["./temp/self.csv"]).expand_files()
+        gilot.get_hotspots(expanded)
+    names = [s.name for s in timings.stages]
+    assert names[0] == "from_csvs" and "expand_files" in names and "get_hotspots" in names
+    hotspot = next(s for s in timings.stages if s.name == "get_hotspots")
+    assert hotspot.rows_in == len(expanded)
+    assert hotspot.peak_rss_mib is None or hotspot.peak_rss_mib > 0
+
+
+def test_cli_timings_and_profile(tempdir, monkeypatch):
+    log = parser.parse_args(["log", "./", "--full", "--output", "temp/self.csv", "--month", "60"])
+    log.handler(log)
+    monkeypatch.setattr(sys, "argv", [
+        "gilot", "hotspot", "-i", "temp/self.csv",
+        "--timings", "temp/timings.json", "--profile", "temp/hotspot.prof"])
+    main()
+    with open("temp/timings.json") as f:
+        stages = json.load(f)["stages"]
+    assert stages[0]["name"] == "hotspot" and stages[0]["depth"] == 0
+    assert {"from_csvs", "expand_files", "get_hotspots"} <= {s["name"] for s in stages}
+    assert pstats.Stats("temp/hotspot.prof").total_calls > 0